@@ -4,12 +4,150 @@ This module provides endpoints for adding, verifying, updating, and deleting fac
 using a DeepFace service implementation.
 """
 
-from flask import Flask, jsonify, request
+import hmac
+import os
+import time
+
+from flask import Flask, g, jsonify, request
+from pymongo import errors
+from src import deadline, logs, memory, metrics, profiling, tracing
+from src.admission import InferenceGate, Overloaded
+from src.attendance import AttendanceRecorder
 from src.deepface_service import DeepFaceService
+from src.staging import EmbeddingStage
 
 app = Flask(__name__)
+logs.configure()
+
+staged_faces = EmbeddingStage(
+    ttl=float(os.environ.get("STAGED_FACE_TTL", "300")),
+    max_entries=int(os.environ.get("STAGED_FACE_LIMIT", "256")),
+)
+
+df = DeepFaceService(staged_faces)
+
+attendance_recorder = AttendanceRecorder(df.db, os.environ.get("SITE_TIMEZONE", "UTC"))
+
+inference_gate = InferenceGate(
+    concurrency=int(os.environ.get("INFERENCE_CONCURRENCY", "1")),
+    queue_depth=int(os.environ.get("INFERENCE_QUEUE_DEPTH", "8")),
+    queue_timeout=float(os.environ.get("INFERENCE_QUEUE_TIMEOUT", "10")),
+)
+
+avoided_work = deadline.AvoidedWork()
+
+memory_guard = memory.MemoryGuard(
+    memory.budget_from_env(),
+    shed_fraction=float(os.environ.get("MEMORY_SHED_FRACTION", "0.9")),
+)
+memory_guard.on_pressure(staged_faces.clear)
+memory_guard.on_pressure(df.shed_caches)
+
+# Profiling is only reachable with this token; unset, /profile does not exist
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_STARTUP = os.environ.get("PROFILE_STARTUP", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# Routes whose first request is profiled with PROFILE_STARTUP
+RECOGNITION_ROUTES = ("/faces/verify", "/signins", "/faces/identify")
+profiler = profiling.Profiler(
+    os.environ.get("PROFILE_DIR", "profiles"),
+    interval=float(os.environ.get("PROFILE_INTERVAL", str(profiling.DEFAULT_INTERVAL))),
+)
+
+
+@app.before_request
+def start_timer():
+    """Note when the request started and continue the caller's trace."""
+    g.started = time.perf_counter()
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    g.trace_span = tracing.enter(
+        f"{request.method} {route}", request.headers.get(tracing.TRACEPARENT)
+    )
+
+
+@app.before_request
+def start_profile():
+    """Profile this request if a profile of its route is wanted."""
+    if profiler.active:
+        profiler.enter(request.url_rule.rule if request.url_rule else None)
+
+
+@app.teardown_request
+def end_profile(_error=None):
+    """Stop profiling this request's thread."""
+    if profiler.active:
+        profiler.exit()
+
+
+@app.after_request
+def observe_request(response):
+    """Record the request's duration under its route, method and status."""
+    if "started" in g:
+        metrics.REQUEST_SECONDS.observe(
+            time.perf_counter() - g.started,
+            request.url_rule.rule if request.url_rule else "unmatched",
+            request.method,
+            str(response.status_code),
+        )
+    span = tracing.current()
+    if span is not None:
+        span.attributes["status"] = response.status_code
+    return response
+
+
+@app.teardown_request
+def end_trace(error=None):
+    """End the request's trace span."""
+    span = g.pop("trace_span", None)
+    if span is not None:
+        if error is not None:
+            tracing.leave(span, error=type(error).__name__)
+        else:
+            tracing.leave(span)
+
+
+@app.before_request
+def start_deadline():
+    """Adopt the caller's remaining time budget for this request."""
+    deadline.current.set(
+        deadline.Deadline.from_header(request.headers.get(deadline.DEADLINE_HEADER))
+    )
+
+
+@app.errorhandler(deadline.DeadlineExceeded)
+def deadline_exceeded(error):
+    """Drop work whose caller has already given up."""
+    avoided_work.record(error.stage)
+    return jsonify({"success": False, "message": str(error)}), 504
+
+
+@app.before_request
+def check_memory():
+    """Shed caches if the process is close to its memory budget."""
+    memory_guard.check()
 
-df = DeepFaceService()
+
+@app.errorhandler(memory.MemoryBudgetExceeded)
+def memory_budget_exceeded(error):
+    """Refuse requests that would grow the service over its memory budget."""
+    return (
+        jsonify({"success": False, "busy": True, "message": str(error)}),
+        503,
+        {"Retry-After": str(error.retry_after)},
+    )
+
+
+@app.errorhandler(Overloaded)
+def overloaded(error):
+    """Reject inference requests that could not be admitted."""
+    return (
+        jsonify({"success": False, "busy": True, "message": str(error)}),
+        503,
+        {"Retry-After": str(error.retry_after)},
+    )
 
 
 @app.route("/")
@@ -18,34 +156,280 @@ def index():
     return "Welcome to the Machine Learning Client"
 
 
+@app.route("/stats")
+def stats():
+    """Return inference queue, deadline and staging statistics as JSON."""
+    return jsonify(
+        {
+            "inference": inference_gate.stats(),
+            "deadlines": avoided_work.stats(),
+            "staged_faces": staged_faces.stats(),
+        }
+    )
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Return stage, endpoint, gallery and cache metrics for Prometheus."""
+    inference = inference_gate.stats()
+    staged = staged_faces.stats()
+    families = [
+        metrics.render_histograms(),
+        metrics.family(
+            "deepface_inference_in_flight",
+            "gauge",
+            "Inference requests running now.",
+            [("", {}, inference["in_flight"])],
+        ),
+        metrics.family(
+            "deepface_inference_queue_depth",
+            "gauge",
+            "Inference requests waiting for a slot.",
+            [("", {}, inference["queue_depth"])],
+        ),
+        metrics.family(
+            "deepface_inference_admitted_total",
+            "counter",
+            "Inference requests admitted.",
+            [("", {}, inference["admitted"])],
+        ),
+        metrics.family(
+            "deepface_inference_rejected_total",
+            "counter",
+            "Inference requests turned away, by reason.",
+            [("", {"reason": k}, v) for k, v in sorted(inference["rejected"].items())],
+        ),
+        metrics.family(
+            "deepface_deadline_dropped_total",
+            "counter",
+            "Requests dropped because their caller's deadline passed, by stage.",
+            [
+                ("", {"stage": k}, v)
+                for k, v in sorted(avoided_work.stats()["dropped"].items())
+            ],
+        ),
+        metrics.family(
+            "deepface_staged_embeddings",
+            "gauge",
+            "Embeddings held in the enrollment staging cache.",
+            [("", {}, staged["entries"])],
+        ),
+        metrics.family(
+            "deepface_staged_embeddings_total",
+            "counter",
+            "Staging cache events: staged, used, expired and evicted.",
+            [
+                ("", {"event": event}, staged[event])
+                for event in ("staged", "used", "expired", "evicted")
+            ],
+        ),
+    ]
+    try:
+        sizes = df.gallery_size()
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        app.logger.warning("gallery size unavailable: %s", e)
+        sizes = {}
+    families.append(
+        metrics.family(
+            "deepface_gallery_faces",
+            "gauge",
+            "Enrolled faces, per local gallery shard or in MongoDB ('all').",
+            [("", {"shard": shard}, count) for shard, count in sorted(sizes.items())],
+        )
+    )
+    usage = df.memory_usage()
+    guard = memory_guard.stats()
+    families.append(
+        metrics.family(
+            "deepface_memory_bytes",
+            "gauge",
+            "Resident set size, and estimates of what the service holds in it.",
+            [
+                ("", {"kind": "rss"}, memory.rss_bytes()),
+                ("", {"kind": "gallery"}, usage["gallery_bytes"]),
+                ("", {"kind": "staged"}, usage["staged_bytes"]),
+            ]
+            + [
+                ("", {"kind": f"model_{key[:-6]}"}, value)
+                for key, value in sorted((usage["model"] or {}).items())
+                if value is not None
+            ],
+        )
+    )
+    if guard["budget_bytes"] is not None:
+        families.append(
+            metrics.family(
+                "deepface_memory_budget_bytes",
+                "gauge",
+                "Memory budget enforced by the service.",
+                [("", {}, guard["budget_bytes"])],
+            )
+        )
+    families.append(
+        metrics.family(
+            "deepface_memory_guard_total",
+            "counter",
+            "Memory guard events: caches shed and growth refused.",
+            [
+                ("", {"event": "shed"}, guard["sheds"]),
+                ("", {"event": "refused"}, guard["refused"]),
+            ],
+        )
+    )
+    if "MODEL_LOAD_SECONDS" in app.config:
+        families.append(
+            metrics.family(
+                "deepface_model_load_seconds",
+                "gauge",
+                "Time taken to load the Facenet model at startup.",
+                [("", {}, app.config["MODEL_LOAD_SECONDS"])],
+            )
+        )
+    return "".join(families), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+
+def _invalid_sites(json_data):
+    """Return a 400 response if the optional 'sites' field is malformed."""
+    sites = json_data.get("sites")
+    if sites is None or (
+        isinstance(sites, list) and all(isinstance(s, str) and s for s in sites)
+    ):
+        return None
+    return (
+        jsonify({"success": False, "message": "sites must be a list of site names"}),
+        400,
+    )
+
+
+def _unauthorized():
+    """Return a 404 or 403 response unless the request has ``PROFILE_TOKEN``."""
+    if not PROFILE_TOKEN:
+        return jsonify({"success": False, "message": "Not found"}), 404
+    if not hmac.compare_digest(
+        request.headers.get("X-Profile-Token", ""), PROFILE_TOKEN
+    ):
+        return jsonify({"success": False, "message": "Forbidden"}), 403
+    return None
+
+
+@app.route("/profile", methods=["GET", "POST"])
+def profile():
+    """
+    Start a sampling profile, or report on the running one.
+
+    Needs the ``X-Profile-Token`` header to match ``PROFILE_TOKEN``. A POST
+    with ``route`` and ``requests`` profiles the next requests to that route
+    pattern; one with ``seconds`` profiles every thread for that long. Wall
+    and CPU flamegraph input is written to ``PROFILE_DIR``.
+    """
+    unauthorized = _unauthorized()
+    if unauthorized:
+        return unauthorized
+    if request.method == "POST":
+        options = request.get_json(silent=True) or {}
+        route = options.get("route") or None
+        try:
+            profiler.start(
+                options.get("name") or route or "window",
+                routes=(route,) if route else None,
+                requests=int(options.get("requests") or 0) or None,
+                seconds=float(options.get("seconds") or 0) or None,
+            )
+        except ValueError as error:
+            return jsonify({"success": False, "message": str(error)}), 400
+    return jsonify(profiler.status())
+
+
+@app.route("/memory")
+def memory_report():
+    """
+    Return the process's memory use, budget and the service's largest holders.
+
+    Needs the ``X-Profile-Token`` header, like ``/profile``. While
+    ``tracemalloc`` runs (see ``/memory/tracemalloc``), also lists the Python
+    allocations that grew most since it started.
+    """
+    unauthorized = _unauthorized()
+    if unauthorized:
+        return unauthorized
+    report = {
+        "rss_bytes": memory.rss_bytes(),
+        "peak_rss_bytes": memory.peak_rss_bytes(),
+        "limit_bytes": memory.cgroup_limit_bytes(),
+        "guard": memory_guard.stats(),
+        **df.memory_usage(),
+    }
+    allocations = memory.allocations(request.args.get("limit", 20, type=int))
+    if allocations["tracing"]:
+        report["allocations"] = allocations
+    return jsonify(report)
+
+
+@app.route("/memory/tracemalloc", methods=["POST"])
+def memory_tracing():
+    """
+    Start or stop ``tracemalloc``; it slows every allocation while it runs.
+
+    Needs the ``X-Profile-Token`` header, and a JSON ``action`` of ``start``
+    or ``stop``.
+    """
+    unauthorized = _unauthorized()
+    if unauthorized:
+        return unauthorized
+    action = (request.get_json(silent=True) or {}).get("action")
+    if action == "start":
+        memory.start_tracing()
+    elif action == "stop":
+        memory.stop_tracing()
+    else:
+        return (
+            jsonify({"success": False, "message": "action must be start or stop"}),
+            400,
+        )
+    return jsonify({"success": True, "tracing": action == "start"})
+
+
 @app.route("/faces", methods=["POST"])
+@inference_gate.admit
 def add_face():
     """Add a new face to the database.
 
-    Requires a JSON payload with 'img' (base64 image) and 'name' fields.
+    Requires a JSON payload with 'img' (base64 image) and 'name' fields, and
+    optionally 'sites' (list of site names whose gates may match the face).
+    Instead of 'img', 'token' may name an embedding staged by a verify call.
     """
     json_data = request.get_json()
 
-    if "img" not in json_data or "name" not in json_data:
+    if ("img" not in json_data and "token" not in json_data) or (
+        "name" not in json_data
+    ):
         return (
             jsonify(
                 {"success": False, "message": "Missing required fields (img, name)"}
             ),
             400,
         )
+    invalid = _invalid_sites(json_data)
+    if invalid:
+        return invalid
 
-    img = json_data["img"]
+    memory_guard.reserve()
+    img = json_data.get("img")
     name = json_data["name"]
-    res = df.add_face(img, name)
+    res = df.add_face(img, name, json_data.get("sites"), json_data.get("token"))
 
     return res, 201
 
 
 @app.route("/faces/verify", methods=["POST"])
+@inference_gate.admit
 def verify_face():
     """Verify a face against stored faces in the database.
 
-    Requires a JSON payload with 'img' (base64 image) field.
+    Requires a JSON payload with 'img' (base64 image) field, and optionally
+    'site' to match only faces tagged with that site. With 'stage' true the
+    response has a 'token' for the embedding, usable by a following add or
+    update instead of the image.
     """
     json_data = request.get_json()
 
@@ -56,11 +440,112 @@ def verify_face():
         )
 
     img = json_data["img"]
-    res = df.verify_face(img)
+    # Over the memory budget, verify still answers but stages nothing
+    stage = bool(json_data.get("stage")) and memory_guard.allow_growth()
+    res = df.verify_face(img, json_data.get("site") or None, stage)
 
     return res, 200
 
 
+def _attendance_unavailable(error):
+    """Reply 503 when faces were recognised but attendance could not be saved."""
+    app.logger.warning("attendance write failed: %s", error)
+    return (
+        jsonify({"success": False, "message": f"Error recording attendance: {error}"}),
+        503,
+    )
+
+
+@app.route("/signins", methods=["POST"])
+@inference_gate.admit
+def record_signin():
+    """Verify a face and record today's attendance in one call.
+
+    Requires a JSON payload with 'img' (base64 image) field, and optionally
+    'site'. The verify result gains 'first' and 'attendance_id' when the face
+    is recognised. The Server-Timing header breaks down where the time went.
+    """
+    json_data = request.get_json()
+
+    if "img" not in json_data:
+        return (
+            jsonify({"success": False, "message": "Missing required fields (img)"}),
+            400,
+        )
+
+    started = time.perf_counter()
+    res = df.verify_face(json_data["img"], json_data.get("site") or None)
+    verified = time.perf_counter()
+    if res.get("success") and res.get("verified"):
+        try:
+            res.update(attendance_recorder.record(res["match"]["_id"]))
+        except errors.PyMongoError as e:
+            return _attendance_unavailable(e)
+    recorded = time.perf_counter()
+
+    timing = (
+        f"verify;dur={(verified - started) * 1000:.1f}, "
+        f"record;dur={(recorded - verified) * 1000:.1f}"
+    )
+    return res, 200, {"Server-Timing": timing}
+
+
+@app.route("/faces/detect", methods=["POST"])
+@inference_gate.admit
+def detect_faces():
+    """Locate the faces in one image without embedding them.
+
+    Requires a JSON payload with 'img' (base64 image) field. Used to track
+    faces across streamed kiosk frames before paying for recognition.
+    """
+    json_data = request.get_json()
+
+    if "img" not in json_data:
+        return (
+            jsonify({"success": False, "message": "Missing required fields (img)"}),
+            400,
+        )
+
+    return df.detect_faces(json_data["img"]), 200
+
+
+@app.route("/faces/identify", methods=["POST"])
+@inference_gate.admit
+def identify_faces():
+    """Identify every face in one image, optionally recording attendance.
+
+    Requires a JSON payload with 'img' (base64 image) field, and optionally
+    'site' and 'record'. Each result in 'faces' has the face's 'box'; with
+    'record', recognised faces also get 'first' and 'attendance_id', written
+    in one bulk write. The Server-Timing header breaks down where the time went.
+    """
+    json_data = request.get_json()
+
+    if "img" not in json_data:
+        return (
+            jsonify({"success": False, "message": "Missing required fields (img)"}),
+            400,
+        )
+
+    started = time.perf_counter()
+    res = df.identify_faces(json_data["img"], json_data.get("site") or None)
+    identified = time.perf_counter()
+    timing = f"identify;dur={(identified - started) * 1000:.1f}"
+    if res.get("success") and json_data.get("record"):
+        recognised = [face for face in res["faces"] if face["verified"]]
+        try:
+            recorded = attendance_recorder.record_many(
+                [face["match"]["_id"] for face in recognised]
+            )
+        except errors.PyMongoError as e:
+            return _attendance_unavailable(e)
+        for face in recognised:
+            face.update(recorded[face["match"]["_id"]])
+        timing += f", record;dur={(time.perf_counter() - identified) * 1000:.1f}"
+
+    return res, 200, {"Server-Timing": timing}
+
+
 @app.route("/faces/<face_id>", methods=["DELETE"])
 def delete_face(face_id):
     """Delete a face from the database by its ID.
@@ -74,31 +559,47 @@ def delete_face(face_id):
 
 
 @app.route("/faces/<face_id>", methods=["PUT"])
+@inference_gate.admit
 def update_face(face_id):
     """Update an existing face in the database.
 
     Args:
         face_id: The ID of the face to update.
 
-    Requires a JSON payload with 'img' (base64 image) and 'name' fields.
+    Requires a JSON payload with 'img' (base64 image) and 'name' fields, and
+    optionally 'sites' to replace the face's sites. Instead of 'img', 'token'
+    may name an embedding staged by a verify call.
     """
     json_data = request.get_json()
 
-    if "img" not in json_data or "name" not in json_data:
+    if ("img" not in json_data and "token" not in json_data) or (
+        "name" not in json_data
+    ):
         return (
             jsonify(
                 {"success": False, "message": "Missing required fields (img, name)"}
             ),
             400,
         )
+    invalid = _invalid_sites(json_data)
+    if invalid:
+        return invalid
 
-    img = json_data["img"]
+    img = json_data.get("img")
     name = json_data["name"]
 
-    res = df.replace_face(img, name, face_id)
+    res = df.replace_face(
+        img, name, face_id, json_data.get("sites"), json_data.get("token")
+    )
 
     return res, 200
 
 
 if __name__ == "__main__":
+    if PROFILE_STARTUP:
+        with profiler.block("startup-model-load"):
+            app.config["MODEL_LOAD_SECONDS"] = df.warm_up()
+        profiler.start("startup-first-inference", routes=RECOGNITION_ROUTES, requests=1)
+    else:
+        app.config["MODEL_LOAD_SECONDS"] = df.warm_up()
     app.run(host="0.0.0.0", port=5005)
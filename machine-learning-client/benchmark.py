@@ -0,0 +1,588 @@
+"""
+Gallery-scale benchmark for ``DeepFaceService`` search, enrollment and deletion.
+
+Measures how ``verify_face``, ``add_face`` and ``delete_face`` scale with the
+number of enrolled faces, in each gallery mode: ``scan`` (no ``GALLERY_SHARDS``,
+every verify reads and compares all faces) and ``local:N`` (N in-process
+shards). Runs offline on a CPU-only machine::
+
+    python benchmark.py run --out results.json
+    python benchmark.py run --sizes 1000,10000 --modes local:1 --save-baseline base.json
+    python benchmark.py run --sizes 1000,10000 --modes local:1 --baseline base.json
+
+Nothing outside the process is used. DeepFace is replaced by a stand-in whose
+"images" are keys of precomputed embeddings, so timings cover everything but
+the Facenet forward pass. MongoDB is replaced by an in-memory collection. The
+embeddings are synthetic and Facenet-like: 128 dimensions, with different
+people about 16 apart and two captures of one person about 6 apart, either side
+of the default ``DEEPFACE_THRESHOLD`` of 10.
+
+Each gallery size and mode runs in its own process, so its memory figures
+start from a clean interpreter and an out-of-memory 1M run only fails that
+case. For each case ``run`` reports:
+
+* ``load_ms``: building the service, which fills local shards;
+* ``first_verify_ms``: the first verify, which builds the search matrix;
+* ``verify_*_ms`` percentiles, sequential, and ``throughput_qps`` with
+  ``--concurrency`` threads; ``hit_rate`` checks the right face was found;
+* ``add_*_ms`` and ``delete_*_ms``, and ``verify_after_add_*_ms``, a verify
+  right after an enrollment, which pays for rebuilding the matrix;
+* ``rss_growth_bytes`` and ``bytes_per_face``: the resident set's growth from
+  before the gallery was generated, which includes the stand-in's documents
+  (local shards share their embeddings), and ``gallery_bytes``, the service's
+  own estimate (see ``GET /memory``).
+
+Stored embeddings are Python lists, as pymongo returns them, unless
+``--vectors array`` stores float32 arrays. The 1M case needs about 10 GB of
+memory with lists and 4.5 GB with arrays. ``scan`` is skipped above
+``--scan-limit`` faces.
+
+The report is JSON. With ``--baseline``, every latency and memory figure of a
+case that was also in the baseline is compared with it. Figures more than
+``--tolerance`` (25%) worse are listed under ``regressions`` and the command
+exits with status 1. Baselines only compare runs on the same machine.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import numpy as np
+
+from src import memory
+
+DIMS = 128
+# Different people are about 16 apart, captures of one person about 6
+IDENTITY_SCALE = 1.0
+PROBE_NOISE = 0.5
+THRESHOLD = 10
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+DEFAULT_MODES = ("scan", "local:1", "local:4")
+SCAN_LIMIT = 100_000
+TOLERANCE = 0.25
+# Latency changes smaller than this are noise, whatever the percentage
+NOISE_FLOOR_MS = 0.1
+# Figures compared with the baseline; lower is better for all of them
+COMPARED = (
+    "load_ms",
+    "first_verify_ms",
+    "verify_p50_ms",
+    "verify_p95_ms",
+    "verify_after_add_p50_ms",
+    "add_p50_ms",
+    "delete_p50_ms",
+    "bytes_per_face",
+)
+
+
+class StubDeepFace:
+    """Stands in for ``DeepFace``: an image is the key of its embedding."""
+
+    embeddings = {}
+
+    @classmethod
+    def represent(cls, img_path, **_options):
+        """Return the embedding registered under ``img_path`` as one face."""
+        return [
+            {
+                "embedding": cls.embeddings[img_path],
+                "facial_area": {"x": 0, "y": 0, "w": 160, "h": 160},
+            }
+        ]
+
+    @staticmethod
+    def build_model(_model_name):
+        """Return no model; there is nothing to load."""
+        return None
+
+
+def _matches(doc, query):
+    for key, wanted in query.items():
+        value = doc.get(key)
+        if value != wanted and not (isinstance(value, list) and wanted in value):
+            return False
+    return True
+
+
+class InMemoryCollection:
+    """
+    The part of a pymongo collection ``DeepFaceService`` uses, held in a dict.
+
+    Ids are 24-digit hex strings. ``find`` returns the stored documents
+    themselves, so unlike MongoDB it costs no decoding or copying.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs = {}
+        self._next_id = 0
+
+    def _new_id(self):
+        self._next_id += 1
+        return f"{self._next_id:024x}"
+
+    def insert_one(self, doc):
+        """Store a copy of ``doc`` under a new ``_id``."""
+        with self._lock:
+            face_id = self._new_id()
+            self._docs[face_id] = dict(doc, _id=face_id)
+        return types.SimpleNamespace(inserted_id=face_id)
+
+    def insert_many(self, docs):
+        """Store each of ``docs`` under a new ``_id``."""
+        with self._lock:
+            for doc in docs:
+                face_id = self._new_id()
+                self._docs[face_id] = dict(doc, _id=face_id)
+
+    def find(self, query=None, _projection=None):
+        """Return the documents matching ``query``."""
+        with self._lock:
+            docs = list(self._docs.values())
+        return [doc for doc in docs if _matches(doc, query)] if query else docs
+
+    def find_one(self, query):
+        """Return the first document matching ``query``, or None."""
+        with self._lock:
+            if "_id" in query:
+                doc = self._docs.get(str(query["_id"]))
+                return doc if doc is not None and _matches(doc, query) else None
+        return next(iter(self.find(query)), None)
+
+    def update_one(self, query, update):
+        """Apply ``update["$set"]`` to the first document matching ``query``."""
+        doc = self.find_one(query)
+        if doc is not None:
+            with self._lock:
+                doc.update(update["$set"])
+        return types.SimpleNamespace(modified_count=int(doc is not None))
+
+    def delete_one(self, query):
+        """Delete the first document matching ``query``."""
+        doc = self.find_one(query)
+        if doc is not None:
+            with self._lock:
+                self._docs.pop(doc["_id"], None)
+        return types.SimpleNamespace(deleted_count=int(doc is not None))
+
+    def delete_many(self, query):
+        """Delete every document matching ``query``."""
+        doomed = [doc["_id"] for doc in self.find(query)]
+        with self._lock:
+            for face_id in doomed:
+                self._docs.pop(face_id, None)
+        return types.SimpleNamespace(deleted_count=len(doomed))
+
+    def estimated_document_count(self):
+        """Return the number of documents."""
+        with self._lock:
+            return len(self._docs)
+
+
+class InMemoryClient:  # pylint: disable=too-few-public-methods
+    """Stands in for ``MongoClient`` with one in-memory ``smart_gate`` database."""
+
+    def __init__(self):
+        self.database = types.SimpleNamespace(
+            faces=InMemoryCollection(), attendance=InMemoryCollection()
+        )
+
+    def __getitem__(self, _name):
+        return self.database
+
+
+def _import_service():
+    """Import ``src.deepface_service`` without TensorFlow or OpenCV."""
+    if "deepface" not in sys.modules:
+        stub = types.ModuleType("deepface")
+        stub.DeepFace = StubDeepFace
+        sys.modules["deepface"] = stub
+    try:
+        import cv2  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        # Only used to decode data: URLs, which the benchmark never sends
+        sys.modules["cv2"] = types.ModuleType("cv2")
+    # pylint: disable-next=import-outside-toplevel
+    from src import deepface_service
+
+    return deepface_service
+
+
+def _people(size, seed):
+    """Return ``size`` synthetic identities, one float32 row each."""
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((size, DIMS), dtype=np.float32) * IDENTITY_SCALE
+
+
+def _capture(rng, person):
+    """Return another capture of ``person``: its identity plus noise."""
+    return (person + rng.standard_normal(DIMS) * PROBE_NOISE).tolist()
+
+
+def _seed(collection, people, vectors):
+    chunk = 10_000
+    for start in range(0, len(people), chunk):
+        rows = people[start : start + chunk]
+        collection.insert_many(
+            {
+                "name": f"Person {start + i}",
+                "img_vectors": row.tolist() if vectors == "list" else row,
+            }
+            for i, row in enumerate(rows)
+        )
+
+
+def _timed(operation, count, max_seconds):
+    """Call ``operation(i)`` up to ``count`` times, or until ``max_seconds``."""
+    seconds = []
+    budget_end = time.perf_counter() + max_seconds
+    for i in range(count):
+        started = time.perf_counter()
+        operation(i)
+        seconds.append(time.perf_counter() - started)
+        if len(seconds) >= 3 and time.perf_counter() > budget_end:
+            break
+    return seconds
+
+
+def _summary(prefix, seconds):
+    ordered = sorted(seconds)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    return {
+        f"{prefix}_count": len(ordered),
+        f"{prefix}_p50_ms": round(percentile(0.50) * 1000, 3),
+        f"{prefix}_p95_ms": round(percentile(0.95) * 1000, 3),
+        f"{prefix}_p99_ms": round(percentile(0.99) * 1000, 3),
+    }
+
+
+# pylint: disable-next=too-many-arguments,too-many-locals,too-many-statements
+def run_case(
+    mode,
+    size,
+    *,
+    queries=200,
+    writes=50,
+    concurrency=4,
+    vectors="list",
+    seed=0,
+    max_seconds=20.0,
+):
+    """
+    Benchmark one gallery mode at one gallery size in this process.
+
+    Args:
+        mode (str): ``scan``, or ``local:N`` for N in-process shards.
+        size (int): Number of enrolled faces.
+        queries (int): Verify calls timed, sequentially and then concurrently.
+        writes (int): Faces added, each followed by a verify, then deleted.
+        concurrency (int): Threads verifying at once for ``throughput_qps``.
+        vectors (str): ``list`` or ``array``; how embeddings are stored.
+        seed (int): Seed of the synthetic embeddings.
+        max_seconds (float): Stop a phase after this long, once it has at
+            least three samples.
+
+    Returns:
+        dict: The case's parameters and figures (see the module docstring).
+    """
+    service_module = _import_service()
+    rss_before = memory.rss_bytes()
+    people = _people(size, seed)
+    client = InMemoryClient()
+    _seed(client.database.faces, people, vectors)
+    rng = np.random.default_rng(seed + 1)
+    stub = StubDeepFace.embeddings
+    stub.clear()
+    # Probe random enrolled people; the identities are not kept in memory
+    wanted = rng.integers(0, size, queries)
+    for i, person in enumerate(wanted):
+        stub[f"probe:{i}"] = _capture(rng, people[person])
+    ids = [doc["_id"] for doc in client.database.faces.find()]
+    expected = [ids[person] for person in wanted]
+    del people, ids
+
+    environment = {"DEEPFACE_THRESHOLD": str(THRESHOLD), "GALLERY_SHARDS": ""}
+    if mode != "scan":
+        environment["GALLERY_SHARDS"] = mode
+    with patch.dict(os.environ, environment), patch.multiple(
+        service_module,
+        DeepFace=StubDeepFace,
+        MongoClient=lambda _uri: client,
+        ObjectId=str,
+        load_dotenv=lambda: None,
+    ):
+        started = time.perf_counter()
+        service = service_module.DeepFaceService()
+        result = {
+            "mode": mode,
+            "size": size,
+            "vectors": vectors,
+            "load_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+
+        hits = []
+
+        def verify(i):
+            match = service.verify_face(f"probe:{i}").get("match") or {}
+            hits.append(match.get("_id") == expected[i])
+
+        result["first_verify_ms"] = round(_timed(verify, 1, 0)[0] * 1000, 3)
+        result.update(_summary("verify", _timed(verify, queries, max_seconds)))
+        result["hit_rate"] = round(sum(hits) / len(hits), 4)
+
+        budget_end = time.perf_counter() + max_seconds
+
+        def verify_in_budget(i):
+            if time.perf_counter() > budget_end:
+                return 0
+            verify(i)
+            return 1
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            started = time.perf_counter()
+            done = sum(pool.map(verify_in_budget, range(queries)))
+            elapsed = time.perf_counter() - started
+        result["concurrency"] = concurrency
+        result["throughput_qps"] = round(done / elapsed, 1) if done else 0.0
+
+        usage = service.memory_usage()
+        rss = memory.rss_bytes()
+        result.update(
+            {
+                "rss_bytes": rss,
+                "peak_rss_bytes": memory.peak_rss_bytes(),
+                "rss_growth_bytes": rss - rss_before,
+                "bytes_per_face": round((rss - rss_before) / size),
+                "gallery_bytes": usage["gallery_bytes"],
+            }
+        )
+
+        added = []
+        adds = []
+        after_add = []
+
+        def add(i):
+            stub[f"enroll:{i}"] = _capture(rng, rng.standard_normal(DIMS))
+            started = time.perf_counter()
+            added.append(service.add_face(f"enroll:{i}", f"Enrolled {i}")["face_id"])
+            adds.append(time.perf_counter() - started)
+            after_add.extend(_timed(verify, 1, 0))
+
+        _timed(add, writes, max_seconds)
+        result.update(_summary("add", adds))
+        result.update(_summary("verify_after_add", after_add))
+        result.update(
+            _summary(
+                "delete",
+                _timed(lambda i: service.delete_face(added[i]), len(added), 1e9),
+            )
+        )
+    stub.clear()
+    return result
+
+
+def _run_isolated(mode, size, options):
+    """Run one case in a fresh interpreter and return its result."""
+    command = [sys.executable, os.path.abspath(__file__), "case"]
+    command += ["--mode", mode, "--size", str(size)]
+    for name, value in options.items():
+        command += [f"--{name.replace('_', '-')}", str(value)]
+    completed = subprocess.run(
+        command,
+        capture_output=True,
+        text=True,
+        check=False,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if completed.returncode != 0:
+        return {
+            "mode": mode,
+            "size": size,
+            "error": completed.stderr.strip().splitlines()[-1:]
+            or [f"exited with status {completed.returncode}"],
+        }
+    return json.loads(completed.stdout)
+
+
+# pylint: disable-next=too-many-arguments
+def run_suite(sizes, modes, *, scan_limit=SCAN_LIMIT, isolate=True, **options):
+    """
+    Benchmark every mode at every size.
+
+    Args:
+        sizes (list): Gallery sizes, e.g. ``[1000, 10000]``.
+        modes (list): Gallery modes, e.g. ``["scan", "local:4"]``.
+        scan_limit (int): Skip ``scan`` above this many faces.
+        isolate (bool): Run each case in its own process.
+        **options: Passed to ``run_case``.
+
+    Returns:
+        dict: ``environment``, ``parameters`` and ``results``, one per case.
+    """
+    results = []
+    for size in sizes:
+        for mode in modes:
+            if mode == "scan" and size > scan_limit:
+                results.append(
+                    {"mode": mode, "size": size, "skipped": "above --scan-limit"}
+                )
+            elif isolate:
+                results.append(_run_isolated(mode, size, options))
+            else:
+                results.append(run_case(mode, size, **options))
+    return {
+        "benchmark": "deepface-gallery",
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "parameters": {"sizes": list(sizes), "modes": list(modes), **options},
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    """
+    Return the figures of ``report`` that are worse than in ``baseline``.
+
+    Args:
+        report (dict): A ``run_suite`` report.
+        baseline (dict): An earlier report of the same benchmark.
+        tolerance (float): Allowed slowdown or growth, 0.25 for 25%.
+
+    Returns:
+        list: One ``{"mode", "size", "metric", "baseline", "current",
+        "change"}`` per regression, ``change`` being the relative increase.
+    """
+    before = {(case["mode"], case["size"]): case for case in baseline["results"]}
+    regressions = []
+    for case in report["results"]:
+        old = before.get((case["mode"], case["size"]))
+        if old is None:
+            continue
+        for metric in COMPARED:
+            if not old.get(metric) or metric not in case:
+                continue
+            current, previous = case[metric], old[metric]
+            if metric.endswith("_ms") and current - previous < NOISE_FLOOR_MS:
+                continue
+            if current > previous * (1 + tolerance):
+                regressions.append(
+                    {
+                        "mode": case["mode"],
+                        "size": case["size"],
+                        "metric": metric,
+                        "baseline": previous,
+                        "current": current,
+                        "change": round(current / previous - 1, 3),
+                    }
+                )
+    return regressions
+
+
+def _add_case_options(parser):
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--writes", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--vectors", choices=("list", "array"), default="list")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--max-seconds", type=float, default=20.0, help="time limit per phase"
+    )
+
+
+def _case_options(args):
+    return {
+        "queries": args.queries,
+        "writes": args.writes,
+        "concurrency": args.concurrency,
+        "vectors": args.vectors,
+        "seed": args.seed,
+        "max_seconds": args.max_seconds,
+    }
+
+
+def _load(path):
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def _dump(report, path):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+        file.write("\n")
+
+
+def main():
+    """Parse the command line and run the chosen subcommand."""
+    parser = argparse.ArgumentParser(description="DeepFace gallery benchmark")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="benchmark every size and mode")
+    run.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES))
+    run.add_argument("--modes", default=",".join(DEFAULT_MODES))
+    run.add_argument("--scan-limit", type=int, default=SCAN_LIMIT)
+    run.add_argument(
+        "--in-process", action="store_true", help="run every case in this process"
+    )
+    run.add_argument("--out", help="write the report here instead of stdout")
+    run.add_argument("--baseline", help="report to compare against")
+    run.add_argument("--tolerance", type=float, default=TOLERANCE)
+    run.add_argument("--save-baseline", help="also write the report here")
+    _add_case_options(run)
+
+    case = commands.add_parser("case", help="benchmark one size and mode")
+    case.add_argument("--mode", required=True)
+    case.add_argument("--size", type=int, required=True)
+    _add_case_options(case)
+
+    check = commands.add_parser("compare", help="compare two saved reports")
+    check.add_argument("report")
+    check.add_argument("baseline")
+    check.add_argument("--tolerance", type=float, default=TOLERANCE)
+
+    args = parser.parse_args()
+    if args.command == "case":
+        print(json.dumps(run_case(args.mode, args.size, **_case_options(args))))
+        return 0
+    if args.command == "compare":
+        regressions = compare(_load(args.report), _load(args.baseline), args.tolerance)
+        print(json.dumps(regressions, indent=2))
+        return 1 if regressions else 0
+
+    report = run_suite(
+        [int(size) for size in args.sizes.split(",")],
+        [mode.strip() for mode in args.modes.split(",")],
+        scan_limit=args.scan_limit,
+        isolate=not args.in_process,
+        **_case_options(args),
+    )
+    if args.baseline:
+        report["baseline"] = args.baseline
+        report["regressions"] = compare(report, _load(args.baseline), args.tolerance)
+    if args.save_baseline:
+        _dump(report, args.save_baseline)
+    if args.out:
+        _dump(report, args.out)
+    else:
+        print(json.dumps(report, indent=2))
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""Flask application serving one partition of the sharded face gallery.
+
+Run one process or container per shard, each with ``GALLERY_SHARD_INDEX`` and
+``GALLERY_SHARD_COUNT`` set, and list their URLs in the DeepFace service's
+``GALLERY_SHARDS``. A shard loads its faces from MongoDB at startup, receives
+adds, updates and deletes from the DeepFace service, and reloads from MongoDB
+every ``GALLERY_REFRESH_SECONDS`` so it catches up on updates it missed.
+"""
+
+import logging
+import os
+import threading
+
+from dotenv import load_dotenv
+from flask import Flask, jsonify, request
+from pymongo import MongoClient
+from src import logs
+from src.gallery import FACE_PROJECTION, GalleryShard
+
+load_dotenv()
+
+app = Flask(__name__)
+
+shard = GalleryShard(
+    index=int(os.environ.get("GALLERY_SHARD_INDEX", "0")),
+    count=int(os.environ.get("GALLERY_SHARD_COUNT", "1")),
+)
+
+
+def load_partition():
+    """Fill the shard with its faces from MongoDB."""
+    faces = MongoClient(os.environ.get("MONGO_URI"))["smart_gate"].faces
+    shard.load(faces.find({}, FACE_PROJECTION))
+
+
+def refresh_forever(interval):
+    """Reload the shard from MongoDB every ``interval`` seconds."""
+    stop = threading.Event()
+    while not stop.wait(interval):
+        try:
+            load_partition()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.getLogger(__name__).warning("shard reload failed: %s", e)
+
+
+@app.route("/shard/search", methods=["POST"])
+def search():
+    """Return this shard's top-k matches for a probe embedding.
+
+    Requires a JSON payload with 'embedding', or 'embeddings' holding several
+    probes, and optionally 'k' (default 1) and 'site' to search only faces
+    tagged with that site. For 'embeddings', 'matches' holds one list per probe.
+    """
+    json_data = request.get_json()
+
+    if "embedding" not in json_data and "embeddings" not in json_data:
+        return (
+            jsonify(
+                {"success": False, "message": "Missing required fields (embedding)"}
+            ),
+            400,
+        )
+
+    k = int(json_data.get("k", 1))
+    if "embeddings" in json_data:
+        matches = shard.search_many(json_data["embeddings"], k, json_data.get("site"))
+    else:
+        matches = shard.search(json_data["embedding"], k, json_data.get("site"))
+    return jsonify({"shard": [shard.index, shard.count], "matches": matches})
+
+
+@app.route("/shard/faces/<face_id>", methods=["PUT"])
+def upsert_face(face_id):
+    """Add or replace one face on this shard.
+
+    Requires a JSON payload with 'name' and 'embedding' fields, and optionally
+    'sites'.
+    """
+    json_data = request.get_json()
+
+    if "name" not in json_data or "embedding" not in json_data:
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "message": "Missing required fields (name, embedding)",
+                }
+            ),
+            400,
+        )
+    if not shard.owns(face_id):
+        return (
+            jsonify({"success": False, "message": "Face belongs to another shard"}),
+            409,
+        )
+
+    shard.upsert(
+        face_id, json_data["name"], json_data["embedding"], json_data.get("sites")
+    )
+    return jsonify({"success": True})
+
+
+@app.route("/shard/faces/<face_id>", methods=["DELETE"])
+def delete_face(face_id):
+    """Remove one face from this shard."""
+    shard.delete(face_id)
+    return jsonify({"success": True})
+
+
+@app.route("/shard/stats")
+def stats():
+    """Return the shard's position and size as JSON."""
+    return jsonify(shard.stats())
+
+
+if __name__ == "__main__":
+    logs.configure()
+    load_partition()
+    threading.Thread(
+        target=refresh_forever,
+        args=(float(os.environ.get("GALLERY_REFRESH_SECONDS", "300")),),
+        daemon=True,
+    ).start()
+    app.run(host="0.0.0.0", port=int(os.environ.get("GALLERY_SHARD_PORT", "5101")))
@@ -0,0 +1,152 @@
+"""
+Admission control for face inference.
+
+Embedding a face is CPU bound, so only a few can usefully run at once. The
+``InferenceGate`` lets ``concurrency`` requests run and up to ``queue_depth``
+more wait for a slot. Anything beyond that is rejected immediately with
+``Overloaded``, before its request body is even read. A request that waits
+longer than ``queue_timeout`` is rejected too, rather than being processed
+after its caller has given up, and so is one whose propagated deadline passes
+while it waits (see ``src/deadline.py``).
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from src import deadline as deadlines
+
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class Overloaded(Exception):
+    """
+    Raised when an inference request is not admitted.
+
+    Args:
+        reason (str): ``"queue_full"`` or ``"timed_out"``.
+        retry_after (int): Suggested seconds before retrying.
+    """
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Inference queue is busy ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class InferenceGate:  # pylint: disable=too-many-instance-attributes
+    """
+    Bounded queue in front of the inference workers.
+
+    Args:
+        concurrency (int): Inference requests allowed to run at once.
+        queue_depth (int): Requests allowed to wait for a free slot.
+        queue_timeout (float): Seconds a request may wait before it is
+            rejected.
+    """
+
+    def __init__(self, concurrency=1, queue_depth=8, queue_timeout=10.0):
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.in_flight = 0
+        self.peak_waiting = 0
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "timed_out": 0}
+        self.service_seconds = 1.0
+
+    def retry_after(self):
+        """Estimate in whole seconds when a new request could be served."""
+        with self._lock:
+            backlog = self.waiting + self.in_flight + 1
+        return max(1, math.ceil(backlog * self.service_seconds / self.concurrency))
+
+    @contextmanager
+    def slot(self, deadline=None):
+        """
+        Hold an inference slot for the duration of the block.
+
+        Args:
+            deadline (Deadline, optional): Stop waiting once it passes.
+
+        Raises:
+            Overloaded: If the queue is full or no slot frees up in time.
+            DeadlineExceeded: If ``deadline`` passes before a slot frees up.
+        """
+        wait = self.queue_timeout
+        if deadline is not None:
+            if deadline.expired():
+                raise deadlines.DeadlineExceeded("queue")
+            wait = min(wait, deadline.remaining())
+
+        with self._lock:
+            if self.waiting + self.in_flight >= self.concurrency + self.queue_depth:
+                self.rejected["queue_full"] += 1
+                full = True
+            else:
+                full = False
+                self.waiting += 1
+                self.peak_waiting = max(self.peak_waiting, self.waiting)
+        if full:
+            raise Overloaded("queue_full", self.retry_after())
+
+        acquired = self._slots.acquire(timeout=wait)
+        timed_out = not acquired and (deadline is None or not deadline.expired())
+        with self._lock:
+            self.waiting -= 1
+            if acquired:
+                self.in_flight += 1
+                self.admitted += 1
+            elif timed_out:
+                self.rejected["timed_out"] += 1
+        if timed_out:
+            raise Overloaded("timed_out", self.retry_after())
+        if not acquired:
+            raise deadlines.DeadlineExceeded("queue")
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self.in_flight -= 1
+                self.service_seconds += SERVICE_TIME_SMOOTHING * (
+                    elapsed - self.service_seconds
+                )
+            self._slots.release()
+
+    def admit(self, view):
+        """
+        Decorate a Flask view so it only runs while holding a slot.
+
+        The wait is bounded by the deadline of the request being served, which
+        is checked again before the view reads and decodes the request.
+        """
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with self.slot(deadlines.current.get()):
+                deadlines.check("decode")
+                return view(*args, **kwargs)
+
+        return wrapper
+
+    def stats(self):
+        """Return queue depth, admission and rejection counts."""
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "queue_limit": self.queue_depth,
+                "queue_depth": self.waiting,
+                "peak_queue_depth": self.peak_waiting,
+                "in_flight": self.in_flight,
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+                "avg_inference_ms": round(self.service_seconds * 1000, 1),
+            }
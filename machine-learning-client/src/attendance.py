@@ -0,0 +1,173 @@
+"""
+Attendance recording for single-hop sign-ins.
+
+``POST /signins`` verifies a face and records the day's attendance in the same
+call. The web app then makes one downstream request per sign-in instead of a
+verify call plus its own MongoDB reads and writes. The records follow the web
+app's schema:
+
+* one document per person and local day in the month's ``attendance_YYYY_MM``
+  partition, deduplicated by the unique ``daily_attendance_key`` index;
+* for a first sign-in of the day, ``$inc`` updates of the
+  ``attendance_daily`` and ``attendance_monthly`` rollups.
+
+Group captures record everyone recognised in a frame with ``record_many``,
+one unordered bulk write instead of an upsert per person.
+"""
+
+import logging
+import threading
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+from bson.objectid import ObjectId
+from pymongo import UpdateOne, errors
+from src import metrics
+
+logger = logging.getLogger(__name__)
+
+DAILY_KEY_INDEX = "daily_attendance_key"
+DAILY_ROLLUP = "attendance_daily"
+MONTHLY_ROLLUP = "attendance_monthly"
+
+
+def partition_name(local_date):
+    """Return the partition collection for a ``YYYY-MM-DD`` local date."""
+    return f"attendance_{local_date[:4]}_{local_date[5:7]}"
+
+
+class AttendanceRecorder:
+    """
+    Writes daily sign-ins to the ``smart_gate`` database.
+
+    Args:
+        db: The ``smart_gate`` pymongo database, shared with DeepFaceService
+            so both use one connection pool.
+        timezone_name (str): Site timezone that decides the attendance day.
+    """
+
+    def __init__(self, db, timezone_name="UTC"):
+        self.db = db
+        self.timezone = (
+            timezone.utc if timezone_name.upper() == "UTC" else ZoneInfo(timezone_name)
+        )
+        self._indexed = set()
+        self._lock = threading.Lock()
+
+    def _partition(self, local_date):
+        """Return the day's partition, creating its indexes on first use."""
+        name = partition_name(local_date)
+        with self._lock:
+            if name not in self._indexed:
+                collection = self.db[name]
+                collection.create_index([("timestamp", 1)])
+                collection.create_index(
+                    [("local_date", 1), ("face_id", 1)],
+                    name=DAILY_KEY_INDEX,
+                    unique=True,
+                    partialFilterExpression={"local_date": {"$exists": True}},
+                )
+                self._indexed.add(name)
+        return self.db[name]
+
+    def record(self, face_id, now=None):
+        """
+        Record today's sign-in for ``face_id`` with one upsert on the daily key.
+
+        Args:
+            face_id (str): Id of the recognised face.
+            now (datetime, optional): Sign-in time; defaults to now at the site.
+
+        Returns:
+            dict: ``first`` is False when the person had already signed in that
+            day; ``attendance_id`` is the new record's id, or None.
+        """
+        now = now or datetime.now(self.timezone)
+        local_date = now.date().isoformat()
+        try:
+            with metrics.stage("record"):
+                result = self._partition(local_date).update_one(
+                    {"face_id": ObjectId(face_id), "local_date": local_date},
+                    {"$setOnInsert": {"timestamp": now}},
+                    upsert=True,
+                )
+        except errors.DuplicateKeyError:
+            # A concurrent sign-in inserted the same daily key first
+            return {"first": False, "attendance_id": None}
+        if result.upserted_id is None:
+            return {"first": False, "attendance_id": None}
+
+        self._count_firsts(local_date, [face_id])
+        return {"first": True, "attendance_id": str(result.upserted_id)}
+
+    def record_many(self, face_ids, now=None):
+        """
+        Record today's sign-in for several faces with one bulk write.
+
+        Used for group captures; each face gets the same daily-key upsert as
+        ``record``, sent unordered in a single ``bulk_write``.
+
+        Args:
+            face_ids (list): Ids of the recognised faces, without duplicates.
+            now (datetime, optional): Sign-in time; defaults to now at the site.
+
+        Returns:
+            dict: For each face id, the ``record`` result.
+        """
+        if not face_ids:
+            return {}
+        now = now or datetime.now(self.timezone)
+        local_date = now.date().isoformat()
+        upserts = [
+            UpdateOne(
+                {"face_id": ObjectId(face_id), "local_date": local_date},
+                {"$setOnInsert": {"timestamp": now}},
+                upsert=True,
+            )
+            for face_id in face_ids
+        ]
+        metrics.BATCH_SIZE.observe(len(upserts), "record")
+        try:
+            with metrics.stage("record"):
+                upserted = (
+                    self._partition(local_date)
+                    .bulk_write(upserts, ordered=False)
+                    .upserted_ids
+                )
+        except errors.BulkWriteError as e:
+            # Duplicate daily keys are concurrent sign-ins that won the race
+            if any(err.get("code") != 11000 for err in e.details["writeErrors"]):
+                raise
+            upserted = {item["index"]: item["_id"] for item in e.details["upserted"]}
+
+        self._count_firsts(local_date, [face_ids[i] for i in sorted(upserted)])
+        return {
+            face_id: {
+                "first": i in upserted,
+                "attendance_id": str(upserted[i]) if i in upserted else None,
+            }
+            for i, face_id in enumerate(face_ids)
+        }
+
+    def _count_firsts(self, local_date, face_ids):
+        """Add first sign-ins of the day to the daily and monthly rollups."""
+        if not face_ids:
+            return
+        try:
+            self.db[DAILY_ROLLUP].update_one(
+                {"_id": local_date}, {"$inc": {"count": len(face_ids)}}, upsert=True
+            )
+            self.db[MONTHLY_ROLLUP].bulk_write(
+                [
+                    UpdateOne(
+                        {"month": local_date[:7], "face_id": ObjectId(face_id)},
+                        {"$inc": {"count": 1}},
+                        upsert=True,
+                    )
+                    for face_id in face_ids
+                ],
+                ordered=False,
+            )
+        except errors.PyMongoError as e:
+            # The sign-ins are recorded; `flask rollups rebuild` repairs the rollups
+            logger.warning("rollup update failed for %s: %s", ", ".join(face_ids), e)
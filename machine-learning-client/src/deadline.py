@@ -0,0 +1,94 @@
+"""
+Request deadlines propagated from the caller.
+
+Callers send their remaining time budget in milliseconds in the
+``X-Deadline-Ms`` header. The service turns it into a ``Deadline`` when the
+request arrives and checks it at each costly stage: waiting for an inference
+slot, decoding the image, detecting faces and computing the embedding. Work whose caller has
+already given up is dropped with ``DeadlineExceeded`` instead of being run.
+
+The deadline of the request being served is kept in a context variable so the
+``DeepFaceService`` methods can check it without changing their signatures.
+"""
+
+import threading
+import time
+from contextvars import ContextVar
+
+DEADLINE_HEADER = "X-Deadline-Ms"
+STAGES = ("queue", "decode", "detection", "embedding")
+
+current = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a request's deadline passes before a stage starts.
+
+    Args:
+        stage (str): The stage that was skipped, one of ``STAGES``.
+    """
+
+    def __init__(self, stage):
+        super().__init__(f"Request deadline exceeded before {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    Point in time by which the caller needs an answer.
+
+    Args:
+        seconds (float): Remaining budget from now.
+    """
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def from_header(cls, value):
+        """Return a deadline from an ``X-Deadline-Ms`` value, or None."""
+        try:
+            return cls(int(value) / 1000)
+        except (TypeError, ValueError):
+            return None
+
+    def remaining(self):
+        """Return the seconds left, never negative."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        """Return whether the deadline has passed."""
+        return self.remaining() <= 0
+
+
+def check(stage):
+    """
+    Raise if the current request's deadline has passed.
+
+    Raises:
+        DeadlineExceeded: Before ``stage`` runs for an expired request.
+    """
+    deadline = current.get()
+    if deadline is not None and deadline.expired():
+        raise DeadlineExceeded(stage)
+
+
+class AvoidedWork:
+    """Thread-safe counts of requests dropped at each stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(STAGES, 0)
+
+    def record(self, stage):
+        """Count one request dropped before ``stage``."""
+        with self._lock:
+            # A stage missing from STAGES must not turn a 504 into a 500
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    def stats(self):
+        """Return the counts per stage and the number of skipped embeddings."""
+        with self._lock:
+            counts = dict(self.counts)
+        return {"dropped": counts, "embeddings_avoided": sum(counts.values())}
@@ -6,49 +6,198 @@ using the DeepFace API. It interfaces with MongoDB for storing face data and
 provides methods for face verification against stored faces.
 """
 
+import base64
+import logging
 import os
+import time
 
+import cv2
 import numpy as np
 from bson.objectid import ObjectId
 from deepface import DeepFace
 from dotenv import load_dotenv
 from pymongo import MongoClient
+from src import deadline, gallery, memory, metrics
+from src.gallery import FACE_PROJECTION
+from src.staging import EmbeddingStage
 
+logger = logging.getLogger(__name__)
 
-class DeepFaceService:
+STAGED_FACE_EXPIRED = {
+    "success": False,
+    "expired": True,
+    "message": "Staged face expired, capture it again",
+}
+
+
+def _decode(image_data):
+    """
+    Decode a base64 ``data:`` URL into the BGR array DeepFace would load.
+
+    Decoding up front lets it be timed separately from detection and Facenet.
+    Anything else, such as a file path, is passed through for DeepFace.
+    """
+    if not (isinstance(image_data, str) and image_data.startswith("data:image/")):
+        return image_data
+    with metrics.stage("decode"):
+        encoded = np.frombuffer(
+            base64.b64decode(image_data.split(",", 1)[1]), dtype=np.uint8
+        )
+        image = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode the image")
+    return image
+
+
+def _area(face):
+    """Return the pixel area of a detected face, 0 if DeepFace gave none."""
+    area = face.get("facial_area") or {}
+    return area.get("w", 0) * area.get("h", 0)
+
+
+def _sharpness(crop):
+    """Return the variance of the Laplacian of a face crop, on a 0-255 scale."""
+    gray = np.asarray(crop, dtype=float)
+    if gray.ndim == 3:
+        gray = gray.mean(axis=2)
+    if gray.shape[0] < 3 or gray.shape[1] < 3:
+        return 0.0
+    if gray.max() <= 1.0:
+        gray = gray * 255.0
+    laplacian = (
+        gray[:-2, 1:-1]
+        + gray[2:, 1:-1]
+        + gray[1:-1, :-2]
+        + gray[1:-1, 2:]
+        - 4 * gray[1:-1, 1:-1]
+    )
+    return float(laplacian.var())
+
+
+def _box(face):
+    """Return the ``x``, ``y``, ``w``, ``h`` bounding box of a detected face."""
+    area = face.get("facial_area") or {}
+    return {key: int(area.get(key, 0)) for key in ("x", "y", "w", "h")}
+
+
+def _weights_bytes(model):
+    """Return the size of a built DeepFace model's weights, or None if unknown."""
+    try:
+        return int(
+            sum(
+                weights.nbytes
+                for weights in getattr(model, "model", model).get_weights()
+            )
+        )
+    except (AttributeError, TypeError):
+        return None
+
+
+class DeepFaceService:  # pylint: disable=too-many-instance-attributes
     """
     Service for facial recognition and verification using DeepFace API.
 
     This class provides methods to add faces to a database, verify faces against
     stored faces, and delete faces from the database. It uses MongoDB for storage
     and the DeepFace API for facial recognition operations.
+
+    Args:
+        staged (EmbeddingStage, optional): Store for embeddings staged by
+            ``verify_face(stage=True)``. Defaults to a new one.
     """
 
-    def __init__(self):
+    def __init__(self, staged=None):
         load_dotenv()
         mongo_uri = os.getenv("MONGO_URI")
         self.client = MongoClient(mongo_uri)
         self.db = self.client["smart_gate"]
         self.faces = self.db.faces
         self.threshold = float(os.getenv("DEEPFACE_THRESHOLD", "10"))
+        self.detector = os.environ.get("DETECTOR_BACKEND", "opencv")
+        self.gallery = gallery.from_env(self.faces)
+        self.staged = staged if staged is not None else EmbeddingStage()
+        # Set by warm_up: the model's weights and the RSS growth loading it
+        self.model_footprint = None
+
+    @staticmethod
+    def _detect(image_data):
+        """Return DeepFace's embedding and facial area for every face found."""
+        deadline.check("decode")
+        image = _decode(image_data)
+        deadline.check("embedding")
+        with metrics.stage("embed"):
+            return DeepFace.represent(img_path=image, model_name="Facenet")
+
+    def _probe(self, image_data):
+        """Return the largest face's embedding and the number of faces found."""
+        detected = self._detect(image_data)
+        return max(detected, key=_area)["embedding"], len(detected)
+
+    def warm_up(self):
+        """
+        Load the Facenet model now rather than on the first request.
+
+        Also notes the model's footprint for ``memory_usage``: the size of its
+        weights, and how much the resident set grew while loading it (which
+        includes TensorFlow's own start-up).
 
-    def add_face(self, image_data, name):
+        Returns:
+            float: Seconds the load took.
+        """
+        rss_before = memory.rss_bytes()
+        started = time.perf_counter()
+        model = DeepFace.build_model("Facenet")
+        seconds = time.perf_counter() - started
+        self.model_footprint = {
+            "weights_bytes": _weights_bytes(model),
+            "rss_growth_bytes": memory.rss_bytes() - rss_before,
+        }
+        return seconds
+
+    def _staged_or_embed(self, image_data, token):
+        """
+        Return the embedding staged under ``token``, or embed ``image_data``.
+
+        Enrollment needs exactly one face; a frame with several is rejected
+        rather than storing whichever face the detector listed first. That
+        holds for a token too, whose verify call counted the faces.
+        """
+        if token:
+            staged = self.staged.lookup(token)
+            if staged is None:
+                return None
+            embedding, faces = staged
+        else:
+            detected = self._detect(image_data)
+            embedding, faces = detected[0]["embedding"], len(detected)
+        if faces > 1:
+            raise ValueError(f"{faces} faces detected, capture one person at a time")
+        return embedding
+
+    def add_face(self, image_data, name, sites=None, token=None):
         """
         Add a face to the database for future recognition
 
         Args:
             image_data (str): Base64 encoded image
             name (str): Name of the person
+            sites (list, optional): Sites whose gates may match this face
+            token (str, optional): Staged embedding to use instead of the image
 
         Returns:
             dict: Response from DeepFace API with face embeddings
         """
         try:
-            embeddings = DeepFace.represent(img_path=image_data, model_name="Facenet")[
-                0
-            ]["embedding"]
+            embeddings = self._staged_or_embed(image_data, token)
+            if embeddings is None:
+                return dict(STAGED_FACE_EXPIRED)
             face_doc = {"name": name, "img_vectors": embeddings}
+            if sites:
+                face_doc["sites"] = list(sites)
             face_id = self.faces.insert_one(face_doc).inserted_id
+            self._index_face(str(face_id), name, embeddings, sites)
+            if token:
+                self.staged.discard(token)
 
             return {
                 "success": True,
@@ -56,10 +205,13 @@ class DeepFaceService:
                 "message": "Face added successfully",
             }
 
+        except deadline.DeadlineExceeded:
+            raise
         except Exception as e:  # pylint: disable=broad-exception-caught
             return {"success": False, "message": f"Error: {str(e)}"}
 
-    def replace_face(self, image_data, name, face_id):
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def replace_face(self, image_data, name, face_id, sites=None, token=None):
         """
         Replace the face embeddings for an existing face ID and optionally update the name
 
@@ -67,6 +219,8 @@ class DeepFaceService:
             image_data (str): Base64 encoded image
             face_id (str): ID of the face to replace
             name (str, optional): New name for the face. If None, name remains unchanged
+            sites (list, optional): New sites for the face. If None, sites remain unchanged
+            token (str, optional): Staged embedding to use instead of the image
 
         Returns:
             dict: Operation result
@@ -76,17 +230,27 @@ class DeepFaceService:
             if not face:
                 return {"success": False, "message": "Face not found"}
 
-            embeddings = DeepFace.represent(img_path=image_data, model_name="Facenet")[
-                0
-            ]["embedding"]
+            embeddings = self._staged_or_embed(image_data, token)
+            if embeddings is None:
+                return dict(STAGED_FACE_EXPIRED)
 
             update_doc = {"img_vectors": embeddings, "name": name}
+            if sites is not None:
+                update_doc["sites"] = list(sites)
 
             result = self.faces.update_one(
                 {"_id": ObjectId(face_id)}, {"$set": update_doc}
             )
 
             if result.modified_count > 0:
+                self._index_face(
+                    face_id,
+                    name,
+                    embeddings,
+                    sites if sites is not None else face.get("sites"),
+                )
+                if token:
+                    self.staged.discard(token)
                 return {
                     "success": True,
                     "face_id": face_id,
@@ -95,71 +259,252 @@ class DeepFaceService:
 
             return {"success": False, "message": "Failed to update face"}
 
+        except deadline.DeadlineExceeded:
+            raise
         except Exception as e:  # pylint: disable=broad-exception-caught
             return {"success": False, "message": f"Error: {str(e)}"}
 
-    def verify_face(self, image_data):
+    def verify_face(self, image_data, site=None, stage=False):
         """
         Verify a face against stored faces
 
         Args:
             image_data (str): Base64 encoded image
-            user_id (str, optional): Specific user ID to verify against
+            site (str, optional): Only match faces tagged with this site
+            stage (bool): Keep the computed embedding and return a ``token``
+                for it, for a following add or update
 
         Returns:
             dict: Verification result
         """
         try:
-            # get all stored faces
-            stored_faces = list(self.faces.find())
+            if self.gallery is not None:
+                # scatter-gather over the sharded gallery
+                probe, faces = self._probe(image_data)
+                with metrics.stage("search"):
+                    matches = self.gallery.search(probe, k=1, site=site)
+                best_match = matches[0] if matches else None
+            else:
+                # get all stored faces, or those of the requested site
+                with metrics.stage("find"):
+                    stored_faces = list(
+                        self.faces.find({"sites": site}) if site else self.faces.find()
+                    )
+                if not stored_faces and not stage:
+                    return {
+                        "success": True,
+                        "verified": False,
+                        "message": "No matching face found",
+                    }
+                probe, faces = self._probe(image_data)
+                with metrics.stage("search"):
+                    best_match = self._closest(probe, stored_faces)
+                logger.debug(
+                    "compared %d stored faces, best match %s",
+                    len(stored_faces),
+                    best_match,
+                )
 
-            if not stored_faces:
-                return {
+            if best_match and best_match["distance"] <= self.threshold:
+                result = {"success": True, "verified": True, "match": best_match}
+            else:
+                result = {
                     "success": True,
                     "verified": False,
                     "message": "No matching face found",
                 }
+            if stage:
+                result["token"] = self.staged.put(probe, faces)
+            return result
 
-            image_embedding1 = DeepFace.represent(
-                img_path=image_data, model_name="Facenet"
-            )[0]["embedding"]
-
-            # Verify against each stored face
-            best_match = None
-            lowest_distance = None
+        except deadline.DeadlineExceeded:
+            raise
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            return {"success": False, "message": f"Error: {str(e)}"}
 
-            for face in stored_faces:
-                print(f"comparing {face['_id']}")
+    def identify_faces(self, image_data, site=None):
+        """
+        Identify every face in an image with one batched gallery search.
 
-                image_embedding2 = face["img_vectors"]
+        Args:
+            image_data (str): Base64 encoded image
+            site (str, optional): Only match faces tagged with this site
 
-                distance = float(
-                    np.linalg.norm(
-                        np.array(image_embedding1) - np.array(image_embedding2)
+        Returns:
+            dict: ``faces`` lists one result per detected face, largest first,
+            each with its ``box`` and either ``verified`` with its ``match`` or
+            not verified. When two faces match the same person, only the
+            closer one is verified.
+        """
+        try:
+            detected = sorted(self._detect(image_data), key=_area, reverse=True)
+            probes = [face["embedding"] for face in detected]
+            metrics.BATCH_SIZE.observe(len(probes), "identify")
+            if self.gallery is not None:
+                with metrics.stage("search"):
+                    best = self.gallery.search_many(probes, k=1, site=site)
+            else:
+                # one in-memory index for the batch instead of a scan per face
+                scan = gallery.GalleryShard()
+                with metrics.stage("find"):
+                    scan.load(
+                        self.faces.find(
+                            {"sites": site} if site else {}, FACE_PROJECTION
+                        )
                     )
-                )
+                with metrics.stage("search"):
+                    best = scan.search_many(probes, k=1)
+
+            faces = []
+            closest = {}
+            for face, matches in zip(detected, best):
+                result = {"box": _box(face), "verified": False}
+                match = matches[0] if matches else None
+                if match and match["distance"] <= self.threshold:
+                    other = closest.get(match["_id"])
+                    if other is None or match["distance"] < other["match"]["distance"]:
+                        if other is not None:
+                            del other["match"]
+                            other["verified"] = False
+                        result.update(verified=True, match=match)
+                        closest[match["_id"]] = result
+                faces.append(result)
+
+            return {"success": True, "faces": faces}
+
+        except deadline.DeadlineExceeded:
+            raise
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            return {"success": False, "message": f"Error: {str(e)}"}
 
-                if lowest_distance is None or distance < lowest_distance:
-                    lowest_distance = distance
-                    best_match = {
-                        "_id": str(face["_id"]),
-                        "name": face["name"],
-                        "distance": distance,
-                    }
-                    print(f"found best match:\n {best_match}")
+    def detect_faces(self, image_data):
+        """
+        Locate faces without embedding them, for tracking streamed frames.
 
-            if best_match and best_match["distance"] <= self.threshold:
-                return {"success": True, "verified": True, "match": best_match}
+        Runs only the ``DETECTOR_BACKEND`` detector, which is much cheaper than
+        a Facenet embedding.
 
-            return {
-                "success": True,
-                "verified": False,
-                "message": "No matching face found",
-            }
+        Args:
+            image_data (str): Base64 encoded image
+
+        Returns:
+            dict: ``faces`` lists each face's ``box``, the detector's
+            ``confidence`` and a ``sharpness`` score (variance of the
+            Laplacian of the crop), largest first.
+        """
+        try:
+            deadline.check("decode")
+            image = _decode(image_data)
+            deadline.check("detection")
+            with metrics.stage("detect"):
+                found = DeepFace.extract_faces(
+                    img_path=image,
+                    detector_backend=self.detector,
+                    enforce_detection=False,
+                )
+            # Without a face, DeepFace returns the whole frame with confidence 0
+            faces = [
+                {
+                    "box": _box(face),
+                    "confidence": float(face.get("confidence") or 0),
+                    "sharpness": _sharpness(face["face"]),
+                }
+                for face in sorted(found, key=_area, reverse=True)
+                if face.get("confidence")
+            ]
+            return {"success": True, "faces": faces}
 
+        except deadline.DeadlineExceeded:
+            raise
         except Exception as e:  # pylint: disable=broad-exception-caught
             return {"success": False, "message": f"Error: {str(e)}"}
 
+    @staticmethod
+    def _closest(image_embedding1, stored_faces):
+        """Return the stored face nearest to the probe, comparing one by one."""
+        best_match = None
+        lowest_distance = None
+
+        for face in stored_faces:
+            image_embedding2 = face["img_vectors"]
+
+            distance = float(
+                np.linalg.norm(np.array(image_embedding1) - np.array(image_embedding2))
+            )
+
+            if lowest_distance is None or distance < lowest_distance:
+                lowest_distance = distance
+                best_match = {
+                    "_id": str(face["_id"]),
+                    "name": face["name"],
+                    "distance": distance,
+                }
+
+        return best_match
+
+    def _index_face(self, face_id, name=None, embeddings=None, sites=None):
+        """
+        Copy a stored face to its gallery shard, if sharding is enabled.
+
+        Without ``embeddings`` the face is removed from its shard instead.
+        """
+        if self.gallery is None:
+            return
+        try:
+            with metrics.stage("index"):
+                if embeddings is None:
+                    self.gallery.delete(face_id)
+                else:
+                    self.gallery.upsert(face_id, name, embeddings, sites)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # The face is stored; shard servers pick it up on their next reload
+            logger.warning("gallery update failed for %s: %s", face_id, e)
+
+    def gallery_size(self):
+        """
+        Return the number of enrolled faces.
+
+        Returns:
+            dict: Faces per in-process gallery shard, keyed by shard index, or
+            ``{"all": count}`` from MongoDB when there is no gallery. Remote
+            shards report their own size on ``/shard/stats``.
+        """
+        if self.gallery is None:
+            return {"all": self.faces.estimated_document_count()}
+        return {
+            str(shard.index): shard.stats()["faces"] for shard in self._local_shards()
+        }
+
+    def _local_shards(self):
+        if self.gallery is None:
+            return []
+        return [
+            shard
+            for shard in self.gallery.shards
+            if isinstance(shard, gallery.GalleryShard)
+        ]
+
+    def memory_usage(self):
+        """
+        Estimate the memory held by the model, the gallery and staged faces.
+
+        Returns:
+            dict: ``model`` (the footprint noted by ``warm_up``, or None),
+            ``gallery_bytes`` for the in-process shards and ``staged_bytes``.
+        """
+        return {
+            "model": self.model_footprint,
+            "gallery_bytes": sum(
+                shard.memory_bytes() for shard in self._local_shards()
+            ),
+            "staged_bytes": self.staged.memory_bytes(),
+        }
+
+    def shed_caches(self):
+        """Drop the in-process shards' per-site indexes to free memory."""
+        for shard in self._local_shards():
+            shard.shed()
+
     def delete_face(self, face_id):
         """
         Delete a face from the database and all related attendance records
@@ -177,6 +522,8 @@ class DeepFaceService:
             # Delete all attendance records for this face
             attendance_result = self.db.attendance.delete_many({"face_id": face_id})
 
+            # Evict it even if another replica already deleted the stored face
+            self._index_face(face_id)
             if face_result.deleted_count > 0:
                 return {
                     "success": True,
@@ -0,0 +1,376 @@
+"""
+Sharded in-memory face gallery for scatter-gather identification.
+
+Faces are partitioned over ``N`` shards by a stable hash of their ``_id``. Each
+shard keeps its faces' embeddings in one matrix and answers top-k nearest
+neighbour queries. ``ShardedGallery`` coordinates a search: the probe embedding
+is computed once, sent to every shard in parallel, and the per-shard results
+are merged. ``search_many`` does the same for all faces found in one frame in
+a single round.
+
+Matches are ordered by ``(distance, _id)``. Every shard returns all faces tied
+with its k-th best, so the merged top-k is exactly what a single shard holding
+the whole gallery would return, whatever the shard count.
+
+Faces may be tagged with ``sites``. A search for a site only considers faces
+tagged with it, using a separate matrix per site that is built on the first
+search for that site and dropped whenever the shard changes. Faces without
+sites are only found by searches without a site.
+
+``GALLERY_SHARDS`` selects the mode:
+
+* unset: no gallery; ``verify_face`` scans MongoDB as before.
+* ``local:N``: N shards inside the DeepFace process. They reload from MongoDB
+  every ``GALLERY_REFRESH_SECONDS`` (default 300, 0 to never reload), so faces
+  added, changed or removed through another DeepFace replica show up here.
+* a comma-separated list of shard server URLs (see ``shard.py``). Shard ``i``
+  of the list must be started with ``GALLERY_SHARD_INDEX=i`` and
+  ``GALLERY_SHARD_COUNT`` equal to the length of the list.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import urllib.request
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src import deadline, memory, tracing
+
+FACE_PROJECTION = {"name": 1, "img_vectors": 1, "sites": 1}
+SHARD_TIMEOUT = 5.0
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(face_id, shard_count):
+    """Return the shard index owning ``face_id``; stable across processes."""
+    return zlib.crc32(str(face_id).encode("utf-8")) % shard_count
+
+
+def _ranked(matches, k):
+    """Sort matches by ``(distance, _id)`` and keep the best ``k``."""
+    return sorted(matches, key=lambda match: (match["distance"], match["_id"]))[:k]
+
+
+class GalleryShard:
+    """
+    One partition of the gallery held in memory.
+
+    Args:
+        index (int): This shard's position, ``0 <= index < count``.
+        count (int): Total number of shards.
+    """
+
+    def __init__(self, index=0, count=1):
+        self.index = index
+        self.count = count
+        self._lock = threading.Lock()
+        self._faces = {}
+        self._indexes = {}
+
+    def owns(self, face_id):
+        """Return whether ``face_id`` hashes to this shard."""
+        return shard_of(face_id, self.count) == self.index
+
+    def load(self, faces):
+        """Replace the shard's contents with the owned faces among ``faces``."""
+        owned = {
+            str(face["_id"]): (
+                face["name"],
+                face["img_vectors"],
+                frozenset(face.get("sites") or ()),
+            )
+            for face in faces
+            if self.owns(face["_id"])
+        }
+        with self._lock:
+            self._faces = owned
+            self._indexes = {}
+
+    def upsert(self, face_id, name, embedding, sites=()):
+        """Add or replace one face."""
+        with self._lock:
+            self._faces[str(face_id)] = (name, embedding, frozenset(sites or ()))
+            self._indexes = {}
+
+    def delete(self, face_id):
+        """Remove one face if present."""
+        with self._lock:
+            if self._faces.pop(str(face_id), None) is not None:
+                self._indexes = {}
+
+    def _index(self, site):
+        """Return ``(ids, names, matrix)`` for ``site``; call with the lock held."""
+        if site not in self._indexes:
+            ids = [
+                face_id
+                for face_id, (_, _, sites) in self._faces.items()
+                if site is None or site in sites
+            ]
+            self._indexes[site] = (
+                ids,
+                [self._faces[face_id][0] for face_id in ids],
+                np.array([self._faces[face_id][1] for face_id in ids], dtype=float),
+            )
+        return self._indexes[site]
+
+    def search(self, probe, k=1, site=None):
+        """
+        Return this shard's best matches for ``probe``.
+
+        Args:
+            probe (list): The embedding to look up.
+            k (int): Number of matches wanted.
+            site (str, optional): Only consider faces tagged with this site.
+
+        Returns:
+            list: Up to ``k`` dicts with ``_id``, ``name`` and ``distance``,
+            plus any faces tied with the k-th, ordered by ``(distance, _id)``.
+        """
+        return self.search_many([probe], k, site)[0]
+
+    def search_many(self, probes, k=1, site=None):
+        """
+        Return this shard's best matches for each of several probes.
+
+        The site index is looked up once for the whole batch.
+
+        Returns:
+            list: One ``search`` result per probe, in the order given.
+        """
+        with self._lock:
+            ids, names, matrix = self._index(site)
+        if not ids:
+            return [[] for _ in probes]
+        return [self._top(ids, names, matrix, probe, k) for probe in probes]
+
+    @staticmethod
+    def _top(ids, names, matrix, probe, k):
+        """Rank the faces of one index against one probe."""
+        distances = np.linalg.norm(matrix - np.asarray(probe, dtype=float), axis=1)
+        if k < len(ids):
+            cutoff = np.partition(distances, k - 1)[k - 1]
+            candidates = np.flatnonzero(distances <= cutoff)
+        else:
+            candidates = range(len(ids))
+        matches = [
+            {"_id": ids[i], "name": names[i], "distance": float(distances[i])}
+            for i in candidates
+        ]
+        ranked = _ranked(matches, len(matches))
+        if len(ranked) > k:
+            kth = ranked[k - 1]["distance"]
+            ranked = [match for match in ranked if match["distance"] <= kth]
+        return ranked
+
+    def memory_bytes(self):
+        """Estimate the bytes held by the shard's embeddings and indexes."""
+        with self._lock:
+            faces = list(self._faces.values())
+            matrices = [matrix for _, _, matrix in self._indexes.values()]
+        sample = memory.vector_bytes(faces[0][1]) if faces else 0
+        return len(faces) * sample + sum(matrix.nbytes for matrix in matrices)
+
+    def shed(self):
+        """Drop the per-site indexes; they are rebuilt when next searched."""
+        with self._lock:
+            self._indexes = {
+                site: index for site, index in self._indexes.items() if site is None
+            }
+
+    def stats(self):
+        """Return the shard's position, size and built site indexes."""
+        with self._lock:
+            return {
+                "index": self.index,
+                "count": self.count,
+                "faces": len(self._faces),
+                "sites_indexed": sorted(site for site in self._indexes if site),
+            }
+
+
+class RemoteShard:
+    """
+    Client for a shard served by ``shard.py`` in another process or container.
+
+    Args:
+        url (str): Base URL of the shard server.
+        index (int): The shard index the server must report.
+        count (int): The shard count the server must report.
+    """
+
+    def __init__(self, url, index, count):
+        self.url = url.rstrip("/")
+        self.index = index
+        self.count = count
+
+    def _call(self, method, path, payload=None):
+        timeout = SHARD_TIMEOUT
+        headers = {"Content-Type": "application/json"}
+        current = deadline.current.get()
+        if current is not None:
+            timeout = max(0.001, min(timeout, current.remaining()))
+            headers[deadline.DEADLINE_HEADER] = str(int(timeout * 1000))
+        with tracing.span(f"shard {self.index}", url=self.url):
+            traceparent = tracing.traceparent_header()
+            if traceparent:
+                headers[tracing.TRACEPARENT] = traceparent
+            request = urllib.request.Request(
+                self.url + path,
+                data=(
+                    json.dumps(payload).encode("utf-8") if payload is not None else None
+                ),
+                headers=headers,
+                method=method,
+            )
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.loads(response.read())
+
+    def search(self, probe, k=1, site=None):
+        """Query the shard server; fails if it holds a different partition."""
+        return self.search_many([probe], k, site)[0]
+
+    def search_many(self, probes, k=1, site=None):
+        """Query the shard server for several probes in one request."""
+        payload = {"embeddings": [list(map(float, probe)) for probe in probes], "k": k}
+        if site:
+            payload["site"] = site
+        result = self._call("POST", "/shard/search", payload)
+        if result["shard"] != [self.index, self.count]:
+            raise RuntimeError(
+                f"{self.url} serves shard {result['shard']}, "
+                f"expected [{self.index}, {self.count}]"
+            )
+        return result["matches"]
+
+    def upsert(self, face_id, name, embedding, sites=()):
+        """Add or replace one face on the shard server."""
+        self._call(
+            "PUT",
+            f"/shard/faces/{face_id}",
+            {
+                "name": name,
+                "embedding": list(map(float, embedding)),
+                "sites": list(sites or ()),
+            },
+        )
+
+    def delete(self, face_id):
+        """Remove one face from the shard server."""
+        self._call("DELETE", f"/shard/faces/{face_id}")
+
+
+class ShardedGallery:
+    """
+    Scatter-gather coordinator over gallery shards.
+
+    Args:
+        shards (list): ``GalleryShard`` or ``RemoteShard`` objects, where
+            ``shards[i]`` holds partition ``i``.
+    """
+
+    def __init__(self, shards):
+        self.shards = shards
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(shards), thread_name_prefix="gallery"
+        )
+
+    def shard_for(self, face_id):
+        """Return the shard owning ``face_id``."""
+        return self.shards[shard_of(face_id, len(self.shards))]
+
+    def search(self, probe, k=1, site=None):
+        """Return the global top ``k`` matches, ordered by ``(distance, _id)``."""
+        return self.search_many([probe], k, site)[0]
+
+    def search_many(self, probes, k=1, site=None):
+        """
+        Return the global top ``k`` matches for each probe.
+
+        Every shard receives the whole batch in one call, so a frame with
+        several faces costs one round trip per shard rather than one per face.
+        """
+        # Each call runs in the caller's context, so remote shards see the
+        # request's deadline and trace
+        futures = [
+            self._executor.submit(
+                contextvars.copy_context().run, shard.search_many, probes, k, site
+            )
+            for shard in self.shards
+        ]
+        per_shard = [f.result() for f in futures]
+        return [
+            _ranked([match for matches in per_shard for match in matches[i]], k)
+            for i in range(len(probes))
+        ]
+
+    def upsert(self, face_id, name, embedding, sites=()):
+        """Add or replace a face on its owning shard."""
+        self.shard_for(face_id).upsert(str(face_id), name, embedding, sites)
+
+    def delete(self, face_id):
+        """Remove a face from its owning shard."""
+        self.shard_for(face_id).delete(str(face_id))
+
+    def reload(self, faces):
+        """Refill the in-process shards from the faces collection."""
+        docs = list(faces.find({}, FACE_PROJECTION))
+        for shard in self.shards:
+            if isinstance(shard, GalleryShard):
+                shard.load(docs)
+
+    def reload_every(self, faces, interval):
+        """
+        Reload the in-process shards from ``faces`` in a background thread.
+
+        Other replicas write their adds, updates and deletes to MongoDB only,
+        so this is how they reach this process's shards.
+
+        Returns:
+            threading.Event: Set it to stop reloading.
+        """
+        stop = threading.Event()
+
+        def reload_forever():
+            while not stop.wait(interval):
+                try:
+                    self.reload(faces)
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    logger.warning("gallery reload failed: %s", e)
+
+        threading.Thread(
+            target=reload_forever, name="gallery-reload", daemon=True
+        ).start()
+        return stop
+
+
+def from_env(faces):
+    """
+    Build the gallery configured by ``GALLERY_SHARDS``.
+
+    Args:
+        faces: The MongoDB faces collection, used to fill local shards.
+
+    Returns:
+        ShardedGallery: The gallery, or None when sharding is not enabled.
+    """
+    spec = os.environ.get("GALLERY_SHARDS", "").strip()
+    if not spec:
+        return None
+    if spec.startswith("local:"):
+        count = int(spec[len("local:") :])
+        gallery = ShardedGallery([GalleryShard(index, count) for index in range(count)])
+        gallery.reload(faces)
+        interval = float(os.environ.get("GALLERY_REFRESH_SECONDS", "300"))
+        if interval > 0:
+            gallery.reload_every(faces, interval)
+        return gallery
+    urls = [url.strip() for url in spec.split(",") if url.strip()]
+    return ShardedGallery(
+        [RemoteShard(url, index, len(urls)) for index, url in enumerate(urls)]
+    )
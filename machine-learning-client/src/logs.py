@@ -0,0 +1,42 @@
+"""
+Leveled, sampled logging for the DeepFace service.
+
+``LOG_LEVEL`` (default ``INFO``) sets the level. Records below ``INFO`` are
+sampled: only a ``LOG_SAMPLE_RATE`` share of them (default 0.01) is written, so
+``LOG_LEVEL=DEBUG`` can show what recognition requests are doing without
+writing a line for every request.
+"""
+
+import logging
+import os
+import random
+
+FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+class SampleFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """
+    Pass every record at ``INFO`` or above, and a share of the rest.
+
+    Args:
+        rate (float): Share of debug records to keep, from 0 to 1.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.INFO or random.random() < self.rate
+
+
+def configure():
+    """Send the service's logs to stderr at ``LOG_LEVEL``, sampling debug."""
+    root = logging.getLogger()
+    if any(isinstance(f, SampleFilter) for h in root.handlers for f in h.filters):
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(FORMAT))
+    handler.addFilter(SampleFilter(float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))))
+    root.addHandler(handler)
+    root.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
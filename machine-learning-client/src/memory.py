@@ -0,0 +1,270 @@
+"""
+Memory accounting and a memory budget for the DeepFace service.
+
+The process's resident set is mostly TensorFlow and the Facenet model, plus the
+state the service keeps: the in-process gallery shards (embeddings and their
+per-site search matrices) and the staged enrollment embeddings. ``GET /memory``
+reports the RSS, the container's limit, the model's footprint measured at
+start-up and estimates of the gallery and cache sizes. With
+``PROFILE_TOKEN``, it can also start ``tracemalloc`` and report the Python
+allocations that grew since it started.
+
+``MemoryGuard`` keeps the process under a budget: ``MEMORY_BUDGET_MB``, or by
+default ``MEMORY_BUDGET_FRACTION`` (0.9) of the container's cgroup limit. The
+RSS is read at most once per ``interval``. Past ``shed_fraction`` of the
+budget, the registered caches are shed. Once the budget is reached, requests
+that would keep more in memory, such as enrolling a face or staging an
+embedding, are refused until it is back under.
+"""
+
+import gc
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+CGROUP_LIMITS = (
+    "/sys/fs/cgroup/memory.max",
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+)
+# cgroup v1 reports "no limit" as a huge page-aligned number
+NO_LIMIT = 1 << 60
+TRACEMALLOC_FRAMES = 10
+
+# Snapshot taken by start_tracing, for allocations() to compare against
+_baseline = None  # pylint: disable=invalid-name
+
+
+def _status_bytes(field):
+    """Return a ``kB`` field of ``/proc/self/status`` in bytes, or None."""
+    try:
+        with open("/proc/self/status", encoding="ascii") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def rss_bytes():
+    """Return the process's resident set size in bytes."""
+    rss = _status_bytes("VmRSS")
+    return rss if rss is not None else peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    """Return the process's largest resident set size so far, in bytes."""
+    peak = _status_bytes("VmHWM")
+    if peak is None:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1 if sys.platform == "darwin" else 1024
+    return peak
+
+
+def cgroup_limit_bytes(paths=CGROUP_LIMITS):
+    """Return the container's memory limit in bytes, or None if unlimited."""
+    for path in paths:
+        try:
+            with open(path, encoding="ascii") as limit:
+                value = limit.read().strip()
+        except OSError:
+            continue
+        if value == "max" or not value.isdigit() or int(value) >= NO_LIMIT:
+            return None
+        return int(value)
+    return None
+
+
+def vector_bytes(vector):
+    """Estimate the bytes held by one embedding, a list of floats or an array."""
+    if hasattr(vector, "nbytes") or len(vector) == 0:
+        # An array that owns its data counts it in getsizeof
+        return sys.getsizeof(vector)
+    return sys.getsizeof(vector) + len(vector) * sys.getsizeof(vector[0])
+
+
+def budget_from_env():
+    """Return the configured budget in bytes, or None for no budget."""
+    explicit = os.environ.get("MEMORY_BUDGET_MB")
+    if explicit:
+        return int(float(explicit) * 1024 * 1024)
+    limit = cgroup_limit_bytes()
+    if limit is None:
+        return None
+    return int(limit * float(os.environ.get("MEMORY_BUDGET_FRACTION", "0.9")))
+
+
+class MemoryBudgetExceeded(Exception):
+    """
+    Raised instead of growing the service's state over its memory budget.
+
+    Args:
+        rss (int): Resident set size when the request was refused.
+        budget (int): The budget in bytes.
+    """
+
+    retry_after = 30
+
+    def __init__(self, rss, budget):
+        super().__init__(
+            f"Memory budget exceeded ({rss // 2**20} of {budget // 2**20} MiB)"
+        )
+        self.rss = rss
+        self.budget = budget
+
+
+class MemoryGuard:  # pylint: disable=too-many-instance-attributes
+    """
+    Sheds caches near the memory budget and refuses growth over it.
+
+    Args:
+        budget (int): Budget in bytes; None disables the guard.
+        shed_fraction (float): Share of the budget at which caches are shed.
+        interval (float): Seconds between RSS readings.
+        cooldown (float): Seconds between two rounds of shedding.
+        read_rss (callable): Returns the RSS in bytes; for tests.
+    """
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        budget,
+        shed_fraction=0.9,
+        interval=1.0,
+        cooldown=10.0,
+        read_rss=rss_bytes,
+    ):
+        self.budget = budget
+        self.shed_fraction = shed_fraction
+        self.interval = interval
+        self.cooldown = cooldown
+        self.read_rss = read_rss
+        self._lock = threading.Lock()
+        self._shedders = []
+        self._read_at = float("-inf")
+        self._shed_at = float("-inf")
+        self.rss = 0
+        self.sheds = 0
+        self.refused = 0
+
+    def on_pressure(self, shed):
+        """Register ``shed()``, called to free memory near the budget."""
+        self._shedders.append(shed)
+
+    def check(self):
+        """
+        Read the RSS if it is due and shed caches if it is near the budget.
+
+        Returns:
+            int: The latest RSS reading in bytes.
+        """
+        if self.budget is None:
+            return self.rss
+        now = time.monotonic()
+        with self._lock:
+            if now - self._read_at < self.interval:
+                return self.rss
+            self._read_at = now
+            self.rss = self.read_rss()
+            shed = (
+                self.rss >= self.budget * self.shed_fraction
+                and now - self._shed_at >= self.cooldown
+            )
+            if shed:
+                self._shed_at = now
+                self.sheds += 1
+        if shed:
+            for shedder in self._shedders:
+                shedder()
+            gc.collect()
+            with self._lock:
+                self.rss = self.read_rss()
+        return self.rss
+
+    def allow_growth(self):
+        """Return whether the service may keep more in memory now."""
+        if self.budget is None:
+            return True
+        if self.check() < self.budget:
+            return True
+        with self._lock:
+            self.refused += 1
+        return False
+
+    def reserve(self):
+        """
+        Refuse a request that would grow the service's state over budget.
+
+        Raises:
+            MemoryBudgetExceeded: If the RSS has reached the budget.
+        """
+        if not self.allow_growth():
+            raise MemoryBudgetExceeded(self.rss, self.budget)
+
+    def stats(self):
+        """Return the budget, the latest reading and the guard's counters."""
+        with self._lock:
+            return {
+                "budget_bytes": self.budget,
+                "shed_at_bytes": (
+                    int(self.budget * self.shed_fraction) if self.budget else None
+                ),
+                "rss_bytes": self.rss,
+                "sheds": self.sheds,
+                "refused": self.refused,
+            }
+
+
+def start_tracing():
+    """Start ``tracemalloc`` and take the baseline later snapshots compare to."""
+    global _baseline  # pylint: disable=global-statement
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    _baseline = tracemalloc.take_snapshot()
+
+
+def stop_tracing():
+    """Stop ``tracemalloc`` and drop its data."""
+    global _baseline  # pylint: disable=global-statement
+    _baseline = None
+    tracemalloc.stop()
+
+
+def allocations(limit=20):
+    """
+    Return the Python allocations that grew most since ``start_tracing``.
+
+    Returns:
+        dict: ``traced_bytes``, ``peak_bytes`` and ``top``, a list of
+        ``{"where", "size_bytes", "growth_bytes", "count"}`` by source line,
+        or ``{"tracing": False}`` when ``tracemalloc`` is not running.
+    """
+    if not tracemalloc.is_tracing():
+        return {"tracing": False}
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        (tracemalloc.Filter(False, tracemalloc.__file__),)
+    )
+    stats = (
+        snapshot.compare_to(_baseline, "lineno")
+        if _baseline is not None
+        else snapshot.statistics("lineno")
+    )
+    traced, peak = tracemalloc.get_traced_memory()
+    return {
+        "tracing": True,
+        "traced_bytes": traced,
+        "peak_bytes": peak,
+        "top": [
+            {
+                "where": str(stat.traceback[0]),
+                "size_bytes": stat.size,
+                "growth_bytes": getattr(stat, "size_diff", stat.size),
+                "count": stat.count,
+            }
+            for stat in stats[:limit]
+        ],
+    }
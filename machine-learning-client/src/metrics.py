@@ -0,0 +1,180 @@
+"""
+Prometheus text-format metrics for the DeepFace service.
+
+``GET /metrics`` renders two kinds of metric families:
+
+* histograms kept here and observed as requests run: the time of each
+  pipeline stage (``deepface_stage_seconds``), of each endpoint
+  (``deepface_http_request_seconds``) and batch sizes (``deepface_batch_size``);
+* values read from the service's existing ``stats()`` at scrape time, such as
+  the gallery size, the inference queue and the staged-embedding cache, via
+  ``family``.
+
+The stages are ``decode`` (base64 and JPEG decoding), ``detect`` (face
+detection alone, for ``/faces/detect``), ``embed`` (DeepFace.represent: face
+detection plus Facenet), ``find`` (loading faces from MongoDB), ``search`` (the
+distance computation or gallery search), ``record`` (attendance writes) and
+``index`` (gallery updates). DeepFace runs detection and Facenet in one call,
+so Facenet's own share is ``embed`` less ``detect``.
+"""
+
+import bisect
+import contextlib
+import logging
+import threading
+import time
+
+from src import tracing
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def family(name, kind, documentation, samples):
+    """
+    Render one metric family in the Prometheus text format.
+
+    Args:
+        name (str): Metric name.
+        kind (str): ``counter``, ``gauge`` or ``histogram``.
+        documentation (str): The ``# HELP`` text.
+        samples (list): ``(suffix, labels, value)`` triples; ``suffix`` is
+            appended to ``name`` (e.g. ``"_bucket"``), ``labels`` is a dict.
+
+    Returns:
+        str: The family's lines, ending in a newline.
+    """
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    lines += [
+        f"{name}{suffix}{_labels(labels)} {_number(value)}"
+        for suffix, labels, value in samples
+    ]
+    return "\n".join(lines) + "\n"
+
+
+class Histogram:
+    """
+    Thread-safe cumulative histogram with fixed label names.
+
+    Args:
+        name (str): Metric name.
+        documentation (str): The ``# HELP`` text.
+        labelnames (tuple): Names of the labels passed to ``observe``.
+        buckets (tuple): Upper bounds, in increasing order.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *labelvalues):
+        """Record ``value`` under the given label values."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [
+                    [0] * (len(self.buckets) + 1),
+                    0.0,
+                ]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextlib.contextmanager
+    def time(self, *labelvalues):
+        """Observe the seconds spent in the ``with`` block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def count(self, *labelvalues):
+        """Return the number of observations under the given label values."""
+        with self._lock:
+            series = self._series.get(labelvalues)
+            return sum(series[0]) if series else 0
+
+    def render(self):
+        """Return the histogram as a text-format family."""
+        with self._lock:
+            series = {
+                key: (list(counts), total)
+                for key, (counts, total) in self._series.items()
+            }
+        samples = []
+        for labelvalues, (counts, total) in sorted(series.items()):
+            labels = dict(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(
+                    ("_bucket", {**labels, "le": _number(bound)}, cumulative)
+                )
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, cumulative))
+        return family(self.name, "histogram", self.documentation, samples)
+
+
+STAGE_SECONDS = Histogram(
+    "deepface_stage_seconds", "Time spent in each recognition stage.", ("stage",)
+)
+REQUEST_SECONDS = Histogram(
+    "deepface_http_request_seconds",
+    "Time to answer each endpoint.",
+    ("endpoint", "method", "status"),
+)
+BATCH_SIZE = Histogram(
+    "deepface_batch_size",
+    "Faces per batched call: identify searches and attendance bulk writes.",
+    ("kind",),
+    SIZE_BUCKETS,
+)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Time a pipeline stage: ``with metrics.stage("embed"): ...``.
+
+    The stage is also a span of the request's trace, if it is sampled, and
+    its time is logged at ``DEBUG``.
+    """
+    started = time.perf_counter()
+    try:
+        with tracing.span(name):
+            yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, name)
+        logger.debug("stage %s took %.1f ms", name, elapsed * 1000)
+
+
+def render_histograms():
+    """Return the text of every histogram kept in this module."""
+    return "".join(
+        histogram.render() for histogram in (STAGE_SECONDS, REQUEST_SECONDS, BATCH_SIZE)
+    )
@@ -0,0 +1,111 @@
+"""
+Short-lived store of face embeddings staged during enrollment.
+
+Adding a user first checks whether the face is already enrolled. A
+``/faces/verify`` call with ``"stage": true`` keeps the embedding it computed
+and returns a token for it. The following ``POST /faces`` or
+``PUT /faces/<id>`` can send that token instead of the image, so the image is
+embedded once and not sent again. The number of faces in the verified frame is
+kept with the embedding, so enrollment can still refuse a group photo.
+
+Tokens expire after ``ttl`` seconds. At most ``max_entries`` are kept; when the
+store is full, the oldest entry is evicted. An expired or evicted token is
+reported as such, and the admin captures the face again. Tokens live in one
+DeepFace process, so callers with several replicas send the follow-up call to
+the replica that issued the token.
+"""
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from src import memory
+
+
+class EmbeddingStage:  # pylint: disable=too-many-instance-attributes
+    """
+    Bounded, expiring map of tokens to embeddings.
+
+    Args:
+        ttl (float): Seconds a staged embedding stays usable.
+        max_entries (int): Most embeddings kept at once.
+    """
+
+    def __init__(self, ttl=300.0, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.staged = 0
+        self.used = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _expire(self, now):
+        """Drop entries past their TTL; call with the lock held."""
+        while self._entries:
+            token, (expires_at, _, _) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            del self._entries[token]
+            self.expired += 1
+
+    def put(self, embedding, faces=1):
+        """Stage ``embedding``, found among ``faces`` faces, and return its token."""
+        token = secrets.token_urlsafe(16)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            while len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+            self._entries[token] = (now + self.ttl, embedding, faces)
+            self.staged += 1
+        return token
+
+    def get(self, token):
+        """Return the embedding staged under ``token``, or None if gone."""
+        staged = self.lookup(token)
+        return staged[0] if staged is not None else None
+
+    def lookup(self, token):
+        """Return ``(embedding, faces)`` staged under ``token``, or None if gone."""
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            self.used += 1
+            return entry[1], entry[2]
+
+    def discard(self, token):
+        """Forget ``token`` once its face has been stored."""
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def clear(self):
+        """Drop every staged embedding, counting them as evicted."""
+        with self._lock:
+            self.evicted += len(self._entries)
+            self._entries.clear()
+
+    def memory_bytes(self):
+        """Estimate the bytes held by the staged embeddings."""
+        with self._lock:
+            entries = list(self._entries.values())
+        return sum(memory.vector_bytes(embedding) for _, embedding, _ in entries)
+
+    def stats(self):
+        """Return the store's size and counters."""
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "staged": self.staged,
+                "used": self.used,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
@@ -0,0 +1,196 @@
+"""
+Request tracing for the DeepFace service.
+
+The web app forwards its trace context in the W3C ``traceparent`` header with
+every DeepFace call. The service continues that trace, with the sampling
+decision the web app made, and records one span for the request and one for
+each recognition stage timed by ``metrics.stage`` (decode, embed, find,
+search, record, ...). A request that arrives without the header starts its own
+trace, head-sampled at ``TRACE_SAMPLE_RATE`` (default 0, tracing off).
+
+Spans of sampled traces are appended as JSON lines to ``TRACE_FILE`` (default
+``traces.jsonl``). Join them with the web app's file on ``trace_id`` to follow
+one sign-in from the kiosk's request to MongoDB.
+"""
+
+import contextlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+SERVICE = "deepface"
+TRACEPARENT = "traceparent"
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0"))
+
+TRACEPARENT_PATTERN = re.compile(
+    r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$"
+)
+
+
+@dataclass(frozen=True)
+class SpanContext:
+    """The ids and sampling decision that travel in ``traceparent``."""
+
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+
+def _new_id(nbytes):
+    return random.getrandbits(nbytes * 8).to_bytes(nbytes, "big").hex()
+
+
+def parse(header):
+    """Return the ``SpanContext`` of a ``traceparent`` value, or None if invalid."""
+    match = TRACEPARENT_PATTERN.match((header or "").strip().lower())
+    if match is None:
+        return None
+    version, trace_id, span_id, flags = match.groups()
+    if version == "ff" or trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return SpanContext(trace_id, span_id, bool(int(flags, 16) & 1))
+
+
+class FileExporter:
+    """
+    Appends finished spans to a JSON-lines file.
+
+    Args:
+        path (str): File to append to; opened on the first sampled span.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def export(self, fields):
+        """Write one span record."""
+        line = json.dumps(fields, default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                # pylint: disable-next=consider-using-with
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+
+    def flush(self):
+        """Flush written spans to the file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+
+exporter = FileExporter(TRACE_FILE)
+_current = ContextVar("trace_span", default=None)
+
+
+class Span:  # pylint: disable=too-few-public-methods
+    """
+    One timed operation in a trace. Only sampled spans are exported.
+
+    Args:
+        name (str): Operation name, e.g. ``POST /faces/verify``.
+        context (SpanContext): The span's own ids.
+        parent_id (str, optional): Span id of the parent.
+        attributes (dict, optional): Extra fields recorded with the span.
+    """
+
+    def __init__(self, name, context, parent_id=None, attributes=None):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.token = None
+
+    def end(self, **attributes):
+        """Finish the span and export it if sampled."""
+        if not self.context.sampled:
+            return
+        self.attributes.update(attributes)
+        exporter.export(
+            {
+                "service": SERVICE,
+                "trace_id": self.context.trace_id,
+                "span_id": self.context.span_id,
+                "parent_id": self.parent_id,
+                "name": self.name,
+                "start": round(self.start, 6),
+                "duration_ms": round((time.perf_counter() - self._started) * 1000, 3),
+                "attributes": self.attributes,
+            }
+        )
+
+
+def enter(name, traceparent=None, **attributes):
+    """
+    Start the span of an incoming request and make it current.
+
+    Args:
+        name (str): Span name.
+        traceparent (str, optional): The request's ``traceparent`` header. A
+            valid one is continued with its sampling decision; otherwise a new
+            trace is started and head-sampled at ``TRACE_SAMPLE_RATE``.
+
+    Returns:
+        Span: Pass it to ``leave`` when the request is done.
+    """
+    remote = parse(traceparent)
+    if remote is None:
+        context = SpanContext(
+            _new_id(16), _new_id(8), random.random() < TRACE_SAMPLE_RATE
+        )
+        request_span = Span(name, context, None, attributes)
+    else:
+        context = SpanContext(remote.trace_id, _new_id(8), remote.sampled)
+        request_span = Span(name, context, remote.span_id, attributes)
+    request_span.token = _current.set(request_span)
+    return request_span
+
+
+def leave(request_span, **attributes):
+    """End a span started with ``enter`` and restore the previous one."""
+    _current.reset(request_span.token)
+    request_span.end(**attributes)
+    if request_span.context.sampled:
+        exporter.flush()
+
+
+def current():
+    """Return the current span, or None outside a traced request."""
+    return _current.get()
+
+
+def traceparent_header():
+    """Return the ``traceparent`` to send on an outgoing call, or None."""
+    active = _current.get()
+    if active is None:
+        return None
+    context = active.context
+    return (
+        f"00-{context.trace_id}-{context.span_id}-{'01' if context.sampled else '00'}"
+    )
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Record the ``with`` block as a child of the current span, if sampled."""
+    parent = _current.get()
+    if parent is None or not parent.context.sampled:
+        yield
+        return
+    context = SpanContext(parent.context.trace_id, _new_id(8), True)
+    child = Span(name, context, parent.context.span_id, attributes)
+    token = _current.set(child)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+        child.end()
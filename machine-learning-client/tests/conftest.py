@@ -8,6 +8,7 @@ import pytest
 # Mock necessary modules before any tests are imported
 sys.modules["deepface"] = MagicMock()
 sys.modules["deepface.DeepFace"] = MagicMock()
+sys.modules["cv2"] = MagicMock()
 sys.modules["pymongo"] = MagicMock()
 sys.modules["pymongo.MongoClient"] = MagicMock()
 sys.modules["bson"] = MagicMock()
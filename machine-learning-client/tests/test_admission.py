@@ -0,0 +1,68 @@
+"""Tests for the inference admission gate."""
+
+import threading
+import pytest
+from src.admission import InferenceGate, Overloaded
+
+
+def test_slot_tracks_in_flight_and_admissions():
+    """A held slot counts as in flight and is released afterwards."""
+    gate = InferenceGate(concurrency=1, queue_depth=1)
+    with gate.slot():
+        assert gate.stats()["in_flight"] == 1
+    stats = gate.stats()
+    assert stats["in_flight"] == 0
+    assert stats["admitted"] == 1
+
+
+def test_full_queue_is_rejected_immediately():
+    """Requests beyond concurrency plus queue depth are refused."""
+    gate = InferenceGate(concurrency=1, queue_depth=0)
+    with gate.slot():
+        with pytest.raises(Overloaded) as excinfo:
+            with gate.slot():
+                pass
+    assert excinfo.value.reason == "queue_full"
+    assert excinfo.value.retry_after >= 1
+    assert gate.stats()["rejected"] == {"queue_full": 1, "timed_out": 0}
+
+
+def test_waiting_request_times_out():
+    """A queued request gives up once the queue timeout passes."""
+    gate = InferenceGate(concurrency=1, queue_depth=1, queue_timeout=0.01)
+    with gate.slot():
+        with pytest.raises(Overloaded) as excinfo:
+            with gate.slot():
+                pass
+    assert excinfo.value.reason == "timed_out"
+    assert gate.stats()["queue_depth"] == 0
+
+
+def test_waiting_request_runs_when_slot_frees():
+    """A queued request proceeds as soon as the running one finishes."""
+    gate = InferenceGate(concurrency=1, queue_depth=1, queue_timeout=5)
+    release = threading.Event()
+    started = threading.Event()
+
+    def hold():
+        with gate.slot():
+            started.set()
+            release.wait()
+
+    def wait_for_slot():
+        with gate.slot():
+            pass
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    started.wait()
+    waiter = threading.Thread(target=wait_for_slot)
+    waiter.start()
+    while gate.stats()["queue_depth"] == 0:
+        pass
+    release.set()
+    holder.join()
+    waiter.join()
+    stats = gate.stats()
+    assert stats["admitted"] == 2
+    assert stats["peak_queue_depth"] == 1
@@ -4,6 +4,7 @@
 # ^ This is disabled because pytest fixtures are intentionally redefined in test functions
 import json
 import sys
+import time
 from unittest.mock import MagicMock, patch
 import pytest
 
@@ -13,7 +14,9 @@ sys.modules["deepface.DeepFace"] = MagicMock()
 
 # Import app after mocking dependencies
 # pylint: disable=wrong-import-position
+import app as app_module
 from app import app
+from src import deadline, tracing
 
 # pylint: enable=wrong-import-position
 
@@ -56,7 +59,9 @@ def test_add_face_success(mock_df, client):
         "face_id": "123456789",
         "message": "Face added successfully",
     }
-    mock_df.add_face.assert_called_once_with("base64_encoded_image", "Test Person")
+    mock_df.add_face.assert_called_once_with(
+        "base64_encoded_image", "Test Person", None, None
+    )
 
 
 @patch("app.df")
@@ -113,7 +118,7 @@ def test_verify_face_success(mock_df, client):
         "verified": True,
         "match": {"_id": "123456789", "name": "Test Person", "distance": 5.0},
     }
-    mock_df.verify_face.assert_called_once_with("base64_encoded_image")
+    mock_df.verify_face.assert_called_once_with("base64_encoded_image", None, False)
 
 
 @patch("app.df")
@@ -178,7 +183,7 @@ def test_update_face_success(mock_df, client):
         "message": "Face updated successfully",
     }
     mock_df.replace_face.assert_called_once_with(
-        "base64_encoded_image", "Updated Person", "123456789"
+        "base64_encoded_image", "Updated Person", "123456789", None, None
     )
 
 
@@ -211,3 +216,403 @@ def test_update_face_missing_fields(mock_df, client):
 
     # Verify mock was not called
     mock_df.replace_face.assert_not_called()
+
+
+@patch("app.df")
+def test_verify_face_rejected_when_overloaded(mock_df, client):
+    """Test an overloaded inference queue answers 503 with Retry-After."""
+    # One request already running and no room to queue another
+    gate = app_module.inference_gate
+    with patch.object(gate, "queue_depth", 0), patch.object(gate, "in_flight", 1):
+        response = client.post(
+            "/faces/verify",
+            data=json.dumps({"img": "base64_encoded_image"}),
+            content_type="application/json",
+        )
+
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert json.loads(response.data)["busy"] is True
+    mock_df.verify_face.assert_not_called()
+
+
+def test_stats_reports_inference_queue(client):
+    """Test the stats endpoint exposes queue depth and rejections."""
+    response = client.get("/stats")
+    stats = json.loads(response.data)["inference"]
+    assert stats["queue_depth"] == 0
+    assert "rejected" in stats
+
+
+@patch("app.df")
+def test_verify_face_with_expired_deadline_is_dropped(mock_df, client):
+    """Test a request whose deadline already passed never reaches inference."""
+    response = client.post(
+        "/faces/verify",
+        data=json.dumps({"img": "base64_encoded_image"}),
+        content_type="application/json",
+        headers={"X-Deadline-Ms": "0"},
+    )
+
+    assert response.status_code == 504
+    mock_df.verify_face.assert_not_called()
+    stats = json.loads(client.get("/stats").data)["deadlines"]
+    assert stats["dropped"]["queue"] >= 1
+
+
+@patch("app.df")
+def test_detect_faces_with_expired_deadline_is_dropped(mock_df, client):
+    """Test a deadline passing before detection answers 504, not 500."""
+    mock_df.detect_faces.side_effect = deadline.DeadlineExceeded("detection")
+    response = client.post(
+        "/faces/detect",
+        json={"img": "base64_encoded_image"},
+        headers={"X-Deadline-Ms": "60000"},
+    )
+
+    assert response.status_code == 504
+    stats = json.loads(client.get("/stats").data)["deadlines"]
+    assert stats["dropped"]["detection"] >= 1
+
+
+@patch("src.deepface_service.DeepFace")
+def test_deadline_passing_during_decode_skips_the_embedding(mock_deepface, client):
+    """Test a deadline that runs out while decoding answers 504 before Facenet."""
+    stored = [{"_id": "abc", "name": "Test Person", "img_vectors": [0.1]}]
+    with patch.object(app_module.df.faces, "find", return_value=stored), patch(
+        "src.deepface_service._decode", side_effect=lambda image: time.sleep(0.05)
+    ):
+        response = client.post(
+            "/faces/verify",
+            json={"img": "base64_encoded_image"},
+            headers={"X-Deadline-Ms": "20"},
+        )
+
+    assert response.status_code == 504
+    mock_deepface.represent.assert_not_called()
+    stats = json.loads(client.get("/stats").data)["deadlines"]
+    assert stats["dropped"]["embedding"] >= 1
+
+
+@patch("app.df")
+def test_verify_face_passes_site(mock_df, client):
+    """A gate's site narrows the search to that site's faces."""
+    mock_df.verify_face.return_value = {"success": True, "verified": False}
+    client.post(
+        "/faces/verify",
+        data=json.dumps({"img": "base64_encoded_image", "site": "north"}),
+        content_type="application/json",
+    )
+    mock_df.verify_face.assert_called_once_with("base64_encoded_image", "north", False)
+
+
+@patch("app.df")
+def test_add_face_rejects_malformed_sites(mock_df, client):
+    """Sites must be a list of names."""
+    response = client.post(
+        "/faces",
+        data=json.dumps({"img": "x", "name": "Test Person", "sites": "north"}),
+        content_type="application/json",
+    )
+    assert response.status_code == 400
+    mock_df.add_face.assert_not_called()
+
+
+@patch("app.attendance_recorder")
+@patch("app.df")
+def test_signins_verifies_and_records(mock_df, mock_recorder, client):
+    """Test a recognised face is recorded in the same call, with timings."""
+    mock_df.verify_face.return_value = {
+        "success": True,
+        "verified": True,
+        "match": {"_id": "123456789", "name": "Test Person", "distance": 5.0},
+    }
+    mock_recorder.record.return_value = {"first": True, "attendance_id": "a1"}
+
+    response = client.post(
+        "/signins",
+        data=json.dumps({"img": "base64_encoded_image", "site": "north"}),
+        content_type="application/json",
+    )
+
+    assert response.status_code == 200
+    body = json.loads(response.data)
+    assert body["first"] is True
+    assert body["attendance_id"] == "a1"
+    mock_df.verify_face.assert_called_once_with("base64_encoded_image", "north")
+    mock_recorder.record.assert_called_once_with("123456789")
+    assert "verify;dur=" in response.headers["Server-Timing"]
+    assert "record;dur=" in response.headers["Server-Timing"]
+
+
+@patch("app.attendance_recorder")
+@patch("app.df")
+def test_signins_does_not_record_unknown_face(mock_df, mock_recorder, client):
+    """Test nothing is written when the face is not recognised."""
+    mock_df.verify_face.return_value = {"success": True, "verified": False}
+
+    response = client.post(
+        "/signins",
+        data=json.dumps({"img": "base64_encoded_image"}),
+        content_type="application/json",
+    )
+
+    assert json.loads(response.data) == {"success": True, "verified": False}
+    mock_recorder.record.assert_not_called()
+
+
+class _MongoDown(Exception):
+    """Stands in for pymongo's base error, which conftest mocks out."""
+
+
+@patch("app.errors.PyMongoError", _MongoDown)
+@patch("app.attendance_recorder")
+@patch("app.df")
+def test_signins_reports_a_failed_attendance_write(mock_df, mock_recorder, client):
+    """Test a database error after verifying becomes a 503 JSON reply."""
+    mock_df.verify_face.return_value = {
+        "success": True,
+        "verified": True,
+        "match": {"_id": "a"},
+    }
+    mock_recorder.record.side_effect = _MongoDown("no primary")
+
+    response = client.post(
+        "/signins",
+        data=json.dumps({"img": "base64_encoded_image"}),
+        content_type="application/json",
+    )
+
+    assert response.status_code == 503
+    body = json.loads(response.data)
+    assert body["success"] is False
+    assert "no primary" in body["message"]
+
+
+@patch("app.errors.PyMongoError", _MongoDown)
+@patch("app.attendance_recorder")
+@patch("app.df")
+def test_identify_reports_a_failed_attendance_write(mock_df, mock_recorder, client):
+    """Test a failed bulk attendance write becomes a 503 JSON reply."""
+    mock_df.identify_faces.return_value = {
+        "success": True,
+        "faces": [{"box": {"x": 0}, "verified": True, "match": {"_id": "a"}}],
+    }
+    mock_recorder.record_many.side_effect = _MongoDown("no primary")
+
+    response = client.post(
+        "/faces/identify",
+        data=json.dumps({"img": "base64_encoded_image", "record": True}),
+        content_type="application/json",
+    )
+
+    assert response.status_code == 503
+    assert json.loads(response.data)["success"] is False
+
+
+@patch("app.df")
+def test_add_face_with_staged_token(mock_df, client):
+    """Test a staged token can stand in for the image."""
+    mock_df.add_face.return_value = {"success": True, "face_id": "1"}
+    response = client.post(
+        "/faces",
+        data=json.dumps({"token": "tok", "name": "Test Person"}),
+        content_type="application/json",
+    )
+    assert response.status_code == 201
+    mock_df.add_face.assert_called_once_with(None, "Test Person", None, "tok")
+
+
+@patch("app.attendance_recorder")
+@patch("app.df")
+def test_identify_records_everyone_recognised(mock_df, mock_recorder, client):
+    """Test a group capture records recognised faces in one bulk call."""
+    mock_df.identify_faces.return_value = {
+        "success": True,
+        "faces": [
+            {"box": {"x": 0}, "verified": True, "match": {"_id": "a"}},
+            {"box": {"x": 50}, "verified": False},
+        ],
+    }
+    mock_recorder.record_many.return_value = {
+        "a": {"first": True, "attendance_id": "a1"}
+    }
+
+    response = client.post(
+        "/faces/identify",
+        data=json.dumps({"img": "base64_encoded_image", "record": True}),
+        content_type="application/json",
+    )
+
+    body = json.loads(response.data)
+    assert body["faces"][0]["first"] is True
+    assert "first" not in body["faces"][1]
+    mock_df.identify_faces.assert_called_once_with("base64_encoded_image", None)
+    mock_recorder.record_many.assert_called_once_with(["a"])
+    assert "record;dur=" in response.headers["Server-Timing"]
+
+    client.post(
+        "/faces/identify",
+        data=json.dumps({"img": "base64_encoded_image"}),
+        content_type="application/json",
+    )
+    mock_recorder.record_many.assert_called_once()
+
+
+@patch("app.df")
+def test_detect_faces_route(mock_df, client):
+    """Test the detection route passes the image through."""
+    mock_df.detect_faces.return_value = {"success": True, "faces": []}
+
+    response = client.post(
+        "/faces/detect",
+        data=json.dumps({"img": "base64_encoded_image"}),
+        content_type="application/json",
+    )
+
+    assert json.loads(response.data) == {"success": True, "faces": []}
+    mock_df.detect_faces.assert_called_once_with("base64_encoded_image")
+    assert client.post("/faces/detect", json={}).status_code == 400
+
+
+@patch("app.df")
+def test_metrics_in_prometheus_text_format(mock_df, client):
+    """Test /metrics exposes endpoint timings, gallery size and cache stats."""
+    mock_df.verify_face.return_value = {"success": True, "verified": False}
+    mock_df.gallery_size.return_value = {"0": 3, "1": 4}
+    client.post("/faces/verify", json={"img": "base64_encoded_image"})
+
+    response = client.get("/metrics")
+
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    text = response.data.decode()
+    assert (
+        'deepface_http_request_seconds_count{endpoint="/faces/verify",'
+        'method="POST",status="200"}'
+    ) in text
+    assert 'deepface_gallery_faces{shard="1"} 4' in text
+    assert "# TYPE deepface_staged_embeddings gauge" in text
+    assert "# TYPE deepface_stage_seconds histogram" in text
+
+
+@patch("app.df")
+def test_requests_continue_the_callers_trace(mock_df, client, tmp_path):
+    """Test a sampled traceparent makes the request a span of that trace."""
+    mock_df.verify_face.return_value = {"success": True, "verified": False}
+    exporter = tracing.FileExporter(str(tmp_path / "traces.jsonl"))
+    parent = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+    with patch.object(tracing, "exporter", exporter):
+        client.post(
+            "/faces/verify",
+            json={"img": "base64_encoded_image"},
+            headers={"traceparent": parent},
+        )
+
+    with open(exporter.path, encoding="utf-8") as file:
+        (span,) = [json.loads(line) for line in file]
+    assert span["name"] == "POST /faces/verify"
+    assert span["trace_id"] == "0af7651916cd43dd8448eb211c80319c"
+    assert span["parent_id"] == "b7ad6b7169203331"
+    assert span["attributes"]["status"] == 200
+
+
+def test_profile_requires_token(client, tmp_path):
+    """Test /profile is hidden without a token and refuses a wrong one."""
+    assert client.get("/profile").status_code == 404
+    with patch("app.PROFILE_TOKEN", "secret"), patch.object(
+        app_module.profiler, "directory", str(tmp_path)
+    ):
+        assert (
+            client.get("/profile", headers={"X-Profile-Token": "nope"}).status_code
+            == 403
+        )
+        response = client.post(
+            "/profile",
+            json={"seconds": 0.05},
+            headers={"X-Profile-Token": "secret"},
+        )
+        assert response.get_json()["running"] == "window"
+        app_module.profiler.wait()
+    assert len(app_module.profiler.status()["written"]) == 2
+
+
+def _over_budget():
+    """Return a guard whose process is always over its 100-byte budget."""
+    guard = app_module.memory.MemoryGuard(
+        100, interval=0, cooldown=0, read_rss=lambda: 200
+    )
+    guard.on_pressure(app_module.staged_faces.clear)
+    return guard
+
+
+@patch("app.df")
+def test_add_face_refused_over_memory_budget(mock_df, client):
+    """Test enrollment is refused with a 503 while over the memory budget."""
+    with patch("app.memory_guard", _over_budget()):
+        response = client.post(
+            "/faces", json={"img": "base64_encoded_image", "name": "Test Person"}
+        )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "30"
+    assert response.get_json()["busy"] is True
+    mock_df.add_face.assert_not_called()
+
+
+@patch("app.df")
+def test_verify_face_stages_nothing_over_memory_budget(mock_df, client):
+    """Test verify still answers over budget but does not stage the embedding."""
+    mock_df.verify_face.return_value = {"success": True, "verified": False}
+    with patch("app.memory_guard", _over_budget()):
+        response = client.post(
+            "/faces/verify", json={"img": "base64_encoded_image", "stage": True}
+        )
+    assert response.status_code == 200
+    mock_df.verify_face.assert_called_once_with("base64_encoded_image", None, False)
+
+
+@patch("app.df")
+def test_memory_report(mock_df, client):
+    """Test /memory is token-protected and reports the RSS, budget and holders."""
+    mock_df.memory_usage.return_value = {
+        "model": {"weights_bytes": 90_000_000, "rss_growth_bytes": 400_000_000},
+        "gallery_bytes": 2048,
+        "staged_bytes": 0,
+    }
+    assert client.get("/memory").status_code == 404
+    with patch("app.PROFILE_TOKEN", "secret"):
+        assert (
+            client.get("/memory", headers={"X-Profile-Token": "nope"}).status_code
+            == 403
+        )
+        report = client.get("/memory", headers={"X-Profile-Token": "secret"}).get_json()
+    assert report["rss_bytes"] > 0
+    assert report["gallery_bytes"] == 2048
+    assert report["model"]["weights_bytes"] == 90_000_000
+    assert "budget_bytes" in report["guard"]
+    assert "allocations" not in report
+
+    text = client.get("/metrics").data.decode()
+    assert 'deepface_memory_bytes{kind="gallery"} 2048' in text
+    assert 'deepface_memory_bytes{kind="model_weights"} 90000000' in text
+
+
+def test_tracemalloc_requires_token(client):
+    """Test allocation tracing is token-protected and shows up in /memory."""
+    assert client.post("/memory/tracemalloc", json={"action": "start"}).status_code == (
+        404
+    )
+    headers = {"X-Profile-Token": "secret"}
+    with patch("app.PROFILE_TOKEN", "secret"):
+        assert (
+            client.post("/memory/tracemalloc", json={}, headers=headers).status_code
+            == 400
+        )
+        client.post("/memory/tracemalloc", json={"action": "start"}, headers=headers)
+        try:
+            report = client.get("/memory", headers=headers).get_json()
+        finally:
+            client.post("/memory/tracemalloc", json={"action": "stop"}, headers=headers)
+        after = client.get("/memory", headers=headers).get_json()
+    assert report["allocations"]["tracing"] is True
+    assert after.get("allocations") is None
@@ -0,0 +1,113 @@
+"""Tests for single-hop attendance recording."""
+
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+from src.attendance import AttendanceRecorder, partition_name
+
+NOW = datetime(2025, 4, 30, 23, 30, tzinfo=timezone.utc)
+
+
+class _DuplicateKeyError(Exception):
+    """Stand-in for pymongo's DuplicateKeyError, which is mocked in tests."""
+
+
+def _database():
+    """Return a mock database with a separate mock per collection."""
+    db = MagicMock()
+    collections = {}
+    db.__getitem__.side_effect = lambda name: collections.setdefault(name, MagicMock())
+    return db
+
+
+def test_first_signin_upserts_daily_key_and_rollups():
+    """A first sign-in writes the daily record and bumps both rollups."""
+    db = _database()
+    db["attendance_2025_04"].update_one.return_value.upserted_id = "new-id"
+
+    result = AttendanceRecorder(db).record("abc", NOW)
+
+    assert result == {"first": True, "attendance_id": "new-id"}
+    partition = db["attendance_2025_04"]
+    query, update = partition.update_one.call_args.args
+    assert query["local_date"] == "2025-04-30"
+    assert update == {"$setOnInsert": {"timestamp": NOW}}
+    assert partition.update_one.call_args.kwargs == {"upsert": True}
+    db["attendance_daily"].update_one.assert_called_once_with(
+        {"_id": "2025-04-30"}, {"$inc": {"count": 1}}, upsert=True
+    )
+
+
+def test_repeat_signin_writes_nothing_else():
+    """An existing daily key is not a first sign-in and skips the rollups."""
+    db = _database()
+    db["attendance_2025_04"].update_one.return_value.upserted_id = None
+
+    assert AttendanceRecorder(db).record("abc", NOW) == {
+        "first": False,
+        "attendance_id": None,
+    }
+    db["attendance_daily"].update_one.assert_not_called()
+
+
+def test_concurrent_duplicate_is_not_first():
+    """Losing the race on the unique daily key is a repeat sign-in."""
+    db = _database()
+    db["attendance_2025_04"].update_one.side_effect = _DuplicateKeyError()
+    with patch("src.attendance.errors.DuplicateKeyError", _DuplicateKeyError):
+        assert AttendanceRecorder(db).record("abc", NOW)["first"] is False
+
+
+def test_local_day_follows_site_timezone():
+    """The attendance day and partition come from the site timezone."""
+    db = _database()
+    recorder = AttendanceRecorder(db, "Asia/Tokyo")
+    recorder.record("abc", NOW.astimezone(recorder.timezone))
+    query, _ = db["attendance_2025_05"].update_one.call_args.args
+    assert query["local_date"] == "2025-05-01"
+    assert partition_name("2025-05-01") == "attendance_2025_05"
+
+
+class _BulkWriteError(Exception):
+    """Stand-in for pymongo's BulkWriteError, which is mocked in tests."""
+
+    def __init__(self, details):
+        super().__init__("bulk write error")
+        self.details = details
+
+
+def test_group_signin_is_one_bulk_write():
+    """Several faces are recorded by one unordered bulk write."""
+    db = _database()
+    partition = db["attendance_2025_04"]
+    partition.bulk_write.return_value.upserted_ids = {0: "id-a", 2: "id-c"}
+
+    results = AttendanceRecorder(db).record_many(["a", "b", "c"], NOW)
+
+    assert results == {
+        "a": {"first": True, "attendance_id": "id-a"},
+        "b": {"first": False, "attendance_id": None},
+        "c": {"first": True, "attendance_id": "id-c"},
+    }
+    partition.bulk_write.assert_called_once()
+    assert len(partition.bulk_write.call_args.args[0]) == 3
+    assert partition.bulk_write.call_args.kwargs == {"ordered": False}
+    partition.update_one.assert_not_called()
+    db["attendance_daily"].update_one.assert_called_once_with(
+        {"_id": "2025-04-30"}, {"$inc": {"count": 2}}, upsert=True
+    )
+    assert len(db["attendance_monthly"].bulk_write.call_args.args[0]) == 2
+
+
+def test_group_signin_duplicates_are_repeats():
+    """Daily keys lost to concurrent sign-ins are repeats; the rest are first."""
+    db = _database()
+    db["attendance_2025_04"].bulk_write.side_effect = _BulkWriteError(
+        {
+            "writeErrors": [{"index": 0, "code": 11000}],
+            "upserted": [{"index": 1, "_id": "id-b"}],
+        }
+    )
+    with patch("src.attendance.errors.BulkWriteError", _BulkWriteError):
+        results = AttendanceRecorder(db).record_many(["a", "b"], NOW)
+    assert [results[face]["first"] for face in ("a", "b")] == [False, True]
+    assert AttendanceRecorder(_database()).record_many([], NOW) == {}
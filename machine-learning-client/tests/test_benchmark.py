@@ -0,0 +1,59 @@
+"""Tests for the gallery benchmark."""
+
+import benchmark
+
+
+def test_case_finds_every_probe_in_both_modes():
+    """A small run finds the right face and reports every phase."""
+    for mode in ("scan", "local:2"):
+        result = benchmark.run_case(mode, 300, queries=20, writes=5, concurrency=2)
+        assert result["hit_rate"] == 1.0
+        assert result["verify_count"] == 20
+        assert result["add_count"] == result["delete_count"] == 5
+        assert result["verify_after_add_count"] == 5
+        assert result["throughput_qps"] > 0
+    assert result["gallery_bytes"] > 0
+
+
+def test_suite_skips_scan_above_limit():
+    """Scanning is only benchmarked up to the scan limit."""
+    report = benchmark.run_suite(
+        [100, 200],
+        ["scan"],
+        scan_limit=100,
+        isolate=False,
+        queries=5,
+        writes=2,
+        concurrency=1,
+    )
+    results = report["results"]
+    assert results[0]["hit_rate"] == 1.0
+    assert results[1] == {"mode": "scan", "size": 200, "skipped": "above --scan-limit"}
+
+
+def test_compare_flags_only_real_regressions():
+    """Slowdowns past the tolerance are flagged; noise and new cases are not."""
+    baseline = {
+        "results": [
+            {"mode": "local:1", "size": 1000, "verify_p50_ms": 1.0},
+            {"mode": "local:1", "size": 10000, "verify_p50_ms": 0.01},
+        ]
+    }
+    report = {
+        "results": [
+            {"mode": "local:1", "size": 1000, "verify_p50_ms": 1.5},
+            {"mode": "local:1", "size": 10000, "verify_p50_ms": 0.05},
+            {"mode": "local:4", "size": 1000, "verify_p50_ms": 9.0},
+        ]
+    }
+    assert benchmark.compare(report, baseline) == [
+        {
+            "mode": "local:1",
+            "size": 1000,
+            "metric": "verify_p50_ms",
+            "baseline": 1.0,
+            "current": 1.5,
+            "change": 0.5,
+        }
+    ]
+    assert not benchmark.compare(report, baseline, tolerance=0.6)
@@ -0,0 +1,51 @@
+"""Tests for propagated request deadlines."""
+
+import pytest
+from src import deadline
+from src.admission import InferenceGate
+
+
+def test_from_header_parses_milliseconds():
+    """A numeric header becomes a deadline; anything else means none."""
+    assert 0 < deadline.Deadline.from_header("1500").remaining() <= 1.5
+    assert deadline.Deadline.from_header(None) is None
+    assert deadline.Deadline.from_header("soon") is None
+
+
+def test_check_raises_for_expired_current_deadline():
+    """Only an expired deadline of the current request stops a stage."""
+    token = deadline.current.set(deadline.Deadline(5))
+    deadline.check("embedding")
+    deadline.current.reset(token)
+
+    token = deadline.current.set(deadline.Deadline(0))
+    with pytest.raises(deadline.DeadlineExceeded) as excinfo:
+        deadline.check("embedding")
+    deadline.current.reset(token)
+    assert excinfo.value.stage == "embedding"
+
+
+def test_gate_stops_waiting_at_deadline():
+    """A queued request is dropped when its deadline passes, not rejected."""
+    gate = InferenceGate(concurrency=1, queue_depth=1, queue_timeout=5)
+    with gate.slot():
+        with pytest.raises(deadline.DeadlineExceeded) as excinfo:
+            with gate.slot(deadline.Deadline(0.01)):
+                pass
+    assert excinfo.value.stage == "queue"
+    assert gate.stats()["rejected"] == {"queue_full": 0, "timed_out": 0}
+
+
+def test_avoided_work_counts_per_stage():
+    """Dropped requests are counted per stage."""
+    avoided = deadline.AvoidedWork()
+    avoided.record("queue")
+    avoided.record("embedding")
+    stats = avoided.stats()
+    assert stats["dropped"] == {
+        "queue": 1,
+        "decode": 0,
+        "detection": 0,
+        "embedding": 1,
+    }
+    assert stats["embeddings_avoided"] == 2
@@ -33,7 +33,9 @@ ObjectId = MockObjectId
 
 # Import the service after mocking dependencies
 # pylint: disable=wrong-import-position
+from src import deadline, metrics
 from src.deepface_service import DeepFaceService
+from src.gallery import GalleryShard, ShardedGallery
 
 # pylint: enable=wrong-import-position
 
@@ -285,6 +287,24 @@ def test_delete_face_not_found(deepface_service):
     assert result == {"success": False, "message": "Face not found"}
 
 
+@patch("src.deepface_service.DeepFace")
+def test_deleted_face_stops_verifying_with_local_shards(
+    mock_deepface, deepface_service
+):
+    """A delete evicts the face from the in-process shards straight away."""
+    deepface_service.gallery = ShardedGallery([GalleryShard(i, 2) for i in range(2)])
+    mock_deepface.represent.return_value = [{"embedding": [0.1, 0.2, 0.3]}]
+    deepface_service.faces.insert_one.return_value.inserted_id = ObjectId("abc")
+    deepface_service.add_face("base64_image_data", "Test Person")
+    assert deepface_service.verify_face("base64_image_data")["verified"] is True
+
+    # Another replica already removed the stored face; this one still evicts it
+    deepface_service.faces.delete_one.return_value.deleted_count = 0
+    deepface_service.delete_face("abc")
+
+    assert deepface_service.verify_face("base64_image_data")["verified"] is False
+
+
 def test_delete_face_error(deepface_service):
     """Test handling errors when deleting a face."""
     # Mock MongoDB delete_one raising an exception
@@ -405,3 +425,291 @@ def test_replace_face_error(mock_deepface, deepface_service):
 
     # Assertions
     assert result == {"success": False, "message": "Error: Test exception"}
+
+
+@patch("src.deepface_service.DeepFace")
+def test_verify_face_skips_embedding_after_deadline(mock_deepface, deepface_service):
+    """Test an expired deadline stops verification before the embedding."""
+    deepface_service.faces.find.return_value = [
+        {"_id": "1", "name": "A", "img_vectors": [0.1]}
+    ]
+    token = deadline.current.set(deadline.Deadline(0))
+    try:
+        with pytest.raises(deadline.DeadlineExceeded):
+            deepface_service.verify_face("base64_image_data")
+    finally:
+        deadline.current.reset(token)
+    mock_deepface.represent.assert_not_called()
+
+
+@patch("src.deepface_service.DeepFace")
+def test_verify_face_uses_sharded_gallery(mock_deepface, deepface_service):
+    """With a gallery the probe is embedded once and searched across shards."""
+    deepface_service.gallery = MagicMock()
+    deepface_service.gallery.search.return_value = [
+        {"_id": "6239121d1d9d3d6e8bbc66c1", "name": "Test Person", "distance": 4.0}
+    ]
+    mock_deepface.represent.return_value = [{"embedding": [0.1, 0.2, 0.3]}]
+
+    result = deepface_service.verify_face("base64_image_data")
+
+    deepface_service.faces.find.assert_not_called()
+    deepface_service.gallery.search.assert_called_once_with(
+        [0.1, 0.2, 0.3], k=1, site=None
+    )
+    assert result["verified"] is True
+    assert result["match"]["name"] == "Test Person"
+
+    deepface_service.gallery.search.return_value = []
+    assert deepface_service.verify_face("base64_image_data")["verified"] is False
+
+
+@patch("src.deepface_service.DeepFace")
+def test_add_face_indexes_in_gallery(mock_deepface, deepface_service):
+    """A stored face is copied to the gallery; a shard failure is not fatal."""
+    deepface_service.gallery = MagicMock()
+    deepface_service.gallery.upsert.side_effect = OSError("shard down")
+    mock_deepface.represent.return_value = [{"embedding": [0.1, 0.2, 0.3]}]
+    deepface_service.faces.insert_one.return_value.inserted_id = ObjectId("abc")
+
+    result = deepface_service.add_face("base64_image_data", "Test Person")
+
+    deepface_service.gallery.upsert.assert_called_once_with(
+        "abc", "Test Person", [0.1, 0.2, 0.3], None
+    )
+    assert result["success"] is True
+
+
+@patch("src.deepface_service.DeepFace")
+def test_verify_face_scans_only_the_requested_site(mock_deepface, deepface_service):
+    """A site limits the database scan to faces tagged with it."""
+    deepface_service.faces.find.return_value = []
+    deepface_service.verify_face("base64_image_data", site="north")
+    deepface_service.faces.find.assert_called_once_with({"sites": "north"})
+    mock_deepface.represent.assert_not_called()
+
+
+@patch("src.deepface_service.DeepFace")
+def test_add_face_stores_sites(mock_deepface, deepface_service):
+    """Sites are stored with the face and copied to the gallery."""
+    deepface_service.gallery = MagicMock()
+    mock_deepface.represent.return_value = [{"embedding": [0.1]}]
+    deepface_service.faces.insert_one.return_value.inserted_id = ObjectId("abc")
+
+    deepface_service.add_face("base64_image_data", "Test Person", ["north"])
+
+    deepface_service.faces.insert_one.assert_called_once_with(
+        {"name": "Test Person", "img_vectors": [0.1], "sites": ["north"]}
+    )
+    deepface_service.gallery.upsert.assert_called_once_with(
+        "abc", "Test Person", [0.1], ["north"]
+    )
+
+
+@patch("src.deepface_service.DeepFace")
+def test_staged_verify_then_add_embeds_once(mock_deepface, deepface_service):
+    """A staged verify lets the following add reuse its embedding."""
+    deepface_service.faces.find.return_value = []
+    mock_deepface.represent.return_value = [{"embedding": [0.1, 0.2, 0.3]}]
+    deepface_service.faces.insert_one.return_value.inserted_id = ObjectId("abc")
+
+    verified = deepface_service.verify_face("base64_image_data", stage=True)
+    result = deepface_service.add_face(None, "Test Person", token=verified["token"])
+
+    assert verified["verified"] is False
+    assert mock_deepface.represent.call_count == 1
+    deepface_service.faces.insert_one.assert_called_once_with(
+        {"name": "Test Person", "img_vectors": [0.1, 0.2, 0.3]}
+    )
+    assert result["success"] is True
+    # The token is spent once the face is stored
+    again = deepface_service.add_face(None, "Test Person", token=verified["token"])
+    assert again["expired"] is True
+
+
+@patch("src.deepface_service.DeepFace")
+def test_staged_group_photo_is_not_enrolled(mock_deepface, deepface_service):
+    """A token from a frame with several faces is refused like the image."""
+    deepface_service.faces.find.return_value = []
+    mock_deepface.represent.return_value = [
+        _detected([0.1], 0, 100),
+        _detected([0.2], 200, 50),
+    ]
+
+    verified = deepface_service.verify_face("base64_image_data", stage=True)
+    result = deepface_service.add_face(None, "Test Person", token=verified["token"])
+
+    assert result["success"] is False
+    assert "2 faces detected" in result["message"]
+    deepface_service.faces.insert_one.assert_not_called()
+
+
+@patch("src.deepface_service.ObjectId", side_effect=lambda x: x)
+def test_replace_face_with_expired_token(mock_objectid, deepface_service):
+    """An unknown token asks for a new capture and changes nothing."""
+    deepface_service.faces.find_one.return_value = {"_id": "1", "name": "Old"}
+
+    result = deepface_service.replace_face(None, "New", "1", token="gone")
+
+    assert result["success"] is False
+    assert result["expired"] is True
+    mock_objectid.assert_called_with("1")
+    deepface_service.faces.update_one.assert_not_called()
+
+
+def _detected(embedding, x, size):
+    """Return a DeepFace.represent entry for a face at ``x`` of ``size`` pixels."""
+    return {
+        "embedding": embedding,
+        "facial_area": {"x": x, "y": 10, "w": size, "h": size},
+    }
+
+
+@patch("src.deepface_service.DeepFace")
+def test_identify_faces_finds_everyone_in_one_scan(mock_deepface, deepface_service):
+    """Every detected face is matched, largest first, with its bounding box."""
+    deepface_service.faces.find.return_value = [
+        {"_id": "a", "name": "Ann", "img_vectors": [0.0, 0.0]},
+        {"_id": "b", "name": "Bob", "img_vectors": [100.0, 0.0]},
+    ]
+    mock_deepface.represent.return_value = [
+        _detected([1.0, 0.0], 0, 40),
+        _detected([99.0, 0.0], 50, 80),
+        _detected([50.0, 50.0], 120, 60),
+    ]
+
+    result = deepface_service.identify_faces("base64_image_data", site="north")
+
+    mock_deepface.represent.assert_called_once()
+    deepface_service.faces.find.assert_called_once()
+    assert deepface_service.faces.find.call_args.args[0] == {"sites": "north"}
+    assert result["success"] is True
+    assert [face["box"]["x"] for face in result["faces"]] == [50, 120, 0]
+    assert result["faces"][0]["box"] == {"x": 50, "y": 10, "w": 80, "h": 80}
+    assert [face["verified"] for face in result["faces"]] == [True, False, True]
+    assert result["faces"][0]["match"]["name"] == "Bob"
+    assert result["faces"][2]["match"]["name"] == "Ann"
+
+
+@patch("src.deepface_service.DeepFace")
+def test_identify_faces_searches_gallery_once(mock_deepface, deepface_service):
+    """All probes go to the gallery together; one person matches one face."""
+    deepface_service.gallery = MagicMock()
+    deepface_service.gallery.search_many.return_value = [
+        [{"_id": "a", "name": "Ann", "distance": 6.0}],
+        [{"_id": "a", "name": "Ann", "distance": 2.0}],
+    ]
+    mock_deepface.represent.return_value = [
+        _detected([0.1], 0, 50),
+        _detected([0.2], 60, 40),
+    ]
+
+    result = deepface_service.identify_faces("base64_image_data")
+
+    deepface_service.gallery.search_many.assert_called_once_with(
+        [[0.1], [0.2]], k=1, site=None
+    )
+    assert [face["verified"] for face in result["faces"]] == [False, True]
+    assert "match" not in result["faces"][0]
+
+
+@patch("src.deepface_service.DeepFace")
+def test_verify_uses_largest_face_and_add_needs_one(mock_deepface, deepface_service):
+    """Verify checks the nearest person; enrollment rejects group shots."""
+    deepface_service.gallery = MagicMock()
+    deepface_service.gallery.search.return_value = []
+    mock_deepface.represent.return_value = [
+        _detected([0.1], 0, 20),
+        _detected([0.2], 60, 90),
+    ]
+
+    deepface_service.verify_face("base64_image_data")
+    result = deepface_service.add_face("base64_image_data", "Test Person")
+
+    assert deepface_service.gallery.search.call_args.args[0] == [0.2]
+    assert result["success"] is False
+    assert "2 faces detected" in result["message"]
+    deepface_service.faces.insert_one.assert_not_called()
+
+
+@patch("src.deepface_service.DeepFace")
+def test_detect_faces_skips_embedding(mock_deepface, deepface_service):
+    """Detection reports boxes and quality without running Facenet."""
+    checkerboard = [[(x + y) % 2 for x in range(8)] for y in range(8)]
+    flat = [[0.5] * 8 for _ in range(8)]
+    mock_deepface.extract_faces.return_value = [
+        {
+            "face": flat,
+            "facial_area": {"x": 0, "y": 0, "w": 20, "h": 20},
+            "confidence": 0.8,
+        },
+        {
+            "face": checkerboard,
+            "facial_area": {"x": 40, "y": 5, "w": 60, "h": 60},
+            "confidence": 0.9,
+        },
+    ]
+
+    result = deepface_service.detect_faces("base64_image_data")
+
+    mock_deepface.represent.assert_not_called()
+    assert mock_deepface.extract_faces.call_args.kwargs["enforce_detection"] is False
+    assert [face["box"]["x"] for face in result["faces"]] == [40, 0]
+    assert result["faces"][0]["sharpness"] > result["faces"][1]["sharpness"] == 0
+
+    # Without a face DeepFace returns the whole frame with confidence 0
+    mock_deepface.extract_faces.return_value = [
+        {"face": flat, "facial_area": {"x": 0, "y": 0, "w": 8, "h": 8}, "confidence": 0}
+    ]
+    assert deepface_service.detect_faces("base64_image_data")["faces"] == []
+
+
+@patch("src.deepface_service.cv2")
+@patch("src.deepface_service.DeepFace")
+def test_data_urls_are_decoded_and_timed(mock_deepface, mock_cv2, deepface_service):
+    """A data URL is decoded once, up front, and each stage is timed."""
+    deepface_service.gallery = MagicMock()
+    deepface_service.gallery.search.return_value = []
+    mock_deepface.represent.return_value = [{"embedding": [0.1]}]
+    before = {
+        stage: metrics.STAGE_SECONDS.count(stage)
+        for stage in ("decode", "embed", "search")
+    }
+
+    deepface_service.verify_face("data:image/jpeg;base64,QUJD")
+
+    mock_cv2.imdecode.assert_called_once()
+    assert mock_deepface.represent.call_args.kwargs["img_path"] is (
+        mock_cv2.imdecode.return_value
+    )
+    for stage, count in before.items():
+        assert metrics.STAGE_SECONDS.count(stage) == count + 1
+
+    mock_cv2.imdecode.return_value = None
+    result = deepface_service.verify_face("data:image/jpeg;base64,QUJD")
+    assert result == {"success": False, "message": "Error: Could not decode the image"}
+
+
+def test_gallery_size_counts_local_shards(deepface_service):
+    """Sizes come from in-process shards, or MongoDB without a gallery."""
+    deepface_service.faces.estimated_document_count.return_value = 7
+    assert deepface_service.gallery_size() == {"all": 7}
+
+
+@patch("src.deepface_service.DeepFace")
+def test_warm_up_notes_model_footprint(mock_deepface, deepface_service):
+    """Warming up records the model's weight size for memory_usage."""
+    weights = MagicMock(nbytes=1000)
+    mock_deepface.build_model.return_value.model.get_weights.return_value = [
+        weights,
+        weights,
+    ]
+    assert deepface_service.memory_usage()["model"] is None
+
+    assert deepface_service.warm_up() >= 0
+
+    usage = deepface_service.memory_usage()
+    assert usage["model"]["weights_bytes"] == 2000
+    assert "rss_growth_bytes" in usage["model"]
+    assert usage["gallery_bytes"] == 0
+    assert usage["staged_bytes"] == 0
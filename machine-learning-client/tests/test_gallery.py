@@ -0,0 +1,273 @@
+"""Tests for the sharded gallery and the shard server."""
+
+import io
+import json
+import random
+import time
+from unittest.mock import MagicMock, patch
+import numpy as np
+import pytest
+import shard as shard_module
+from src import deadline, tracing
+from src.gallery import (
+    GalleryShard,
+    RemoteShard,
+    ShardedGallery,
+    from_env,
+    shard_of,
+)
+
+
+def _faces(count, dims=8, seed=7):
+    rng = random.Random(seed)
+    return [
+        {
+            "_id": f"{i:024x}",
+            "name": f"Person {i}",
+            "img_vectors": [rng.uniform(-1, 1) for _ in range(dims)],
+        }
+        for i in range(count)
+    ]
+
+
+def _gallery(faces, count):
+    shards = [GalleryShard(index, count) for index in range(count)]
+    for part in shards:
+        part.load(faces)
+    return ShardedGallery(shards)
+
+
+def test_shard_of_is_stable_and_partitions():
+    """Every face lands on exactly one shard, the same one every time."""
+    faces = _faces(100)
+    gallery = _gallery(faces, 4)
+    assert sum(part.stats()["faces"] for part in gallery.shards) == 100
+    assert shard_of("6239121d1d9d3d6e8bbc66c0", 4) == shard_of(
+        "6239121d1d9d3d6e8bbc66c0", 4
+    )
+
+
+@pytest.mark.parametrize("shards", [2, 3, 8])
+@pytest.mark.parametrize("k", [1, 5])
+def test_sharded_search_matches_single_node(shards, k):
+    """Scatter-gather returns exactly the single-shard answer."""
+    faces = _faces(300)
+    single = _gallery(faces, 1)
+    sharded = _gallery(faces, shards)
+    rng = random.Random(3)
+    for _ in range(20):
+        probe = [rng.uniform(-1, 1) for _ in range(8)]
+        assert sharded.search(probe, k) == single.search(probe, k)
+
+
+def test_batched_search_matches_one_probe_at_a_time():
+    """search_many answers each probe exactly as search does."""
+    faces = _faces(200)
+    gallery = _gallery(faces, 3)
+    rng = random.Random(5)
+    probes = [[rng.uniform(-1, 1) for _ in range(8)] for _ in range(6)]
+    assert gallery.search_many(probes, k=2) == [
+        gallery.search(probe, k=2) for probe in probes
+    ]
+    assert _gallery([], 2).search_many(probes) == [[] for _ in probes]
+
+
+def test_single_node_matches_brute_force():
+    """The vectorised search finds the same nearest face as a plain scan."""
+    faces = _faces(50)
+    probe = faces[17]["img_vectors"]
+    best = min(
+        faces,
+        key=lambda face: np.linalg.norm(
+            np.array(face["img_vectors"]) - np.array(probe)
+        ),
+    )
+    assert _gallery(faces, 1).search(probe)[0]["_id"] == best["_id"]
+
+
+def test_ties_break_on_id_across_shards():
+    """Equally distant faces are ordered by id wherever they are stored."""
+    faces = [
+        {"_id": face_id, "name": face_id, "img_vectors": [1.0, 0.0]}
+        for face_id in ("d", "a", "c", "b")
+    ]
+    for count in (1, 2, 3):
+        matches = _gallery(faces, count).search([0.0, 0.0], k=2)
+        assert [match["_id"] for match in matches] == ["a", "b"]
+
+
+def test_upsert_and_delete_go_to_owning_shard():
+    """Changes reach the shard that owns the face."""
+    gallery = _gallery([], 3)
+    gallery.upsert("abc", "Ann", [0.0, 0.0])
+    owner = gallery.shard_for("abc")
+    assert owner.stats()["faces"] == 1
+    assert gallery.search([0.1, 0.0])[0]["name"] == "Ann"
+    gallery.delete("abc")
+    assert gallery.search([0.1, 0.0]) == []
+
+
+def test_from_env_builds_local_shards():
+    """local:N loads N in-process shards from the faces collection."""
+    faces = MagicMock()
+    faces.find.return_value = _faces(10)
+    with patch.dict("os.environ", {"GALLERY_SHARDS": "local:2"}):
+        gallery = from_env(faces)
+    assert len(gallery.shards) == 2
+    assert sum(part.stats()["faces"] for part in gallery.shards) == 10
+    with patch.dict("os.environ", {"GALLERY_SHARDS": ""}):
+        assert from_env(faces) is None
+
+
+def test_local_shards_reload_changes_made_by_other_replicas():
+    """Faces written to MongoDB by another replica reach the local shards."""
+    faces = MagicMock()
+    faces.find.return_value = _faces(10)
+    with patch.dict(
+        "os.environ", {"GALLERY_SHARDS": "local:2", "GALLERY_REFRESH_SECONDS": "0"}
+    ):
+        gallery = from_env(faces)
+    added, removed = _faces(12)[11], _faces(12)[0]
+    faces.find.return_value = _faces(12)[2:]
+
+    stop = gallery.reload_every(faces, 0.01)
+    give_up = time.monotonic() + 5
+    while (
+        gallery.search(added["img_vectors"])[0]["_id"] != added["_id"]
+        and time.monotonic() < give_up
+    ):
+        time.sleep(0.01)
+    stop.set()
+
+    assert gallery.search(added["img_vectors"])[0]["_id"] == added["_id"]
+    assert gallery.search(removed["img_vectors"])[0]["_id"] != removed["_id"]
+
+
+def test_site_scope_only_returns_that_sites_faces():
+    """A scoped search never returns a face from another site."""
+    faces = _faces(60)
+    for i, face in enumerate(faces):
+        face["sites"] = ["north"] if i % 3 == 0 else ["south"]
+    faces[1]["sites"] = ["north", "south"]
+    faces[2].pop("sites")
+    north = [face for face in faces if "north" in face.get("sites", ())]
+    gallery = _gallery(faces, 3)
+    for face in faces:
+        matches = gallery.search(face["img_vectors"], k=3, site="north")
+        assert {match["_id"] for match in matches} <= {f["_id"] for f in north}
+        assert matches == _gallery(north, 1).search(face["img_vectors"], k=3)
+    assert gallery.search(faces[2]["img_vectors"])[0]["_id"] == faces[2]["_id"]
+    assert gallery.search([0.0] * 8, site="east") == []
+
+
+def test_site_indexes_follow_changes():
+    """Site indexes are rebuilt after faces are added or retagged."""
+    gallery = _gallery([], 1)
+    gallery.upsert("abc", "Ann", [0.0, 0.0], ["north"])
+    assert gallery.search([0.0, 0.0], site="north")[0]["_id"] == "abc"
+    assert gallery.shards[0].stats()["sites_indexed"] == ["north"]
+    gallery.upsert("abc", "Ann", [0.0, 0.0], ["south"])
+    assert gallery.search([0.0, 0.0], site="north") == []
+
+
+def _served_by(client):
+    """Route ``urllib.request.urlopen`` to a Flask test client."""
+
+    def urlopen(request, timeout):  # pylint: disable=unused-argument
+        response = client.open(
+            request.full_url.split("http://shard-0", 1)[1],
+            method=request.get_method(),
+            data=request.data,
+            content_type="application/json",
+        )
+        return io.BytesIO(response.data)
+
+    return urlopen
+
+
+def test_remote_shard_round_trip():
+    """A RemoteShard adds, searches and deletes through the shard server."""
+    served = GalleryShard(0, 1)
+    with (
+        patch.object(shard_module, "shard", served),
+        patch(
+            "src.gallery.urllib.request.urlopen",
+            _served_by(shard_module.app.test_client()),
+        ),
+    ):
+        gallery = ShardedGallery([RemoteShard("http://shard-0", 0, 1)])
+        gallery.upsert("abc", "Ann", [0.0, 1.0], ["north"])
+        assert gallery.search([0.0, 1.0], site="south") == []
+        assert gallery.search([0.0, 1.0], site="north") == [
+            {"_id": "abc", "name": "Ann", "distance": 0.0}
+        ]
+        gallery.delete("abc")
+        assert gallery.search([0.0, 1.0]) == []
+        stats = json.loads(shard_module.app.test_client().get("/shard/stats").data)
+        assert stats["faces"] == 0
+
+
+def test_shard_server_still_answers_single_probes():
+    """Coordinators that send one 'embedding' get a flat list of matches."""
+    served = GalleryShard(0, 1)
+    served.upsert("abc", "Ann", [0.0, 1.0])
+    with patch.object(shard_module, "shard", served):
+        response = shard_module.app.test_client().post(
+            "/shard/search", json={"embedding": [0.0, 1.0]}
+        )
+    assert json.loads(response.data)["matches"] == [
+        {"_id": "abc", "name": "Ann", "distance": 0.0}
+    ]
+
+
+def test_remote_shards_get_the_callers_deadline_and_trace():
+    """Shard calls run in pool threads but carry the request's context."""
+    seen = []
+
+    def urlopen(request, timeout):
+        seen.append((request, timeout))
+        index = int(request.full_url.split("shard-", 1)[1][0])
+        return io.BytesIO(json.dumps({"shard": [index, 2], "matches": [[]]}).encode())
+
+    gallery = ShardedGallery([RemoteShard(f"http://shard-{i}", i, 2) for i in range(2)])
+    trace_id = "0af7651916cd43dd8448eb211c80319c"
+    span = tracing.enter("POST /faces/verify", f"00-{trace_id}-b7ad6b7169203331-00")
+    token = deadline.current.set(deadline.Deadline(2))
+    try:
+        with patch("src.gallery.urllib.request.urlopen", urlopen):
+            gallery.search([0.0, 1.0])
+    finally:
+        deadline.current.reset(token)
+        tracing.leave(span)
+
+    assert len(seen) == 2
+    for request, timeout in seen:
+        assert 0 < int(request.get_header("X-deadline-ms")) <= 2000
+        assert timeout <= 2
+        assert trace_id in request.get_header("Traceparent")
+
+
+def test_remote_shard_rejects_wrong_partition():
+    """A server holding another partition is an error, not a wrong answer."""
+    with (
+        patch.object(shard_module, "shard", GalleryShard(1, 2)),
+        patch(
+            "src.gallery.urllib.request.urlopen",
+            _served_by(shard_module.app.test_client()),
+        ),
+    ):
+        with pytest.raises(RuntimeError):
+            RemoteShard("http://shard-0", 0, 2).search([0.0])
+
+
+def test_shed_drops_site_indexes_only():
+    """Shedding frees the site indexes; searches rebuild them."""
+    gallery = _gallery([], 1)
+    gallery.upsert("abc", "Ann", [0.0, 0.0], ["north"])
+    gallery.search([0.0, 0.0])
+    gallery.search([0.0, 0.0], site="north")
+    before = gallery.shards[0].memory_bytes()
+    gallery.shards[0].shed()
+    assert gallery.shards[0].stats()["sites_indexed"] == []
+    assert gallery.shards[0].memory_bytes() < before
+    assert gallery.search([0.0, 0.0], site="north")[0]["_id"] == "abc"
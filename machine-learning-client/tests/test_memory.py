@@ -0,0 +1,92 @@
+"""Tests for memory accounting and the memory budget guard."""
+
+from unittest.mock import MagicMock
+from src import memory
+
+
+def _guard(readings, **options):
+    """Return a guard whose RSS readings come from ``readings`` in order."""
+    options.setdefault("interval", 0)
+    options.setdefault("cooldown", 0)
+    return memory.MemoryGuard(100, read_rss=MagicMock(side_effect=readings), **options)
+
+
+def test_guard_sheds_caches_near_the_budget():
+    """Shedders run once the RSS passes the shed fraction, not before."""
+    shed = MagicMock()
+    guard = _guard([50, 95, 70], shed_fraction=0.9)
+    guard.on_pressure(shed)
+    assert guard.check() == 50
+    shed.assert_not_called()
+    assert guard.check() == 70
+    shed.assert_called_once_with()
+    assert guard.stats()["sheds"] == 1
+
+
+def test_guard_refuses_growth_over_the_budget():
+    """Growth is refused while the RSS is at the budget and allowed after."""
+    guard = _guard([120, 120, 80], shed_fraction=2)
+    assert not guard.allow_growth()
+    try:
+        guard.reserve()
+    except memory.MemoryBudgetExceeded as error:
+        assert error.budget == 100
+    else:
+        raise AssertionError("reserve() should refuse growth over the budget")
+    guard.reserve()
+    assert guard.stats()["refused"] == 2
+
+
+def test_guard_reads_rss_at_most_once_per_interval():
+    """Checks within the interval reuse the last reading."""
+    read_rss = MagicMock(return_value=10)
+    guard = memory.MemoryGuard(100, interval=60, read_rss=read_rss)
+    guard.check()
+    guard.check()
+    assert read_rss.call_count == 1
+
+
+def test_guard_without_budget_never_refuses():
+    """A None budget disables the guard."""
+    read_rss = MagicMock()
+    guard = memory.MemoryGuard(None, read_rss=read_rss)
+    assert guard.allow_growth()
+    read_rss.assert_not_called()
+
+
+def test_cgroup_limit(tmp_path):
+    """The first readable limit file wins; 'max' and huge values mean none."""
+    limit = tmp_path / "memory.max"
+    limit.write_text("536870912\n", encoding="ascii")
+    missing = str(tmp_path / "missing")
+    assert memory.cgroup_limit_bytes((missing, str(limit))) == 512 * 2**20
+    limit.write_text("max\n", encoding="ascii")
+    assert memory.cgroup_limit_bytes((str(limit),)) is None
+    limit.write_text(f"{1 << 62}\n", encoding="ascii")
+    assert memory.cgroup_limit_bytes((str(limit),)) is None
+    assert memory.cgroup_limit_bytes((missing,)) is None
+
+
+def test_budget_from_env(monkeypatch):
+    """MEMORY_BUDGET_MB wins over a fraction of the cgroup limit."""
+    monkeypatch.setenv("MEMORY_BUDGET_MB", "256")
+    assert memory.budget_from_env() == 256 * 2**20
+    monkeypatch.delenv("MEMORY_BUDGET_MB")
+    monkeypatch.setenv("MEMORY_BUDGET_FRACTION", "0.5")
+    monkeypatch.setattr(memory, "cgroup_limit_bytes", lambda: 1000)
+    assert memory.budget_from_env() == 500
+
+
+def test_allocations_report_growth_since_start():
+    """Allocations made after start_tracing show up in the report."""
+    assert memory.allocations() == {"tracing": False}
+    memory.start_tracing()
+    try:
+        held = [bytearray(4096) for _ in range(64)]
+        report = memory.allocations(limit=5)
+    finally:
+        memory.stop_tracing()
+    assert report["tracing"]
+    assert report["top"][0]["growth_bytes"] >= 64 * 4096
+    assert "test_memory.py" in report["top"][0]["where"]
+    assert len(held) == 64
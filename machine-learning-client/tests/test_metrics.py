@@ -0,0 +1,56 @@
+"""Tests for the Prometheus text-format metrics."""
+
+import logging
+from src.logs import SampleFilter
+from src.metrics import STAGE_SECONDS, Histogram, family, stage
+
+
+def test_histogram_renders_cumulative_buckets():
+    """Buckets are cumulative, with +Inf, _sum and _count per label set."""
+    histogram = Histogram("demo_seconds", "Demo.", ("stage",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "embed")
+    histogram.observe(0.1, "embed")
+    histogram.observe(5.0, "embed")
+    with histogram.time("find"):
+        pass
+
+    text = histogram.render()
+
+    assert "# TYPE demo_seconds histogram" in text
+    assert 'demo_seconds_bucket{stage="embed",le="0.1"} 2' in text
+    assert 'demo_seconds_bucket{stage="embed",le="1.0"} 2' in text
+    assert 'demo_seconds_bucket{stage="embed",le="+Inf"} 3' in text
+    assert 'demo_seconds_sum{stage="embed"} 5.15' in text
+    assert 'demo_seconds_count{stage="embed"} 3' in text
+    assert histogram.count("find") == 1
+
+
+def test_family_escapes_label_values():
+    """Label values are escaped as the text format requires."""
+    text = family("demo_total", "counter", "Demo.", [("", {"reason": 'a"b'}, 3)])
+    assert text.splitlines() == [
+        "# HELP demo_total Demo.",
+        "# TYPE demo_total counter",
+        'demo_total{reason="a\\"b"} 3',
+    ]
+
+
+def test_debug_records_are_sampled():
+    """Debug records pass at the sample rate; info and above always pass."""
+
+    def record(level):
+        return logging.LogRecord("src", level, __file__, 1, "msg", None, None)
+
+    assert SampleFilter(0.0).filter(record(logging.INFO))
+    assert not SampleFilter(0.0).filter(record(logging.DEBUG))
+    assert SampleFilter(1.0).filter(record(logging.DEBUG))
+
+
+def test_stage_is_timed_and_logged_at_debug(caplog):
+    """Each stage is observed in the histogram and logged with its time."""
+    before = STAGE_SECONDS.count("demo")
+    with caplog.at_level(logging.DEBUG, logger="src.metrics"):
+        with stage("demo"):
+            pass
+    assert STAGE_SECONDS.count("demo") == before + 1
+    assert [r.getMessage().split(" took ")[0] for r in caplog.records] == ["stage demo"]
@@ -0,0 +1,58 @@
+"""Tests for the on-demand sampling profiler."""
+
+import os
+import time
+import pytest
+from src import profiling
+from src.profiling import Profiler
+
+OTHER_COPY = os.path.join(
+    os.path.dirname(__file__), "..", "..", "web-app", "src", "profiling.py"
+)
+
+
+def _busy(seconds):
+    """Spin on the CPU for ``seconds``."""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_block_profiles_model_load(tmp_path):
+    """A profiled block is written as wall and CPU collapsed stacks."""
+    profiler = Profiler(str(tmp_path), interval=0.001)
+    with profiler.block("startup-model-load"):
+        _busy(0.1)
+
+    for path in profiler.status()["written"]:
+        with open(path, encoding="utf-8") as file:
+            assert "_busy (test_profiling.py:" in file.read()
+    assert not profiler.active
+
+
+def test_first_matching_request_is_profiled(tmp_path):
+    """Only requests to the chosen routes count; the profile ends after N."""
+    profiler = Profiler(str(tmp_path), interval=0.001)
+    profiler.start("first", routes=("/faces/verify", "/signins"), requests=1)
+
+    profiler.enter("/metrics")
+    assert profiler.status()["remaining_requests"] == 1
+    profiler.enter("/signins")
+    _busy(0.05)
+    profiler.exit()
+    profiler.wait(timeout=5)
+
+    assert not profiler.active
+    assert len(profiler.status()["written"]) == 2
+
+
+def _code(path):
+    """Return a module's source without its docstring."""
+    with open(path, encoding="utf-8") as file:
+        return file.read().split('"""', 2)[2]
+
+
+@pytest.mark.skipif(not os.path.exists(OTHER_COPY), reason="built without web-app")
+def test_matches_the_web_app_copy():
+    """This copy's code is identical to the web app's."""
+    assert _code(profiling.__file__) == _code(OTHER_COPY)
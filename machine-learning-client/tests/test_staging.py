@@ -0,0 +1,48 @@
+"""Tests for the staged embedding store."""
+
+from unittest.mock import patch
+from src.staging import EmbeddingStage
+
+
+def test_token_returns_staged_embedding_until_discarded():
+    """A token gives back its embedding until the face is stored."""
+    stage = EmbeddingStage()
+    token = stage.put([0.1, 0.2])
+    assert stage.get(token) == [0.1, 0.2]
+    assert stage.lookup(stage.put([0.3], faces=2)) == ([0.3], 2)
+    stage.discard(token)
+    assert stage.get(token) is None
+    assert stage.get("unknown") is None
+
+
+def test_tokens_expire_after_ttl():
+    """Staged embeddings are dropped once their TTL has passed."""
+    stage = EmbeddingStage(ttl=10)
+    with patch("src.staging.time.monotonic", return_value=100.0):
+        token = stage.put([0.1])
+    with patch("src.staging.time.monotonic", return_value=111.0):
+        assert stage.get(token) is None
+        assert stage.stats()["expired"] == 1
+
+
+def test_oldest_entries_are_evicted_at_capacity():
+    """The store never holds more than max_entries embeddings."""
+    stage = EmbeddingStage(max_entries=2)
+    first, second, third = (stage.put([float(i)]) for i in range(3))
+    assert stage.get(first) is None
+    assert stage.get(second) == [1.0]
+    assert stage.get(third) == [2.0]
+    stats = stage.stats()
+    assert stats["entries"] == 2
+    assert stats["evicted"] == 1
+
+
+def test_clear_drops_everything_as_evicted():
+    """Shedding the store under memory pressure counts as eviction."""
+    stage = EmbeddingStage()
+    token = stage.put([0.1, 0.2])
+    assert stage.memory_bytes() > 0
+    stage.clear()
+    assert stage.get(token) is None
+    assert stage.memory_bytes() == 0
+    assert stage.stats()["evicted"] == 1
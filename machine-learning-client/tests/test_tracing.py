@@ -0,0 +1,46 @@
+"""Tests for continuing the web app's traces in the DeepFace service."""
+
+import json
+from unittest.mock import patch
+from src import metrics, tracing
+
+PARENT = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+
+def _read(exporter):
+    exporter.flush()
+    with open(exporter.path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def test_stages_are_spans_of_the_callers_trace(tmp_path):
+    """A sampled caller's trace is continued, with a span per stage."""
+    exporter = tracing.FileExporter(str(tmp_path / "traces.jsonl"))
+    with patch.object(tracing, "exporter", exporter):
+        request_span = tracing.enter("POST /faces/verify", PARENT)
+        with metrics.stage("embed"):
+            pass
+        tracing.leave(request_span, status=200)
+
+    embed, request = _read(exporter)
+    assert embed["name"] == "embed"
+    assert embed["parent_id"] == request["span_id"]
+    assert request["parent_id"] == "b7ad6b7169203331"
+    assert request["trace_id"] == embed["trace_id"] == PARENT[3:35]
+    assert request["attributes"] == {"status": 200}
+
+
+def test_unsampled_requests_write_nothing(tmp_path):
+    """Requests the caller did not sample, or without a header, are skipped."""
+    exporter = tracing.FileExporter(str(tmp_path / "traces.jsonl"))
+    with patch.object(tracing, "exporter", exporter), patch.object(
+        tracing, "TRACE_SAMPLE_RATE", 0.0
+    ):
+        for header in (PARENT[:-2] + "00", None, "garbage"):
+            request_span = tracing.enter("POST /faces/verify", header)
+            with metrics.stage("embed"):
+                pass
+            tracing.leave(request_span)
+
+    assert not (tmp_path / "traces.jsonl").exists()
+    assert tracing.current() is None
@@ -5,28 +5,105 @@ This module provides routes for user authentication via facial recognition,
 attendance tracking, and administrative functions for managing user records.
 """
 
+import atexit
 import os
-from datetime import datetime
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+import click
 import requests
 from bson.objectid import ObjectId
 from flask import (
     Flask,
+    Response,
     flash,
     jsonify,
+    make_response,
     redirect,
     render_template,
     request,
     session,
     url_for,
     g,
+    stream_with_context,
+    before_render_template,
+    template_rendered,
 )
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
+from pymongo.errors import PyMongoError
+from src import export, metrics, ml_client, profiling, tracing
+from src.ml_pool import ReplicaPool
+from src.archive import AttendanceArchive
+from src.capture import UploadStats
+from src.live_feed import LiveFeed
+from src.presence import PresenceCache
+from src.repository import SmartGateRepository
+from src.rollups import AttendanceRollups
+from src.write_behind import AttendanceWriteBehind
+
+
+def env_flag(name):
+    """Return whether environment variable ``name`` is set to a true value."""
+    return os.environ.get(name, "false").lower() in ("1", "true", "yes")
+
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "supersecret")
 MONGO_URI = os.environ.get("MONGO_URI", "mongodb://admin:password@db:27017")
 ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "admin123")
 DEEPFACE_API_URL = os.environ.get("DEEPFACE_API_URL", "http://localhost:5005")
+DEEPFACE_API_URLS = [
+    url.strip()
+    for url in os.environ.get("DEEPFACE_API_URLS", DEEPFACE_API_URL).split(",")
+    if url.strip()
+]
+DEEPFACE_HEDGE = env_flag("DEEPFACE_HEDGE")
+DEEPFACE_REQUEST_BUDGET = float(os.environ.get("DEEPFACE_REQUEST_BUDGET", "30"))
+# Let the DeepFace service record attendance in the verify call (POST /signins)
+SIGNIN_SINGLE_HOP = env_flag("SIGNIN_SINGLE_HOP")
+SIGNIN_ML_PATH = "/signins" if SIGNIN_SINGLE_HOP else "/faces/verify"
+SITE_TIMEZONE = os.environ.get("SITE_TIMEZONE", "UTC")
+# "gate=site" pairs; a listed gate only matches faces tagged with its site
+GATE_SITES = dict(
+    pair.split("=", 1)
+    for pair in os.environ.get("GATE_SITES", "").replace(" ", "").split(",")
+    if "=" in pair
+)
+# Single worker only: "first sign-in today" is decided by this process's cache
+ATTENDANCE_WRITE_BEHIND = env_flag("ATTENDANCE_WRITE_BEHIND")
+ATTENDANCE_WAL_PATH = os.environ.get("ATTENDANCE_WAL_PATH", "attendance.wal")
+ATTENDANCE_FLUSH_SIZE = int(os.environ.get("ATTENDANCE_FLUSH_SIZE", "100"))
+ATTENDANCE_FLUSH_INTERVAL = float(os.environ.get("ATTENDANCE_FLUSH_INTERVAL", "1.0"))
+ATTENDANCE_ARCHIVE_DIR = os.environ.get("ATTENDANCE_ARCHIVE_DIR", "archive")
+ATTENDANCE_RETENTION_MONTHS = int(os.environ.get("ATTENDANCE_RETENTION_MONTHS", "12"))
+# What kiosk and enrollment pages capture and upload; see the README
+CAPTURE = {
+    "width": int(os.environ.get("CAPTURE_WIDTH", "640")),
+    "height": int(os.environ.get("CAPTURE_HEIGHT", "480")),
+    "quality": float(os.environ.get("CAPTURE_QUALITY", "0.8")),
+    "face_crop": env_flag("CAPTURE_FACE_CROP"),
+    "stream_width": int(os.environ.get("CAPTURE_STREAM_WIDTH", "320")),
+    "stream_height": int(os.environ.get("CAPTURE_STREAM_HEIGHT", "240")),
+}
+
+presence_cache = PresenceCache()
+ml_pool = ReplicaPool(
+    DEEPFACE_API_URLS, hedge=DEEPFACE_HEDGE, observe=metrics.observe_deepface
+)
+live_feed = LiveFeed()
+signin_uploads = UploadStats()
+profiler = profiling.Profiler(
+    os.environ.get("PROFILE_DIR", "profiles"),
+    interval=float(os.environ.get("PROFILE_INTERVAL", str(profiling.DEFAULT_INTERVAL))),
+)
+attendance_archive = AttendanceArchive(ATTENDANCE_ARCHIVE_DIR)
+
+
+@app.context_processor
+def capture_settings():
+    """Give every template the browser capture settings."""
+    return {"capture": CAPTURE}
 
 
 def get_db():
@@ -37,6 +114,143 @@ def get_db():
     return g.db
 
 
+def get_repository():
+    """Get the data access layer bound to the current request's database."""
+    if "repository" not in g:
+        g.repository = SmartGateRepository(get_db(), archive=attendance_archive)
+        if not app.config.get("INDEXES_READY"):
+            g.repository.ensure_indexes()
+            AttendanceRollups(get_db()).ensure_indexes()
+            app.config["INDEXES_READY"] = True
+    return g.repository
+
+
+def request_deadline():
+    """Start this request's DeepFace time budget.
+
+    A shorter budget sent by the caller in ``X-Deadline-Ms`` is adopted.
+    """
+    return ml_client.Deadline.from_header(
+        request.headers.get(ml_client.DEADLINE_HEADER), DEEPFACE_REQUEST_BUDGET
+    )
+
+
+def get_rollups():
+    """Get the attendance rollups bound to the current request's database."""
+    if "rollups" not in g:
+        g.rollups = AttendanceRollups(get_db())
+    return g.rollups
+
+
+def _background_repository():
+    """Create a repository with its own client for use outside requests."""
+    return SmartGateRepository(MongoClient(MONGO_URI)["smart_gate"])
+
+
+def _rollup_flushed(repository, docs):
+    """Count sign-ins inserted by the write-behind flusher in the rollups."""
+    try:
+        AttendanceRollups(repository.db).record(
+            (doc["face_id"], doc["local_date"]) for doc in docs
+        )
+    except PyMongoError as e:
+        # The sign-ins are stored; `flask rollups rebuild` repairs the aggregates
+        app.logger.warning("Failed to update attendance rollups: %s", e)
+
+
+def site_tz():
+    """Return the configured site timezone."""
+    if SITE_TIMEZONE.upper() == "UTC":
+        return timezone.utc
+    return ZoneInfo(SITE_TIMEZONE)
+
+
+def site_now():
+    """Return the current time in the configured site timezone."""
+    return datetime.now(site_tz())
+
+
+# Latency metrics: every MongoDB command, DeepFace call (see ml_pool above)
+# and template render is timed against the route that caused it, and traced
+# as part of the request when it is sampled
+monitoring.register(metrics.MongoTimer())
+
+
+@app.before_request
+def start_timer():
+    """Note when the request started and start its trace span."""
+    g.request_started = time.perf_counter()
+    g.trace_span = tracing.enter(
+        f"{request.method} {metrics.endpoint()}",
+        request.headers.get(tracing.TRACEPARENT),
+    )
+
+
+@app.after_request
+def observe_request(response):
+    """Record the request's latency under its route pattern."""
+    if "request_started" in g:
+        metrics.REQUEST_SECONDS.observe(
+            time.perf_counter() - g.request_started,
+            metrics.endpoint(),
+            request.method,
+            str(response.status_code),
+        )
+    span = tracing.current()
+    if span is not None and span.context.sampled:
+        # Lets a kiosk or a browser's network panel name a slow request
+        response.headers["X-Trace-Id"] = span.context.trace_id
+        span.attributes["status"] = response.status_code
+    return response
+
+
+@app.before_request
+def start_profile():
+    """Profile this request if an admin asked for requests to its route."""
+    if profiler.active:
+        profiler.enter(metrics.endpoint())
+
+
+@app.teardown_request
+def end_profile(_error=None):
+    """Stop profiling this request's thread."""
+    if profiler.active:
+        profiler.exit()
+
+
+@app.teardown_request
+def end_trace(error=None):
+    """End the request's trace span."""
+    span = g.pop("trace_span", None)
+    if span is not None:
+        if error is not None:
+            tracing.leave(span, error=type(error).__name__)
+        else:
+            tracing.leave(span)
+
+
+@before_render_template.connect_via(app)
+def start_render(_sender, **_extra):
+    """Note when a template started rendering."""
+    g.render_started = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def observe_render(_sender, template, **_extra):
+    """Record the time spent rendering ``template``."""
+    started = g.pop("render_started", None)
+    if started is not None:
+        metrics.observe_dependency(
+            "jinja", template.name, time.perf_counter() - started
+        )
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Expose route and dependency latencies in the Prometheus text format."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.route("/")
 def index():
     """Redirect to signin page."""
@@ -58,15 +272,102 @@ def admin_login():
 @app.route("/admin")
 def admin_dashboard():
     """Display admin dashboard with attendance and face records."""
-    db = get_db()
     if not session.get("admin"):
         return redirect(url_for("admin_login"))
 
-    records = list(db.attendance.find().sort("timestamp", -1))
-    faces = list(db.faces.find())
+    repository = get_repository()
+    records = repository.list_attendance()
+    faces = repository.list_faces()
     return render_template("admin.html", records=records, faces=faces)
 
 
+@app.route("/admin/live")
+def admin_live():
+    """Stream newly recorded sign-ins to the dashboard as server-sent events."""
+    if not session.get("admin"):
+        return redirect(url_for("admin_login"))
+    return Response(
+        live_feed.stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/admin/summary")
+def admin_summary():
+    """Show per-day headcounts and per-person attendance for one month."""
+    if not session.get("admin"):
+        return redirect(url_for("admin_login"))
+
+    month = request.args.get("month") or site_now().strftime("%Y-%m")
+    try:
+        first_day = datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        flash("Month must be YYYY-MM", "error")
+        return redirect(url_for("admin_summary"))
+
+    rollups = get_rollups()
+    last_day = (first_day + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    headcounts = rollups.daily_headcounts(
+        first_day.date().isoformat(), last_day.date().isoformat()
+    )
+    counts = rollups.monthly_counts(month)
+    people = sorted(
+        (
+            (name, counts.get(face_id, 0))
+            for face_id, name in get_repository().face_names().items()
+        ),
+        key=lambda person: (-person[1], person[0]),
+    )
+    return render_template(
+        "admin_summary.html", month=month, headcounts=headcounts, people=people
+    )
+
+
+@app.route("/admin/export")
+def admin_export():
+    """Stream attendance between two local dates as CSV or NDJSON.
+
+    Query parameters: ``start`` and ``end`` (inclusive, ``YYYY-MM-DD``),
+    ``format`` (``csv`` or ``ndjson``) and ``gzip`` (``1`` to compress).
+    """
+    if not session.get("admin"):
+        return redirect(url_for("admin_login"))
+
+    fmt = request.args.get("format", "csv")
+    if fmt not in export.FORMATS:
+        return jsonify({"success": False, "message": "Unsupported format"}), 400
+    try:
+        start = datetime.strptime(request.args["start"], "%Y-%m-%d")
+        end = datetime.strptime(request.args["end"], "%Y-%m-%d")
+    except (KeyError, ValueError):
+        return (
+            jsonify({"success": False, "message": "start and end must be YYYY-MM-DD"}),
+            400,
+        )
+
+    tz = site_tz()
+    repository = get_repository()
+    names = repository.face_names()
+    records = repository.iter_attendance_between(
+        start.replace(tzinfo=tz), (end + timedelta(days=1)).replace(tzinfo=tz)
+    )
+    write_lines = export.ndjson_lines if fmt == "ndjson" else export.csv_lines
+    body = export.chunked(write_lines(records, names))
+    filename = f"attendance_{start:%Y%m%d}_{end:%Y%m%d}.{fmt}"
+    mimetype = export.FORMATS[fmt]
+    if request.args.get("gzip") == "1":
+        body = export.gzipped(body)
+        filename += ".gz"
+        mimetype = "application/gzip"
+
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+
 @app.route("/admin/add", methods=["GET", "POST"])
 def admin_add_user():
     """Allow admin to add new face records using DeepFace API."""
@@ -82,6 +383,41 @@ def admin_add_user():
     return _process_add_user_form(request.form)
 
 
+def parse_sites(text):
+    """Split a comma-separated sites field into a list of site names."""
+    return [site.strip() for site in (text or "").split(",") if site.strip()]
+
+
+@dataclass(frozen=True)
+class CapturedFace:
+    """
+    A face captured on the add-user page.
+
+    Either the image itself or, once the DeepFace service has embedded it, the
+    token of the staged embedding and the replica holding it.
+    """
+
+    image_data: str = ""
+    token: str = ""
+    replica: str = ""
+
+    def payload(self):
+        """Return the image or token fields of a DeepFace add or update call."""
+        return {"token": self.token} if self.token else {"img": self.image_data}
+
+    def sender(self, send):
+        """Return a pool sender that reaches the replica holding the token."""
+        return ml_pool.sender(send, replica=self.replica or None)
+
+
+def _face_payload(face, name, sites):
+    """Build the body of an add or update call to the DeepFace API."""
+    payload = {**face.payload(), "name": name}
+    if sites:
+        payload["sites"] = sites
+    return payload
+
+
 def _process_add_user_form(form_data):
     """Process the form data for adding or updating a user face.
 
@@ -90,23 +426,29 @@ def _process_add_user_form(form_data):
     """
     # Extract form data
     name = form_data.get("name")
-    image_data = form_data.get("image_data")
+    face = CapturedFace(
+        image_data=form_data.get("image_data", ""),
+        token=form_data.get("face_token", ""),
+        replica=form_data.get("face_replica", ""),
+    )
     action = form_data.get("action", "add")
     existing_face_id = form_data.get("existing_face_id")
+    sites = parse_sites(form_data.get("sites"))
 
     # Validate required fields
-    if not name or not image_data:
+    if not name or not (face.image_data or face.token):
         flash("Name and face image are required", "error")
         return render_template("admin_add_user.html")
 
     # Handle different actions
+    deadline = request_deadline()
     try:
         if action == "confirm":
-            return _handle_confirm_action(name, image_data, existing_face_id)
+            return _handle_confirm_action(name, face, existing_face_id, sites, deadline)
         if action == "add":
-            return _handle_add_action(name, image_data)
+            return _handle_add_action(name, face, sites, deadline)
         if action == "force_add":
-            return _add_new_face(name, image_data)
+            return _add_new_face(name, face, sites, deadline)
         flash("Invalid action specified", "error")
         return render_template("admin_add_user.html")
     except requests.RequestException as e:
@@ -114,16 +456,18 @@ def _process_add_user_form(form_data):
         return render_template("admin_add_user.html")
 
 
-def _handle_confirm_action(name, image_data, existing_face_id):
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def _handle_confirm_action(name, face, existing_face_id, sites, deadline):
     """Handle the confirmation action for updating an existing face."""
     if not existing_face_id:
         flash("Missing face information", "error")
         return render_template("admin_add_user.html")
 
-    update_response = requests.put(
-        f"{DEEPFACE_API_URL}/faces/{existing_face_id}",
-        json={"img": image_data, "name": name},
-        timeout=30,
+    update_response = ml_client.with_retry(
+        face.sender(requests.put),
+        deadline,
+        f"/faces/{existing_face_id}",
+        json=_face_payload(face, name, sites),
     )
 
     result = update_response.json()
@@ -135,16 +479,23 @@ def _handle_confirm_action(name, image_data, existing_face_id):
     return render_template("admin_add_user.html")
 
 
-def _handle_add_action(name, image_data):
+def _handle_add_action(name, face, sites, deadline):
     """Handle the add action for a new face, with verification first."""
-    # First verify if the face already exists
-    verify_response = requests.post(
-        f"{DEEPFACE_API_URL}/faces/verify",
-        json={"img": image_data},
-        timeout=30,
+    # First verify if the face already exists. The service keeps the
+    # embedding it computes, so the add or update below does not redo it.
+    verify_response = ml_client.with_retry(
+        ml_pool.sender(requests.post),
+        deadline,
+        "/faces/verify",
+        json={"img": face.image_data, "stage": True},
     )
 
     verify_result = verify_response.json()
+    if verify_result.get("token"):
+        face = CapturedFace(
+            token=verify_result["token"],
+            replica=ml_pool.replica_url(verify_response.url) or "",
+        )
 
     # If face exists, show confirmation page
     if verify_result.get("success") and verify_result.get("verified"):
@@ -154,19 +505,21 @@ def _handle_add_action(name, image_data):
             existing_face=True,
             match=match,
             name=name,
-            image_data=image_data,
+            face=face,
+            sites=", ".join(sites),
         )
 
     # Face doesn't exist, proceed with adding new face
-    return _add_new_face(name, image_data)
+    return _add_new_face(name, face, sites, deadline)
 
 
-def _add_new_face(name, image_data):
+def _add_new_face(name, face, sites, deadline):
     """Add a new face to the system."""
-    add_response = requests.post(
-        f"{DEEPFACE_API_URL}/faces",
-        json={"img": image_data, "name": name},
-        timeout=30,
+    add_response = ml_client.with_retry(
+        face.sender(requests.post),
+        deadline,
+        "/faces",
+        json=_face_payload(face, name, sites),
     )
 
     result = add_response.json()
@@ -187,85 +540,294 @@ def signin():
 @app.route("/process_signin", methods=["POST"])
 def process_signin():
     """Process submitted face image for signin using DeepFace."""
-    db = get_db()
     if "image" not in request.form:
         return jsonify({"success": False, "message": "No image provided"}), 400
 
-    # Get image data
-    image_data = request.form.get("image")
-
-    # Call DeepFace API to verify the face
+    signin_uploads.observe(request.form["image"])
+    # Call DeepFace API to verify the face. A single-hop call also records
+    # attendance, so it is not hedged: the losing copy would see a repeat.
+    path, payload = signin_request(request.form)
+    started = time.perf_counter()
     try:
-        response = requests.post(
-            f"{DEEPFACE_API_URL}/faces/verify", json={"img": image_data}, timeout=30
+        response = ml_client.send_within(
+            ml_pool.sender(requests.post, hedge=not SIGNIN_SINGLE_HOP),
+            request_deadline(),
+            path,
+            json=payload,
         )
-        if response.status_code == 200:
-            result = response.json()
-            if result.get("success") and result.get("verified"):
-                match = result.get("match", {})
-                face_id = match["_id"]
-
-                # Check if user already signed in today
-                today_start = datetime.now().replace(
-                    hour=0, minute=0, second=0, microsecond=0
-                )
-                existing_signin = db.attendance.find_one(
-                    {"face_id": ObjectId(face_id), "timestamp": {"$gte": today_start}}
-                )
+    except requests.RequestException as e:
+        return signin_unavailable(e)
+    result = response.json() if response.status_code == 200 else None
+    return complete_signin(
+        response.status_code,
+        result,
+        ml_client.retry_after(response),
+        ml_client.call_timings(response, time.perf_counter() - started),
+    )
 
-                if existing_signin:
-                    # User already signed in today
-                    return jsonify(
-                        {
-                            "success": False,
-                            "already_signed_in": True,
-                            "message": "You have already signed in today",
-                            "redirect": url_for(
-                                "signin_success",
-                                face_id=str(face_id),
-                                already_signed_in=True,
-                            ),
-                        }
-                    )
-
-                # Record new attendance
-                attendance_id = db.attendance.insert_one(
-                    {
-                        "face_id": ObjectId(face_id),
-                        "timestamp": datetime.now(),
-                    }
-                ).inserted_id
-                return jsonify(
-                    {
-                        "success": True,
-                        "redirect": url_for(
-                            "signin_success",
-                            face_id=str(face_id),
-                            attendance_id=str(attendance_id),
-                        ),
-                    }
-                )
-            return jsonify({"success": False, "message": "Face not recognized"})
+
+def signin_site(form):
+    """
+    Return the site whose faces a kiosk sign-in may match, or "" for any face.
+
+    A gate listed in ``GATE_SITES`` always uses its configured site; other
+    kiosks may name a site themselves.
+    """
+    return GATE_SITES.get(form.get("gate", ""), form.get("site", ""))
+
+
+def signin_request(form):
+    """
+    Return the DeepFace path and JSON body for a submitted sign-in form.
+
+    A form with ``group`` set asks ``/faces/identify`` for every face in the
+    capture instead of verifying a single one.
+    """
+    payload = {"img": form.get("image")}
+    site = signin_site(form)
+    if site:
+        payload["site"] = site
+    if form.get("group"):
+        payload["record"] = SIGNIN_SINGLE_HOP
+        return "/faces/identify", payload
+    return SIGNIN_ML_PATH, payload
+
+
+def signin_unavailable(error):
+    """Build the sign-in response for a failed DeepFace connection."""
+    return jsonify(
+        {
+            "success": False,
+            "message": f"Error connecting to DeepFace service: {str(error)}",
+        }
+    )
+
+
+def complete_signin(status_code, result, retry_after=None, timings=()):
+    """
+    Record a sign-in from the DeepFace verify response and build the reply.
+
+    Shared by ``process_signin`` and the async sign-in path in ``asgi.py``.
+    Must run inside a request context for the submitted form.
+
+    Args:
+        status_code (int): HTTP status of the verify call.
+        result (dict): Its JSON body, or None when the call failed.
+        retry_after (int, optional): The service's ``Retry-After`` when it
+            rejected the call as overloaded.
+        timings (list, optional): ``(name, ms)`` pairs of the DeepFace call,
+            returned with the web app's own in a ``Server-Timing`` header.
+    """
+    timings = list(timings)
+    response = make_response(_signin_reply(status_code, result, retry_after, timings))
+    if timings:
+        response.headers["Server-Timing"] = ml_client.format_server_timing(timings)
+    return response
+
+
+def _signin_reply(status_code, result, retry_after, timings):
+    """Build the sign-in reply, appending the recording time to ``timings``."""
+    if status_code in ml_client.BUSY_STATUSES:
+        # Hand the back-off to the kiosk, which retries with jitter
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "busy": True,
+                    "retry_after": retry_after,
+                    "message": "Face recognition is busy, retrying shortly",
+                }
+            ),
+            503,
+            {"Retry-After": str(retry_after)},
+        )
+    if status_code != 200:
         return jsonify(
             {
                 "success": False,
-                "message": f"Error communicating with DeepFace API: {response.status_code}",
+                "message": f"Error communicating with DeepFace API: {status_code}",
             }
         )
-    except requests.RequestException as e:
+    if "faces" in result:
+        return _group_reply(result, timings)
+    if not (result.get("success") and result.get("verified")):
+        return jsonify({"success": False, "message": "Face not recognized"})
+
+    match = result.get("match", {})
+    face_id = match["_id"]
+
+    if "first" in result:
+        # Already recorded by the DeepFace service (SIGNIN_SINGLE_HOP)
+        first, attendance_id = result["first"], result.get("attendance_id")
+    else:
+        started = time.perf_counter()
+        first, attendance_id = _record_signin(get_repository(), face_id)
+        timings.append(("record", (time.perf_counter() - started) * 1000))
+
+    if not first:
+        # User already signed in today
         return jsonify(
             {
                 "success": False,
-                "message": f"Error connecting to DeepFace service: {str(e)}",
+                "already_signed_in": True,
+                "message": "You have already signed in today",
+                "redirect": url_for(
+                    "signin_success",
+                    face_id=str(face_id),
+                    already_signed_in=True,
+                ),
             }
         )
 
+    live_feed.publish(
+        {
+            "face_id": str(face_id),
+            "name": match.get("name", ""),
+            "time": site_now().isoformat(timespec="seconds"),
+            "gate": request.form.get("gate", ""),
+        }
+    )
+    return jsonify(
+        {
+            "success": True,
+            "redirect": url_for(
+                "signin_success",
+                face_id=str(face_id),
+                attendance_id=str(attendance_id),
+            ),
+        }
+    )
+
+
+def _record_signin(repository, face_id):
+    """Record today's sign-in for ``face_id``.
+
+    Returns a ``(first, attendance_id)`` tuple; ``first`` is False when the
+    person already signed in today. Repeat sign-ins are answered from the
+    presence cache. Otherwise the sign-in is either queued on the write-behind
+    log or written with one upsert on the daily key.
+    """
+    now = site_now()
+    today = now.date().isoformat()
+
+    if write_behind is not None:
+
+        def loader(local_date):
+            return repository.face_ids_signed_in_on(
+                local_date
+            ) + write_behind.pending_face_ids(local_date)
+
+        if not presence_cache.claim(today, face_id, loader):
+            return False, None
+        doc = SmartGateRepository.daily_signin_doc(face_id, now)
+        return True, write_behind.enqueue(doc)
+
+    if presence_cache.contains(today, face_id, repository.face_ids_signed_in_on):
+        return False, None
+    result = repository.record_daily_signin(face_id, now)
+    presence_cache.add(today, face_id)
+    if result.first:
+        try:
+            get_rollups().record([(ObjectId(face_id), today)])
+        except PyMongoError as e:
+            # The sign-in itself is recorded; `flask rollups rebuild` repairs
+            # the aggregates.
+            app.logger.warning("Failed to update attendance rollups: %s", e)
+    return result.first, result.attendance_id
+
+
+def _group_reply(result, timings):
+    """Record everyone recognised in a group capture and list the faces."""
+    recognised = [face for face in result["faces"] if face["verified"]]
+    if recognised and "first" not in recognised[0]:
+        started = time.perf_counter()
+        recorded = _record_group_signins(
+            get_repository(), [face["match"]["_id"] for face in recognised]
+        )
+        timings.append(("record", (time.perf_counter() - started) * 1000))
+    else:
+        # Already recorded by the DeepFace service (SIGNIN_SINGLE_HOP)
+        recorded = {
+            face["match"]["_id"]: (face["first"], face.get("attendance_id"))
+            for face in recognised
+        }
+
+    faces = []
+    for face in result["faces"]:
+        entry = {"box": face["box"], "recognized": face["verified"]}
+        if face["verified"]:
+            match = face["match"]
+            first = recorded[match["_id"]][0]
+            entry.update(face_id=match["_id"], name=match.get("name", ""), first=first)
+            if first:
+                live_feed.publish(
+                    {
+                        "face_id": match["_id"],
+                        "name": entry["name"],
+                        "time": site_now().isoformat(timespec="seconds"),
+                        "gate": request.form.get("gate", ""),
+                    }
+                )
+        faces.append(entry)
+
+    signed_in = [face["name"] for face in faces if face.get("first")]
+    repeats = [face["name"] for face in faces if face.get("first") is False]
+    unknown = len(faces) - len(recognised)
+    parts = []
+    if signed_in:
+        parts.append("Signed in: " + ", ".join(signed_in))
+    if repeats:
+        parts.append("Already signed in today: " + ", ".join(repeats))
+    if unknown:
+        parts.append(f"{unknown} face(s) not recognized")
+    return jsonify(
+        {
+            "success": bool(recognised),
+            "group": True,
+            "faces": faces,
+            "message": ". ".join(parts) or "No faces found",
+        }
+    )
+
+
+def _record_group_signins(repository, face_ids):
+    """Record today's sign-in for several faces with one bulk insert.
+
+    Returns a ``{face_id: (first, attendance_id)}`` dict. Repeat sign-ins are
+    answered from the presence cache. With the write-behind log, each sign-in
+    is queued and the log batches the writes.
+    """
+    if write_behind is not None:
+        return {face_id: _record_signin(repository, face_id) for face_id in face_ids}
+
+    now = site_now()
+    today = now.date().isoformat()
+    docs = [
+        SmartGateRepository.daily_signin_doc(face_id, now)
+        for face_id in face_ids
+        if not presence_cache.contains(today, face_id, repository.face_ids_signed_in_on)
+    ]
+    inserted = repository.insert_signins(docs) if docs else []
+    for doc in docs:
+        presence_cache.add(today, doc["face_id"])
+    if inserted:
+        try:
+            get_rollups().record([(doc["face_id"], today) for doc in inserted])
+        except PyMongoError as e:
+            # The sign-ins themselves are recorded; `flask rollups rebuild`
+            # repairs the aggregates.
+            app.logger.warning("Failed to update attendance rollups: %s", e)
+    new = {str(doc["face_id"]): doc["_id"] for doc in inserted}
+    return {
+        face_id: (face_id in new, str(new[face_id]) if face_id in new else None)
+        for face_id in face_ids
+    }
+
 
 @app.route("/signin/success/<face_id>")
 def signin_success(face_id):
     """Display success message after signin with matched record."""
-    db = get_db()
-    user = db.faces.find_one({"_id": ObjectId(face_id)})
+    user = get_repository().get_face(face_id)
     already_signed_in = request.args.get("already_signed_in", "false").lower() == "true"
 
     return render_template(
@@ -276,14 +838,15 @@ def signin_success(face_id):
 @app.route("/attendance/<user_id>")
 def attendance(user_id):
     """Show individual user's attendance records."""
-    db = get_db()
-    user = db.faces.find_one({"_id": ObjectId(user_id)})
+    repository = get_repository()
+    user = repository.get_face(user_id)
     if not user:
         return redirect(url_for("signin"))
-    records = list(
-        db.attendance.find({"face_id": ObjectId(user_id)}).sort("timestamp", -1)
+    records = repository.list_attendance_for(user_id)
+    monthly = get_rollups().monthly_for(user.id)
+    return render_template(
+        "attendance.html", records=records, user=user, monthly=monthly
     )
-    return render_template("attendance.html", records=records, user=user)
 
 
 @app.route("/logout")
@@ -296,23 +859,139 @@ def logout():
 @app.route("/admin/delete", methods=["GET"])
 def admin_delete_page():
     """Display all face records in a deletable admin view."""
-    db = get_db()
     if not session.get("admin"):
         return redirect(url_for("admin_login"))
-    faces = db.faces.find()
+    faces = get_repository().iter_faces()
     return render_template("admin_delete.html", faces=faces)
 
 
+@app.route("/admin/stats")
+def admin_stats():
+    """Return in-process cache statistics as JSON."""
+    if not session.get("admin"):
+        return redirect(url_for("admin_login"))
+    stats = {
+        "presence_cache": presence_cache.stats(),
+        "live_feed": live_feed.stats(),
+        "deepface": ml_pool.stats(),
+        "signin_uploads": signin_uploads.stats(),
+    }
+    if write_behind is not None:
+        stats["write_behind"] = write_behind.stats()
+    return jsonify(stats)
+
+
+@app.route("/admin/profile", methods=["GET", "POST"])
+def admin_profile():
+    """
+    Start a sampling profile, or report on the running one.
+
+    A POST with ``route`` and ``requests`` profiles the next requests to that
+    route pattern (e.g. ``/process_signin``); one with ``seconds`` profiles
+    every thread for that long. Wall and CPU flamegraph input is written to
+    ``PROFILE_DIR``.
+    """
+    if not session.get("admin"):
+        return redirect(url_for("admin_login"))
+    if request.method == "POST":
+        options = request.get_json(silent=True) or request.form
+        route = options.get("route") or None
+        try:
+            requests_wanted = int(options.get("requests") or 0) or None
+            seconds = float(options.get("seconds") or 0) or None
+            profiler.start(
+                options.get("name") or route or "window",
+                routes=(route,) if route else None,
+                requests=requests_wanted,
+                seconds=seconds,
+            )
+        except ValueError as error:
+            return jsonify({"success": False, "message": str(error)}), 400
+    return jsonify(profiler.status())
+
+
 @app.route("/admin/delete/<face_id>", methods=["POST"])
 def delete_face(face_id):
-    """Delete a specific face record by ID."""
-    db = get_db()
+    """Delete a face through every DeepFace replica, so none still matches it."""
     if not session.get("admin"):
         return redirect(url_for("admin_login"))
-    db.faces.delete_one({"_id": ObjectId(face_id)})
+    send = ml_pool.broadcast(requests.delete)
+    try:
+        ml_client.with_retry(send, request_deadline(), f"/faces/{face_id}")
+    except (requests.RequestException, ml_client.DeadlineExceeded) as e:
+        # Delete the stored face; sharded galleries drop it on their next reload
+        app.logger.warning("Failed to delete face %s through DeepFace: %s", face_id, e)
+        get_repository().delete_face(face_id)
+    presence_cache.discard(face_id)
     flash("Face record deleted successfully.", "success")
     return redirect(url_for("admin_delete_page"))
 
 
+@app.cli.group("rollups")
+def rollups_cli():
+    """Maintain the precomputed attendance rollups."""
+
+
+@rollups_cli.command("rebuild")
+def rebuild_rollups():
+    """Recompute the rollups from raw attendance; run with sign-ins stopped."""
+    get_rollups().rebuild(get_repository().iter_daily_keys(SITE_TIMEZONE))
+    click.echo("Attendance rollups rebuilt")
+
+
+@rollups_cli.command("check")
+def check_rollups():
+    """Compare the rollups with raw attendance; exit 1 on mismatch."""
+    mismatches = get_rollups().check(get_repository().iter_daily_keys(SITE_TIMEZONE))
+    for mismatch in mismatches:
+        click.echo(
+            f"{mismatch['kind']} {mismatch['key']}: "
+            f"expected {mismatch['expected']}, found {mismatch['actual']}"
+        )
+    if mismatches:
+        raise SystemExit(1)
+    click.echo("Attendance rollups are consistent")
+
+
+@app.cli.group("attendance")
+def attendance_cli():
+    """Manage attendance storage."""
+
+
+@attendance_cli.command("archive")
+@click.option(
+    "--retention-months",
+    type=int,
+    default=ATTENDANCE_RETENTION_MONTHS,
+    show_default=True,
+    help="Months, including the current one, kept live in MongoDB.",
+)
+def archive_attendance(retention_months):
+    """Move monthly partitions older than the retention window to Parquet."""
+    now = site_now()
+    month_index = now.year * 12 + now.month - 1 - (retention_months - 1)
+    cutoff = f"{month_index // 12:04d}-{month_index % 12 + 1:02d}"
+    archived = get_repository().archive_months_before(cutoff)
+    for month, rows in archived:
+        click.echo(f"Archived {month}: {rows} records")
+    click.echo(f"{len(archived)} partition(s) archived before {cutoff}")
+
+
+write_behind = (
+    AttendanceWriteBehind(
+        ATTENDANCE_WAL_PATH,
+        _background_repository,
+        max_batch=ATTENDANCE_FLUSH_SIZE,
+        max_delay=ATTENDANCE_FLUSH_INTERVAL,
+        on_flush=_rollup_flushed,
+    )
+    if ATTENDANCE_WRITE_BEHIND
+    else None
+)
+if write_behind is not None:
+    write_behind.start()
+    atexit.register(write_behind.stop)
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=3000)
@@ -0,0 +1,458 @@
+"""
+ASGI entry point for SmartGate with a non-blocking sign-in path.
+
+Run with an ASGI server instead of ``python app.py``, for example::
+
+    uvicorn asgi:application --host 0.0.0.0 --port 3000 --workers 2
+
+``POST /process_signin`` is handled natively. The request body is read and the
+DeepFace verify call is awaited on a shared ``httpx.AsyncClient``, so a sign-in
+waiting on inference holds a coroutine and a pooled connection rather than a
+worker thread. Recording the result reuses the Flask implementation
+(``app.complete_signin``) on a small thread pool, where it is a presence cache
+lookup or a single indexed upsert. Every other route is served by the Flask app
+through asgiref's WSGI adapter.
+
+``GET /admin/live`` is handled natively too. asgiref runs every WSGI request on
+one shared thread, so an endless event stream served by Flask would stall
+every other route while an admin dashboard is open. Here each viewer is an
+async generator over the same ``LiveFeed``.
+
+``/signin/stream`` is a WebSocket for hands-free kiosks (``signin.html?stream=1``).
+The kiosk streams small frames; each one only goes through face detection,
+and faces are tracked across frames (``src.tracking``). Recognition runs once
+per person, when a new face has been steady and sharp for a few frames, and
+the sign-in result is pushed back over the socket.
+
+Needs ``uvicorn[standard]`` (for WebSockets), ``httpx`` and ``asgiref``, which
+the Pipfile installs.
+"""
+
+import asyncio
+import contextvars
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode
+
+from flask import g, request, session
+from pymongo import MongoClient
+
+import app as webapp
+from src import metrics, ml_client, tracing
+from src.tracking import FaceTracker
+
+try:
+    import httpx
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:  # pragma: no cover
+    httpx = None
+    WsgiToAsgi = None
+
+SIGNIN_PATH = "/process_signin"
+STREAM_PATH = "/signin/stream"
+LIVE_PATH = "/admin/live"
+SIGNIN_THREADS = int(os.environ.get("SIGNIN_THREADS", "16"))
+DEEPFACE_MAX_CONNECTIONS = int(os.environ.get("DEEPFACE_MAX_CONNECTIONS", "500"))
+# Streaming sign-ins: per-frame detection budget and when a track is ready
+STREAM_FRAME_BUDGET = float(os.environ.get("STREAM_FRAME_BUDGET", "2"))
+STREAM_STABLE_FRAMES = int(os.environ.get("STREAM_STABLE_FRAMES", "3"))
+STREAM_MIN_FACE_PX = int(os.environ.get("STREAM_MIN_FACE_PX", "60"))
+STREAM_MIN_SHARPNESS = float(os.environ.get("STREAM_MIN_SHARPNESS", "20"))
+
+
+def _environ(scope, body):
+    """Build a WSGI environ for an ASGI HTTP ``scope`` and its full ``body``."""
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin1").lower()
+        if name == "content-length":
+            continue
+        key = (
+            "CONTENT_TYPE"
+            if name == "content-type"
+            else "HTTP_" + name.upper().replace("-", "_")
+        )
+        value = raw_value.decode("latin1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _form_scope(scope):
+    """Return the HTTP scope of a sign-in form posted over ``scope``'s socket."""
+    return {
+        "type": "http",
+        "method": "POST",
+        "path": SIGNIN_PATH,
+        "root_path": scope.get("root_path", ""),
+        "query_string": b"",
+        "server": scope.get("server"),
+        "client": scope.get("client"),
+        "scheme": "https" if scope.get("scheme") == "wss" else "http",
+        "headers": [(b"content-type", b"application/x-www-form-urlencoded")],
+    }
+
+
+def _header(scope, name):
+    """Return the first value of header ``name`` in ``scope``, or None."""
+    wanted = name.lower().encode("latin1")
+    for raw_name, raw_value in scope.get("headers", []):
+        if raw_name.lower() == wanted:
+            return raw_value.decode("latin1")
+    return None
+
+
+async def _read_body(receive):
+    parts = []
+    while True:
+        message = await receive()
+        parts.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(parts)
+
+
+def _is_admin():
+    return bool(session.get("admin"))
+
+
+def _form_request():
+    if "image" not in request.form:
+        return None
+    webapp.signin_uploads.observe(request.form["image"])
+    return webapp.signin_request(request.form)
+
+
+class SigninApplication:  # pylint: disable=too-few-public-methods
+    """
+    ASGI application serving sign-ins asynchronously and the rest via Flask.
+
+    Args:
+        flask_app (Flask): The SmartGate Flask app.
+        pool (ReplicaPool): The DeepFace replicas to call.
+        threads (int): Threads available for the blocking parts of a sign-in
+            (form parsing and recording). Sign-ins waiting on DeepFace do not
+            occupy one.
+        max_connections (int): Concurrent connections to the DeepFace service.
+        database (optional): Database shared by sign-ins in this process.
+            Defaults to one ``MongoClient`` created on first use.
+    """
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        flask_app,
+        pool,
+        threads=SIGNIN_THREADS,
+        max_connections=DEEPFACE_MAX_CONNECTIONS,
+        database=None,
+    ):
+        if httpx is None or WsgiToAsgi is None:
+            raise RuntimeError(
+                "The async sign-in path requires httpx and asgiref "
+                "(pip install httpx asgiref 'uvicorn[standard]')"
+            )
+        self.flask_app = flask_app
+        self.pool = pool
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="signin"
+        )
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=webapp.DEEPFACE_REQUEST_BUDGET,
+        )
+        self.database = database
+        self._database_lock = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif (
+            scope["type"] == "http"
+            and scope["method"] == "POST"
+            and scope["path"] == SIGNIN_PATH
+        ):
+            await self._process_signin(scope, receive, send)
+        elif (
+            scope["type"] == "http"
+            and scope["method"] == "GET"
+            and scope["path"] == LIVE_PATH
+        ):
+            await self._admin_live(scope, receive, send)
+        elif scope["type"] == "websocket":
+            if scope["path"] == STREAM_PATH:
+                await self._stream_signin(scope, receive, send)
+            else:
+                await send({"type": "websocket.close", "code": 1008})
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.client.aclose()
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _process_signin(self, scope, receive, send):
+        deadline = ml_client.Deadline.from_header(
+            _header(scope, ml_client.DEADLINE_HEADER), webapp.DEEPFACE_REQUEST_BUDGET
+        )
+        metrics.ENDPOINT.set(SIGNIN_PATH)
+        started = time.perf_counter()
+        span = tracing.enter(f"POST {SIGNIN_PATH}", _header(scope, tracing.TRACEPARENT))
+        try:
+            body = await _read_body(receive)
+            reply = await self._signin(scope, body, deadline)
+        finally:
+            tracing.leave(span)
+        await _send(send, *reply)
+        metrics.REQUEST_SECONDS.observe(
+            time.perf_counter() - started, SIGNIN_PATH, "POST", str(reply[0])
+        )
+
+    async def _signin(self, scope, body, deadline):
+        """Sign in the form ``body``; return the reply as ``(status, headers, body)``."""
+        signin_request = await self._run(scope, body, _form_request)
+        if signin_request is None:
+            # Let the Flask view produce its "No image provided" response
+            return await self._run(scope, body, self._reply, webapp.process_signin)
+
+        started = time.perf_counter()
+        try:
+            response = await ml_client.send_within(
+                self.pool.async_sender(
+                    self.client.post, hedge=not webapp.SIGNIN_SINGLE_HOP
+                ),
+                deadline,
+                signin_request[0],
+                json=signin_request[1],
+            )
+        except (httpx.HTTPError, ml_client.DeadlineExceeded) as error:
+            reply = await self._run(
+                scope, body, self._reply, webapp.signin_unavailable, error
+            )
+        else:
+            result = response.json() if response.status_code == 200 else None
+            reply = await self._run(
+                scope,
+                body,
+                self._reply,
+                webapp.complete_signin,
+                response.status_code,
+                result,
+                ml_client.retry_after(response),
+                ml_client.call_timings(response, time.perf_counter() - started),
+            )
+        return reply
+
+    async def _admin_live(self, scope, receive, send):
+        """Stream new sign-ins to an admin dashboard until it disconnects."""
+        body = await _read_body(receive)
+        if not await self._run(scope, body, _is_admin):
+            # The Flask view redirects to the login page
+            await _send(
+                send, *await self._run(scope, body, self._reply, webapp.admin_live)
+            )
+            return
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream; charset=utf-8"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+        stream = webapp.live_feed.astream()
+        disconnected = asyncio.ensure_future(receive())
+        chunk = None
+        try:
+            while True:
+                chunk = asyncio.ensure_future(anext(stream))
+                await asyncio.wait(
+                    {chunk, disconnected}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not chunk.done():
+                    break
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": chunk.result().encode(),
+                        "more_body": True,
+                    }
+                )
+        finally:
+            disconnected.cancel()
+            if chunk is not None and not chunk.done():
+                chunk.cancel()
+                await asyncio.wait({chunk})
+            await stream.aclose()
+
+    async def _stream_signin(self, scope, receive, send):
+        """
+        Sign in faces from a kiosk's stream of frames.
+
+        Each text message is a JSON ``{"image": <data URL>}`` frame and gets
+        one JSON reply, so the kiosk sends its next frame when the last one
+        has been handled. Replies are ``tracking`` messages listing the
+        tracked faces, or a ``signin`` message with the group sign-in result
+        when a track became ready and its frame was recognised.
+        """
+        if (await receive())["type"] != "websocket.connect":
+            return
+        await send({"type": "websocket.accept"})
+        tracker = FaceTracker(
+            STREAM_STABLE_FRAMES, STREAM_MIN_FACE_PX, STREAM_MIN_SHARPNESS
+        )
+        counts = {"frames": 0, "recognitions": 0}
+        metrics.ENDPOINT.set(STREAM_PATH)
+        while True:
+            message = await receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            try:
+                frame = json.loads(message.get("text") or message.get("bytes"))
+                frame = frame["image"]
+            except (TypeError, ValueError, KeyError):
+                reply = {"type": "error", "message": 'Expected {"image": ...}'}
+            else:
+                counts["frames"] += 1
+                started = time.perf_counter()
+                # Each frame is its own trace, sampled like a request
+                span = tracing.enter(f"WEBSOCKET {STREAM_PATH}")
+                try:
+                    reply = await self._stream_frame(scope, tracker, frame, counts)
+                finally:
+                    tracing.leave(span)
+                reply.update(counts)
+                # One sample per frame, labelled by what the frame led to
+                metrics.REQUEST_SECONDS.observe(
+                    time.perf_counter() - started,
+                    STREAM_PATH,
+                    "WEBSOCKET",
+                    reply["type"],
+                )
+            await send({"type": "websocket.send", "text": json.dumps(reply)})
+
+    async def _stream_frame(self, scope, tracker, frame, counts):
+        """Track the faces in one frame and recognise them once one is ready."""
+        try:
+            response = await ml_client.send_within(
+                self.pool.async_sender(self.client.post),
+                ml_client.Deadline(STREAM_FRAME_BUDGET),
+                "/faces/detect",
+                json={"img": frame},
+            )
+            detected = response.json() if response.status_code == 200 else {}
+        except (httpx.HTTPError, ml_client.DeadlineExceeded):
+            detected = {}
+        if not detected.get("success"):
+            # Busy or unreachable: drop the frame, the next one will do
+            return {"type": "tracking", "faces": tracker.visible(), "skipped": True}
+
+        ready = tracker.update(detected["faces"])
+        if not ready:
+            return {"type": "tracking", "faces": tracker.visible()}
+
+        # Recognise everyone in the frame, so faces that were still settling
+        # are not recognised again on a later frame
+        query = dict(parse_qsl(scope.get("query_string", b"").decode("latin1")))
+        form = {key: query[key] for key in ("gate", "site") if key in query}
+        form.update(image=frame, group="1")
+        counts["recognitions"] += 1
+        status, _, body = await self._signin(
+            _form_scope(scope),
+            urlencode(form).encode("latin1"),
+            ml_client.Deadline(webapp.DEEPFACE_REQUEST_BUDGET),
+        )
+        result = json.loads(body)
+        if status == 200 and "faces" in result:
+            tracker.settle([face["box"] for face in result["faces"]])
+        else:
+            tracker.reopen(ready)
+        return {"type": "signin", "result": result, "faces": tracker.visible()}
+
+    async def _run(self, scope, body, func, *args):
+        """Call ``func`` on the thread pool inside a Flask request context."""
+        loop = asyncio.get_running_loop()
+        # Carry the route label (metrics.ENDPOINT) over to the pool thread
+        return await loop.run_in_executor(
+            self.executor,
+            contextvars.copy_context().run,
+            self._in_request,
+            scope,
+            body,
+            func,
+            args,
+        )
+
+    def _in_request(self, scope, body, func, args):
+        with self.flask_app.request_context(_environ(scope, body)):
+            g.db = self._shared_database()
+            return func(*args)
+
+    def _shared_database(self):
+        with self._database_lock:
+            if self.database is None:
+                self.database = MongoClient(webapp.MONGO_URI)["smart_gate"]
+            return self.database
+
+    def _reply(self, view, *args):
+        """Run a Flask view and return ``(status, headers, body)``."""
+        response = self.flask_app.make_response(view(*args))
+        response = self.flask_app.process_response(response)
+        return (
+            response.status_code,
+            response.headers.to_wsgi_list(),
+            response.get_data(),
+        )
+
+
+async def _send(send, status, headers, body):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (name.encode("latin1"), value.encode("latin1"))
+                for name, value in headers
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+application = SigninApplication(webapp.app, webapp.ml_pool)
@@ -0,0 +1,268 @@
+"""
+Load test comparing the sync (Flask) and async (ASGI) sign-in paths.
+
+Start a stand-in DeepFace service with a fixed inference delay, point the web
+app at it, and fire concurrent sign-ins at each server in turn::
+
+    python loadtest.py fake-ml --port 5105 --delay 0.5
+
+    DEEPFACE_API_URL=http://localhost:5105 python app.py
+    python loadtest.py run --url http://localhost:3000 -n 1000 -c 300
+
+    DEEPFACE_API_URL=http://localhost:5105 uvicorn asgi:application --port 3001
+    python loadtest.py run --url http://localhost:3001 -n 1000 -c 300
+
+To measure tail latency with several replicas and hedging, give the stand-ins
+an occasional slow answer and compare one replica against two with hedging::
+
+    python loadtest.py fake-ml --port 5105 --tail-fraction 0.05 --tail-delay 3
+    python loadtest.py fake-ml --port 5106 --tail-fraction 0.05 --tail-delay 3
+
+    DEEPFACE_API_URL=http://localhost:5105 python app.py
+    python loadtest.py run -n 1000 -c 50
+
+    DEEPFACE_API_URLS=http://localhost:5105,http://localhost:5106 \
+        DEEPFACE_HEDGE=true python app.py
+    python loadtest.py run -n 1000 -c 50
+
+To compare the two-hop sign-in (verify, then the web app records attendance)
+with the single-hop one (``POST /signins`` verifies and records), run the real
+DeepFace service against a scratch database and load each mode in turn::
+
+    python loadtest.py run -n 1000 -c 50
+    SIGNIN_SINGLE_HOP=true python app.py
+    python loadtest.py run -n 1000 -c 50
+
+``run`` reports p50/p95 of each ``Server-Timing`` component of the replies:
+``deepface`` (the round trip from the web app), ``ml-verify`` and
+``ml-record`` (inside the DeepFace service) and ``record`` (the web app's own
+MongoDB work, two-hop only).
+
+To see what the capture settings (``CAPTURE_*``, see the README) save on a slow
+kiosk uplink, vary the uploaded JPEG size with the uplink throttled, e.g. a
+full 640x480 frame against a face crop on a 1 Mbit/s link::
+
+    python loadtest.py run -n 200 -c 20 --uplink-kbps 1000 --image-bytes 45000
+    python loadtest.py run -n 200 -c 20 --uplink-kbps 1000 --image-bytes 8000
+
+``bytes_per_signin`` is the size of each request body. The web app's
+``/admin/stats`` reports the sizes real kiosks upload under ``signin_uploads``.
+
+The stand-in answers every verify call with a random face id, so each request
+is a first sign-in and is written to MongoDB. Use a scratch database.
+
+``run`` needs ``httpx``, which the web app's Pipfile installs.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src import ml_client
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+IMAGE_BYTES = 30000
+BOUNDARY = "smartgate-loadtest"
+
+
+class _FakeVerifyHandler(BaseHTTPRequestHandler):
+    delay = 0.5
+    tail_fraction = 0.0
+    tail_delay = 0.0
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Answer a verify or sign-in call after the inference delay."""
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        slow = random.random() < self.tail_fraction
+        delay = self.tail_delay if slow else self.delay
+        time.sleep(delay)
+        result = {
+            "success": True,
+            "verified": True,
+            "match": {"_id": os.urandom(12).hex(), "name": "Load Test"},
+        }
+        if self.path == "/signins":
+            # Pretend to record; nothing is written
+            result.update({"first": True, "attendance_id": os.urandom(12).hex()})
+        body = json.dumps(result).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Server-Timing", f"verify;dur={delay * 1000:.1f}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class _FakeMLServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def serve_fake_ml(port, delay, tail_fraction=0.0, tail_delay=0.0):
+    """
+    Serve stand-in ``/faces/verify`` and ``/signins`` that sleep ``delay`` seconds.
+
+    A ``tail_fraction`` of calls sleep ``tail_delay`` seconds instead.
+    """
+    _FakeVerifyHandler.delay = delay
+    _FakeVerifyHandler.tail_fraction = tail_fraction
+    _FakeVerifyHandler.tail_delay = tail_delay
+    with _FakeMLServer(("0.0.0.0", port), _FakeVerifyHandler) as server:
+        print(f"Fake DeepFace on :{port} with {delay:.3f}s inference")
+        server.serve_forever()
+
+
+def signin_body(image_bytes):
+    """Return a multipart sign-in form carrying a ``image_bytes`` JPEG."""
+    image = "data:image/jpeg;base64," + "A" * (image_bytes * 4 // 3)
+    return (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="image"\r\n\r\n'
+        f"{image}\r\n--{BOUNDARY}--\r\n"
+    ).encode("ascii")
+
+
+async def _throttled(body, kbps):
+    """Yield ``body`` no faster than an uplink of ``kbps`` kilobits per second."""
+    chunk = max(1, kbps * 1000 // 8 // 20)
+    for start in range(0, len(body), chunk):
+        piece = body[start : start + chunk]
+        yield piece
+        await asyncio.sleep(len(piece) * 8 / (kbps * 1000))
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+async def _signin(client, url, body, uplink_kbps, latencies, failures, breakdown):
+    started = time.perf_counter()
+    try:
+        response = await client.post(
+            f"{url}/process_signin",
+            content=_throttled(body, uplink_kbps) if uplink_kbps else body,
+            headers={
+                "Content-Type": f"multipart/form-data; boundary={BOUNDARY}",
+                "Content-Length": str(len(body)),
+            },
+        )
+        ok = response.status_code == 200 and response.json().get("success")
+        timing = response.headers.get("Server-Timing")
+        for name, ms in ml_client.parse_server_timing(timing):
+            breakdown.setdefault(name, []).append(ms)
+    except httpx.HTTPError:
+        ok = False
+    latencies.append(time.perf_counter() - started)
+    if not ok:
+        failures.append(1)
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run_load(url, total, concurrency, image_bytes=IMAGE_BYTES, uplink_kbps=0):
+    """
+    Send ``total`` sign-ins to ``url`` with ``concurrency`` in flight.
+
+    Args:
+        image_bytes (int): Size of the JPEG each sign-in uploads.
+        uplink_kbps (int): Upload speed of each simulated kiosk; 0 is
+            unthrottled.
+
+    Returns:
+        dict: Request counts, bytes per sign-in, throughput, latency
+        percentiles and the p50/p95 of each ``Server-Timing`` component.
+    """
+    if httpx is None:
+        raise RuntimeError("The load test requires httpx (pip install httpx)")
+    latencies = []
+    failures = []
+    breakdown = {}
+    body = signin_body(image_bytes)
+    gate = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async def one(client):
+        async with gate:
+            await _signin(
+                client, url, body, uplink_kbps, latencies, failures, breakdown
+            )
+
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(client) for _ in range(total)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": total,
+        "failures": len(failures),
+        "bytes_per_signin": len(body),
+        "seconds": round(elapsed, 2),
+        "throughput_rps": round(total / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000),
+        "breakdown_ms": {
+            name: {
+                "p50": round(_percentile(samples, 0.50), 1),
+                "p95": round(_percentile(samples, 0.95), 1),
+            }
+            for name, samples in sorted(breakdown.items())
+        },
+    }
+
+
+def main():
+    """Parse the command line and run the chosen subcommand."""
+    parser = argparse.ArgumentParser(description="SmartGate sign-in load test")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fake = commands.add_parser("fake-ml", help="serve a stand-in DeepFace service")
+    fake.add_argument("--port", type=int, default=5105)
+    fake.add_argument("--delay", type=float, default=0.5, help="seconds per verify")
+    fake.add_argument(
+        "--tail-fraction", type=float, default=0.0, help="share of slow verifies"
+    )
+    fake.add_argument(
+        "--tail-delay", type=float, default=0.0, help="seconds per slow verify"
+    )
+
+    run = commands.add_parser("run", help="send concurrent sign-ins")
+    run.add_argument("--url", default="http://localhost:3000")
+    run.add_argument("-n", "--requests", type=int, default=500)
+    run.add_argument("-c", "--concurrency", type=int, default=100)
+    run.add_argument(
+        "--image-bytes", type=int, default=IMAGE_BYTES, help="JPEG size per sign-in"
+    )
+    run.add_argument(
+        "--uplink-kbps", type=int, default=0, help="per-kiosk upload speed, 0 = off"
+    )
+
+    args = parser.parse_args()
+    if args.command == "fake-ml":
+        serve_fake_ml(args.port, args.delay, args.tail_fraction, args.tail_delay)
+    else:
+        result = asyncio.run(
+            run_load(
+                args.url,
+                args.requests,
+                args.concurrency,
+                args.image_bytes,
+                args.uplink_kbps,
+            )
+        )
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Columnar archive of old attendance partitions.
+
+Attendance is stored in one MongoDB collection per month (see
+``src/repository.py``). Once a month falls outside the retention window the
+archive job copies its partition into a compressed Parquet file and drops the
+collection. The repository reads archived months back through this module,
+so exports and per-person history still include them.
+
+Parquet support needs ``pyarrow``, which the Pipfile installs. The import stays
+optional: without it the web app works normally, but the archive job cannot run
+and archived months cannot be read.
+"""
+
+import os
+from datetime import timezone
+
+from bson.objectid import ObjectId
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+    pq = None
+
+ROW_GROUP_SIZE = 10000
+FILE_PREFIX = "attendance_"
+FILE_SUFFIX = ".parquet"
+
+
+def _require_pyarrow():
+    if pq is None:
+        raise RuntimeError(
+            "Reading or writing the attendance archive requires pyarrow "
+            "(pip install pyarrow)"
+        )
+
+
+def _schema():
+    return pa.schema(
+        [
+            ("_id", pa.string()),
+            ("face_id", pa.string()),
+            ("local_date", pa.string()),
+            ("timestamp", pa.timestamp("us", tz="UTC")),
+        ]
+    )
+
+
+def _utc(value):
+    """Normalise a datetime to aware UTC; naive values are already UTC."""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+class AttendanceArchive:
+    """
+    Directory of ``attendance_YYYY_MM.parquet`` files, one per archived month.
+
+    Args:
+        directory (str): Where archive files are stored.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, month):
+        """Return the archive file path for ``month`` (``YYYY-MM``)."""
+        return os.path.join(
+            self.directory, f"{FILE_PREFIX}{month.replace('-', '_')}{FILE_SUFFIX}"
+        )
+
+    def months(self):
+        """Return the archived months in ascending order."""
+        if not os.path.isdir(self.directory):
+            return []
+        months = []
+        for name in os.listdir(self.directory):
+            if name.startswith(FILE_PREFIX) and name.endswith(FILE_SUFFIX):
+                months.append(
+                    name[len(FILE_PREFIX) : -len(FILE_SUFFIX)].replace("_", "-")
+                )
+        return sorted(months)
+
+    def has(self, month):
+        """Return whether ``month`` has been archived."""
+        return os.path.exists(self.path(month))
+
+    def write(self, month, docs):
+        """
+        Write attendance documents for ``month`` to its Parquet file.
+
+        Documents are written in row groups, so memory use is bounded by
+        ``ROW_GROUP_SIZE``. The file appears atomically once complete.
+
+        Returns:
+            int: Number of rows written.
+        """
+        _require_pyarrow()
+        os.makedirs(self.directory, exist_ok=True)
+        final_path = self.path(month)
+        tmp_path = final_path + ".tmp"
+        count = 0
+        with pq.ParquetWriter(tmp_path, _schema(), compression="zstd") as writer:
+            batch = []
+            for doc in docs:
+                batch.append(doc)
+                if len(batch) >= ROW_GROUP_SIZE:
+                    writer.write_table(self._table(batch))
+                    count += len(batch)
+                    batch = []
+            if batch or not count:
+                writer.write_table(self._table(batch))
+                count += len(batch)
+        os.replace(tmp_path, final_path)
+        return count
+
+    def read(self, month, face_id=None, start=None, end=None):
+        """
+        Stream archived documents of ``month``, optionally filtered.
+
+        Args:
+            month (str): ``YYYY-MM``.
+            face_id (optional): Only return this person's records.
+            start, end (datetime, optional): Only return records with
+                ``start <= timestamp < end``.
+
+        Yields:
+            dict: Documents shaped like the MongoDB ones, with naive UTC
+            timestamps as pymongo returns them.
+        """
+        _require_pyarrow()
+        face_filter = str(face_id) if face_id is not None else None
+        start = _utc(start) if start is not None else None
+        end = _utc(end) if end is not None else None
+        parquet = pq.ParquetFile(self.path(month))
+        for batch in parquet.iter_batches(batch_size=ROW_GROUP_SIZE):
+            for row in batch.to_pylist():
+                if face_filter is not None and row["face_id"] != face_filter:
+                    continue
+                timestamp = row["timestamp"]
+                if start is not None and timestamp < start:
+                    continue
+                if end is not None and timestamp >= end:
+                    continue
+                yield {
+                    "_id": ObjectId(row["_id"]),
+                    "face_id": ObjectId(row["face_id"]),
+                    "local_date": row["local_date"],
+                    "timestamp": timestamp.replace(tzinfo=None),
+                }
+
+    @staticmethod
+    def _table(docs):
+        return pa.Table.from_pylist(
+            [
+                {
+                    "_id": str(doc["_id"]),
+                    "face_id": str(doc["face_id"]),
+                    "local_date": doc["local_date"],
+                    "timestamp": _utc(doc["timestamp"]),
+                }
+                for doc in docs
+            ],
+            schema=_schema(),
+        )
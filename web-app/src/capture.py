@@ -0,0 +1,50 @@
+"""
+Accounting for the images kiosks upload.
+
+Kiosks send captures as ``data:image/jpeg;base64,...`` URLs. Their size is set
+by the capture settings (resolution, JPEG quality and the optional face crop;
+see ``CAPTURE_*`` in ``app.py``), and it dominates the sign-in time on a slow
+uplink. ``UploadStats`` keeps running totals so ``/admin/stats`` can report the
+bytes per sign-in that a given configuration actually produces.
+"""
+
+import threading
+
+
+def jpeg_bytes(data_url):
+    """Return the decoded size of a base64 ``data:`` URL's payload."""
+    payload = data_url.split(",", 1)[-1].strip()
+    return len(payload) * 3 // 4 - payload[-2:].count("=")
+
+
+class UploadStats:
+    """Thread-safe totals of uploaded sign-in images."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.total_bytes = 0
+        self.total_jpeg_bytes = 0
+        self.max_bytes = 0
+
+    def observe(self, data_url):
+        """Count one uploaded image."""
+        size = len(data_url)
+        with self._lock:
+            self.uploads += 1
+            self.total_bytes += size
+            self.total_jpeg_bytes += jpeg_bytes(data_url)
+            self.max_bytes = max(self.max_bytes, size)
+
+    def stats(self):
+        """Return upload counts and mean sizes, as sent and as JPEG."""
+        with self._lock:
+            uploads = self.uploads
+            return {
+                "uploads": uploads,
+                "mean_bytes": round(self.total_bytes / uploads) if uploads else 0,
+                "mean_jpeg_bytes": (
+                    round(self.total_jpeg_bytes / uploads) if uploads else 0
+                ),
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,135 @@
+"""
+Fan-out publisher for the admin dashboard's live sign-in feed.
+
+``process_signin`` publishes each recorded sign-in once; every connected
+dashboard receives it through its own bounded queue and a server-sent-events
+stream. Viewers never query the database for updates, so adding viewers costs
+one queue each instead of one poll loop each. ``stream`` serves a viewer from a
+WSGI worker thread; ``astream`` serves one from an asyncio event loop without
+holding a thread.
+"""
+
+import asyncio
+import itertools
+import json
+import queue
+import threading
+from contextlib import contextmanager
+
+HEARTBEAT_SECONDS = 15
+
+
+def _frame(event_id, event):
+    return f"id: {event_id}\nevent: signin\ndata: {json.dumps(event)}\n\n"
+
+
+class _LoopQueue:  # pylint: disable=too-few-public-methods
+    """A bounded ``asyncio.Queue`` that publisher threads can put into."""
+
+    def __init__(self, maxsize):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+
+    def put_nowait(self, message):
+        """Hand ``message`` to the event loop; raise ``queue.Full`` if full."""
+        if self.queue.full():
+            raise queue.Full
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            pass
+
+
+class LiveFeed:
+    """
+    In-process publish/subscribe hub for sign-in events.
+
+    Args:
+        max_pending (int): Events buffered per viewer. A viewer that falls
+            further behind misses events rather than slowing the publisher.
+    """
+
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._ids = itertools.count(1)
+        self.published = 0
+        self.dropped = 0
+
+    def publish(self, event):
+        """Send ``event`` (a JSON-serialisable dict) to every viewer."""
+        with self._lock:
+            message = (next(self._ids), event)
+            self.published += 1
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+
+    @contextmanager
+    def subscribe(self, subscriber=None):
+        """
+        Register a viewer for as long as the context is open.
+
+        Args:
+            subscriber (optional): Object with a ``put_nowait`` that raises
+                ``queue.Full``. Defaults to a new bounded ``queue.Queue``.
+        """
+        if subscriber is None:
+            subscriber = queue.Queue(maxsize=self.max_pending)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        try:
+            yield subscriber
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+    def stream(self, heartbeat=HEARTBEAT_SECONDS):
+        """
+        Yield a ``text/event-stream`` body for one viewer.
+
+        A comment line is sent every ``heartbeat`` seconds without events so
+        that proxies keep the connection open and disconnected viewers are
+        noticed and unsubscribed.
+        """
+        with self.subscribe() as subscriber:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event_id, event = subscriber.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _frame(event_id, event)
+
+    async def astream(self, heartbeat=HEARTBEAT_SECONDS):
+        """Like ``stream``, but an async generator to iterate on an event loop."""
+        subscriber = _LoopQueue(self.max_pending)
+        with self.subscribe(subscriber):
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event_id, event = await asyncio.wait_for(
+                        subscriber.queue.get(), heartbeat
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _frame(event_id, event)
+
+    def stats(self):
+        """Return viewer and delivery counts as a JSON-serialisable dict."""
+        with self._lock:
+            return {
+                "viewers": len(self._subscribers),
+                "published": self.published,
+                "dropped": self.dropped,
+            }
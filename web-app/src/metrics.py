@@ -0,0 +1,233 @@
+"""
+Route and dependency latency metrics for the web app.
+
+``GET /metrics`` renders two summaries in the Prometheus text format, each
+with p50, p95 and p99 over a sliding window of recent observations (the same
+windowed quantiles ``src.ml_pool`` uses for hedging):
+
+* ``webapp_request_seconds{endpoint,method,status}``: the time to answer each
+  route;
+* ``webapp_dependency_seconds{endpoint,dependency,operation}``: the time the
+  route spent waiting on ``deepface`` (per DeepFace path), ``mongo`` (per
+  collection and command) and ``jinja`` (per template).
+
+Labels are bounded: ``endpoint`` is the route pattern (``/attendance/<user_id>``,
+never the id itself), face ids in DeepFace paths become ``<face_id>`` and
+monthly attendance partitions become ``attendance_<month>``. Work done outside
+a request, such as the write-behind flusher, is labelled ``background``.
+
+MongoDB time comes from pymongo's command monitoring, so it includes cursor
+batches fetched while a template iterates over a result. That time counts under
+both ``mongo`` and ``jinja``.
+"""
+
+import re
+import threading
+from collections import deque
+from contextvars import ContextVar
+
+from flask import has_request_context, request
+from pymongo import monitoring
+
+from src import tracing
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+QUANTILES = (0.5, 0.95, 0.99)
+WINDOW = 1024
+
+FACE_ID = re.compile(r"/[0-9a-f]{24}(?=/|$)")
+PARTITION = re.compile(r"^attendance_\d{4}_\d{2}$")
+
+# Route of the asgi.py coroutine running now; set per task, and preferred to
+# the Flask request context asgi.py pushes to reuse views
+ENDPOINT = ContextVar("endpoint", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def family(name, kind, documentation, samples):
+    """
+    Render one metric family in the Prometheus text format.
+
+    Args:
+        name (str): Metric name.
+        kind (str): ``counter``, ``gauge`` or ``summary``.
+        documentation (str): The ``# HELP`` text.
+        samples (list): ``(suffix, labels, value)`` triples; ``suffix`` is
+            appended to ``name`` (e.g. ``"_count"``), ``labels`` is a dict.
+
+    Returns:
+        str: The family's lines, ending in a newline.
+    """
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    lines += [
+        f"{name}{suffix}{_labels(labels)} {value}" for suffix, labels, value in samples
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def _quantile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Summary:
+    """
+    Thread-safe latency summary with fixed label names.
+
+    Quantiles cover the last ``window`` observations of each label set;
+    ``_sum`` and ``_count`` cover all of them.
+
+    Args:
+        name (str): Metric name.
+        documentation (str): The ``# HELP`` text.
+        labelnames (tuple): Names of the labels passed to ``observe``.
+        window (int): Observations kept per label set for the quantiles.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), window=WINDOW):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.window = window
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, seconds, *labelvalues):
+        """Record ``seconds`` under the given label values."""
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [deque(maxlen=self.window), 0, 0.0]
+            series[0].append(seconds)
+            series[1] += 1
+            series[2] += seconds
+
+    def count(self, *labelvalues):
+        """Return the number of observations under the given label values."""
+        with self._lock:
+            series = self._series.get(labelvalues)
+            return series[1] if series else 0
+
+    def quantiles(self, *labelvalues):
+        """Return ``{quantile: seconds}`` for the given label values."""
+        with self._lock:
+            series = self._series.get(labelvalues)
+            ordered = sorted(series[0]) if series else []
+        return {q: _quantile(ordered, q) for q in QUANTILES} if ordered else {}
+
+    def render(self):
+        """Return the summary as a text-format family."""
+        with self._lock:
+            series = {
+                key: (sorted(recent), count, total)
+                for key, (recent, count, total) in self._series.items()
+            }
+        samples = []
+        for labelvalues, (ordered, count, total) in sorted(series.items()):
+            labels = dict(zip(self.labelnames, labelvalues))
+            samples += [
+                ("", {**labels, "quantile": str(q)}, repr(_quantile(ordered, q)))
+                for q in QUANTILES
+            ]
+            samples.append(("_sum", labels, repr(total)))
+            samples.append(("_count", labels, count))
+        return family(self.name, "summary", self.documentation, samples)
+
+
+REQUEST_SECONDS = Summary(
+    "webapp_request_seconds",
+    "Time to answer each route.",
+    ("endpoint", "method", "status"),
+)
+DEPENDENCY_SECONDS = Summary(
+    "webapp_dependency_seconds",
+    "Time each route spent waiting on DeepFace, MongoDB and Jinja rendering.",
+    ("endpoint", "dependency", "operation"),
+)
+
+
+def endpoint():
+    """Return the route pattern of the work running now, for use as a label."""
+    label = ENDPOINT.get()
+    if label is None and has_request_context():
+        rule = request.url_rule
+        label = rule.rule if rule is not None else "unmatched"
+    return label or "background"
+
+
+def observe_dependency(dependency, operation, seconds):
+    """Record ``seconds`` spent in ``dependency`` by the current route.
+
+    Also recorded as a span of the current trace, if it is sampled.
+    """
+    DEPENDENCY_SECONDS.observe(seconds, endpoint(), dependency, operation)
+    tracing.record(f"{dependency} {operation}", seconds)
+
+
+def deepface_operation(path):
+    """Return the bounded label of a DeepFace path, e.g. ``/faces/<face_id>``."""
+    return FACE_ID.sub("/<face_id>", path.split("?", 1)[0])
+
+
+def observe_deepface(path, seconds):
+    """Record one DeepFace call; used as the ``ReplicaPool`` observer.
+
+    Its span is recorded by ``ml_client.send_within``, which forwards the
+    trace context.
+    """
+    DEPENDENCY_SECONDS.observe(
+        seconds, endpoint(), "deepface", deepface_operation(path)
+    )
+
+
+def _collection(event):
+    # Most commands name their collection; getMore names it separately
+    name = event.command.get(event.command_name)
+    if not isinstance(name, str):
+        name = event.command.get("collection", "")
+    return "attendance_<month>" if PARTITION.match(name) else name
+
+
+class MongoTimer(monitoring.CommandListener):
+    """
+    Times every MongoDB command of the process by collection and command.
+
+    Register once with ``pymongo.monitoring.register``; pymongo calls it on the
+    thread that runs the command, so the route is known.
+    """
+
+    def __init__(self):
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self._operations[(event.connection_id, event.request_id)] = (
+                f"{_collection(event)}.{event.command_name}"
+            )
+
+    def _finished(self, event):
+        with self._lock:
+            operation = self._operations.pop(
+                (event.connection_id, event.request_id), event.command_name
+            )
+        observe_dependency("mongo", operation, event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+
+def render():
+    """Return the text of both summaries."""
+    return REQUEST_SECONDS.render() + DEPENDENCY_SECONDS.render()
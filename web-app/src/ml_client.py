@@ -0,0 +1,184 @@
+"""
+Helpers for calling the DeepFace service.
+
+Each call carries the caller's remaining time budget in the ``X-Deadline-Ms``
+header and uses it as its timeout, so the DeepFace service can drop work the
+web app would no longer wait for. A call whose budget is already spent is not
+made at all. Each call also carries the request's trace context in the
+``traceparent`` header and is recorded as a span (see ``src.tracing``).
+
+The DeepFace service rejects requests it cannot queue with a 503 (or 429) and a
+``Retry-After`` header. Kiosk sign-ins pass that answer straight back to the
+browser, which retries on its own. Admin flows retry server-side with
+``with_retry``. Every wait is jittered so rejected callers do not all come back
+at the same moment.
+
+Sign-in replies carry a ``Server-Timing`` header that splits their latency
+into the DeepFace round trip, the service's own stages and the web app's
+recording, so both sign-in paths can be compared from the outside.
+"""
+
+import inspect
+import random
+import time
+
+import requests
+
+from src import tracing
+
+DEADLINE_HEADER = "X-Deadline-Ms"
+BUSY_STATUSES = (429, 503)
+DEFAULT_RETRY_AFTER = 1
+RETRY_ATTEMPTS = 3
+MAX_RETRY_WAIT = 10
+
+
+class DeadlineExceeded(requests.Timeout):
+    """Raised instead of calling DeepFace once the time budget is spent."""
+
+
+class Deadline:
+    """
+    Point in time by which a DeepFace answer is needed.
+
+    Args:
+        seconds (float): Remaining budget from now.
+    """
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def from_header(cls, value, budget):
+        """
+        Adopt an incoming ``X-Deadline-Ms`` value, capped at ``budget`` seconds.
+
+        A missing or malformed header gives the full ``budget``.
+        """
+        try:
+            return cls(min(budget, int(value) / 1000))
+        except (TypeError, ValueError):
+            return cls(budget)
+
+    def remaining(self):
+        """Return the seconds left, never negative."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+def send_within(send, deadline, *args, **kwargs):
+    """
+    Call ``send(*args, **kwargs)`` with the timeout and header of ``deadline``.
+
+    ``send`` may be a coroutine function (``ReplicaPool.async_sender``); its
+    coroutine is returned for the caller to await.
+
+    Raises:
+        DeadlineExceeded: If the budget is already spent.
+    """
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded before calling DeepFace")
+    span = tracing.child("deepface", path=args[0] if args else "")
+    headers = {
+        **kwargs.pop("headers", {}),
+        DEADLINE_HEADER: str(int(remaining * 1000)),
+        **span.headers(),
+    }
+    try:
+        result = send(*args, timeout=remaining, headers=headers, **kwargs)
+    except BaseException as error:
+        span.end(error=type(error).__name__)
+        raise
+    if inspect.isawaitable(result):
+        return span.end_after(result)
+    span.end(status=getattr(result, "status_code", None))
+    return result
+
+
+def format_server_timing(timings):
+    """Format ``(name, milliseconds)`` pairs as a ``Server-Timing`` value."""
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings)
+
+
+def parse_server_timing(value):
+    """Return the ``(name, milliseconds)`` pairs of a ``Server-Timing`` value."""
+    if not isinstance(value, str):
+        return []
+    timings = []
+    for metric in value.split(","):
+        name, _, params = metric.strip().partition(";")
+        for param in params.split(";"):
+            key, _, duration = param.strip().partition("=")
+            if key == "dur" and name:
+                try:
+                    timings.append((name, float(duration)))
+                except ValueError:
+                    pass
+    return timings
+
+
+def call_timings(response, seconds):
+    """
+    Return the timings of one DeepFace call.
+
+    Args:
+        response: The call's response.
+        seconds (float): Its round trip as seen by the web app.
+
+    Returns:
+        list: ``("deepface", ms)`` followed by the service's own timings,
+        prefixed with ``ml-``.
+    """
+    service = parse_server_timing(response.headers.get("Server-Timing"))
+    return [("deepface", seconds * 1000)] + [(f"ml-{name}", ms) for name, ms in service]
+
+
+def is_busy(response):
+    """Return whether ``response`` is an overload rejection."""
+    return response.status_code in BUSY_STATUSES
+
+
+def retry_after(response):
+    """Return the ``Retry-After`` of ``response`` in whole seconds."""
+    try:
+        return max(1, int(response.headers.get("Retry-After", DEFAULT_RETRY_AFTER)))
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+def jittered(seconds):
+    """Spread a wait uniformly over 50%-150% of ``seconds``."""
+    return seconds * random.uniform(0.5, 1.5)
+
+
+def with_retry(
+    send,
+    deadline,
+    *args,
+    attempts=RETRY_ATTEMPTS,
+    max_wait=MAX_RETRY_WAIT,
+    **kwargs,
+):
+    """
+    Call ``send(*args, **kwargs)`` within ``deadline``, retrying while busy.
+
+    Args:
+        send (callable): A ``requests`` function such as ``requests.post``.
+        deadline (Deadline): Budget shared by all attempts and waits.
+        attempts (int): Total calls to make at most.
+        max_wait (float): Longest single wait between calls, in seconds.
+
+    Returns:
+        requests.Response: The first response that is not a rejection, or the
+        last rejection once the attempts or the budget are used up.
+    """
+    response = send_within(send, deadline, *args, **kwargs)
+    for _ in range(attempts - 1):
+        if not is_busy(response):
+            break
+        wait = min(max_wait, jittered(retry_after(response)))
+        if wait >= deadline.remaining():
+            break
+        time.sleep(wait)
+        response = send_within(send, deadline, *args, **kwargs)
+    return response
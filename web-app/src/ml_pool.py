@@ -0,0 +1,401 @@
+"""
+Client-side load balancing over DeepFace replicas.
+
+``DEEPFACE_API_URLS`` may list several ``machine-learning-client`` instances.
+Each call goes to the less loaded of two randomly chosen healthy replicas,
+compared by requests in flight (power of two choices). Replicas are health
+checked passively: a replica that fails ``failure_threshold`` calls in a row
+gets no traffic for a while, and that period doubles each time it fails again.
+If every replica is ejected, the one due back soonest is used anyway.
+
+A call that refers to state held by one replica, such as an embedding staged
+during enrollment, can be pinned to that replica with ``sender(replica=...)``.
+It still goes elsewhere if that replica has left the pool. A call that changes
+state every replica holds, such as deleting a face from their in-memory
+galleries, is sent to all of them with ``broadcast``.
+
+Idempotent calls such as ``/faces/verify`` can be hedged. If the first replica
+has not answered within the recent p95 latency of that path, the same call is
+sent to a second replica and the first good answer is used. A busy or 5xx
+answer does not win; the other call is still waited for.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from src import metrics, ml_client
+
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+HEDGE_QUANTILE = 0.95
+MAX_EJECTION_DOUBLINGS = 5
+HEDGE_THREADS = 128
+
+
+def _quantile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _failed(response):
+    """Return whether ``response`` is a busy rejection or a server error."""
+    return response.status_code >= 500 or ml_client.is_busy(response)
+
+
+def _succeeded(call):
+    """Return whether a finished call returned a usable response."""
+    return call.exception() is None and not _failed(call.result())
+
+
+class Replica:  # pylint: disable=too-many-instance-attributes
+    """Load and health bookkeeping for one DeepFace endpoint."""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def ejected(self, now):
+        """Return whether the replica is out of rotation at ``now``."""
+        return now < self.ejected_until
+
+    def stats(self, now):
+        """Return the replica's counters as a JSON-serialisable dict."""
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejected": self.ejected(now),
+            "ejections": self.ejections,
+            "p95_ms": (
+                round(_quantile(self.latencies, 0.95) * 1000)
+                if self.latencies
+                else None
+            ),
+        }
+
+
+class ReplicaPool:  # pylint: disable=too-many-instance-attributes
+    """
+    Chooses DeepFace replicas and tracks their load and health.
+
+    Args:
+        urls (list): Base URLs of the replicas.
+        hedge (bool): Whether hedging is enabled for calls that ask for it.
+        failure_threshold (int): Consecutive failures before ejection.
+        ejection_seconds (float): First ejection period; later ones double.
+        rng (random.Random, optional): Source of randomness, for tests.
+        observe (callable, optional): Called with ``(path, seconds)`` after
+            each call made through ``sender`` or ``async_sender``, timed as
+            the caller waited for it (a hedged call counts once).
+    """
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        urls,
+        hedge=False,
+        failure_threshold=3,
+        ejection_seconds=10.0,
+        rng=None,
+        observe=None,
+    ):
+        if not urls:
+            raise ValueError("At least one DeepFace URL is required")
+        self.replicas = [Replica(url) for url in urls]
+        self.hedge = hedge
+        self.failure_threshold = failure_threshold
+        self.ejection_seconds = ejection_seconds
+        self.rng = rng or random.Random()
+        self.observe = observe
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._executor = None
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    # Choosing and bookkeeping
+
+    def choose(self, exclude=()):
+        """
+        Pick a replica by power of two choices on requests in flight.
+
+        Returns:
+            Replica: The chosen replica, or None if all are excluded.
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [r for r in self.replicas if r not in exclude]
+            if not candidates:
+                return None
+            healthy = [r for r in candidates if not r.ejected(now)]
+            if not healthy:
+                return min(candidates, key=lambda r: r.ejected_until)
+            if len(healthy) == 1:
+                return healthy[0]
+            first, second = self.rng.sample(healthy, 2)
+            return first if first.outstanding <= second.outstanding else second
+
+    def _begin(self, replica):
+        with self._lock:
+            replica.outstanding += 1
+            replica.requests += 1
+        return time.monotonic()
+
+    def _finish(self, replica, path, started, response=None):
+        """Record a call's outcome; ``response`` None means it raised."""
+        elapsed = time.monotonic() - started
+        failed = response is None or (
+            response.status_code >= 500 and not ml_client.is_busy(response)
+        )
+        with self._lock:
+            replica.outstanding -= 1
+            if failed:
+                replica.failures += 1
+                replica.consecutive_failures += 1
+                if replica.consecutive_failures >= self.failure_threshold:
+                    doublings = min(replica.ejections, MAX_EJECTION_DOUBLINGS)
+                    replica.ejected_until = time.monotonic() + (
+                        self.ejection_seconds * 2**doublings
+                    )
+                    replica.ejections += 1
+            elif not ml_client.is_busy(response):
+                replica.consecutive_failures = 0
+                replica.latencies.append(elapsed)
+                # Keyed like the metrics, so face ids do not each get a window
+                self._latencies.setdefault(
+                    metrics.deepface_operation(path), deque(maxlen=LATENCY_WINDOW)
+                ).append(elapsed)
+
+    def hedge_delay(self, path):
+        """Return the p95 of recent successful calls to ``path``, or None if too few."""
+        with self._lock:
+            latencies = self._latencies.get(metrics.deepface_operation(path), ())
+            if len(latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            return _quantile(latencies, HEDGE_QUANTILE)
+
+    # Synchronous calls (Flask)
+
+    def replica_url(self, url):
+        """Return the base URL of the replica that served ``url``, or None."""
+        if not isinstance(url, str):
+            return None
+        for replica in self.replicas:
+            if url.startswith(replica.url + "/"):
+                return replica.url
+        return None
+
+    def sender(self, send, hedge=False, replica=None):
+        """
+        Wrap a ``requests`` function so it is sent to a chosen replica.
+
+        The returned callable takes a path instead of a URL, so it can be
+        passed to ``ml_client.send_within`` and ``ml_client.with_retry``.
+
+        Args:
+            send (callable): The ``requests`` function to wrap.
+            hedge (bool): Hedge the call, if hedging is enabled.
+            replica (str, optional): Base URL of the replica to use when it
+                is in the pool.
+        """
+        pinned = next((r for r in self.replicas if r.url == replica), None)
+
+        def call(path, **kwargs):
+            started = time.perf_counter()
+            try:
+                if pinned is not None:
+                    return self._send(pinned, send, path, kwargs)
+                if hedge and self.hedge:
+                    return self._hedged(send, path, kwargs)
+                return self._send(self.choose(), send, path, kwargs)
+            finally:
+                self._observe(path, started)
+
+        return call
+
+    def broadcast(self, send):
+        """
+        Wrap a ``requests`` function so it is sent to every replica in turn.
+
+        Returns:
+            callable: Takes a path like ``sender``'s and returns the first
+            replica's response. A replica that fails is skipped; if none
+            answers, the last error is raised.
+        """
+
+        def call(path, **kwargs):
+            started = time.perf_counter()
+            responses, error = [], None
+            try:
+                for replica in self.replicas:
+                    try:
+                        responses.append(self._send(replica, send, path, kwargs))
+                    except OSError as e:  # requests' errors are OSErrors
+                        error = e
+            finally:
+                self._observe(path, started)
+            if not responses:
+                raise error
+            return responses[0]
+
+        return call
+
+    def _observe(self, path, started):
+        if self.observe is not None:
+            self.observe(path, time.perf_counter() - started)
+
+    def _send(self, replica, send, path, kwargs):
+        started = self._begin(replica)
+        response = None
+        try:
+            response = send(replica.url + path, **kwargs)
+            return response
+        finally:
+            self._finish(replica, path, started, response)
+
+    def _hedged(self, send, path, kwargs):
+        delay = self.hedge_delay(path)
+        first = self.choose()
+        if delay is None or len(self.replicas) < 2:
+            return self._send(first, send, path, kwargs)
+
+        executor = self._hedge_executor()
+        primary = executor.submit(self._send, first, send, path, kwargs)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeout:
+            pass
+        second = self.choose(exclude=(first,))
+        with self._lock:
+            self.hedges += 1
+        backup_kwargs = dict(kwargs)
+        if "timeout" in kwargs:
+            backup_kwargs["timeout"] = max(0.001, kwargs["timeout"] - delay)
+        backup = executor.submit(self._send, second, send, path, backup_kwargs)
+
+        # The slower call cannot be cancelled and finishes in the background
+        pending, finished = {primary, backup}, set()
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            finished |= done
+            winner = self._winner(finished, pending, backup)
+            if winner is not None:
+                return winner.result()
+
+    def _winner(self, finished, pending, backup):
+        """
+        Pick the finished call to answer with, or None to keep waiting.
+
+        A call that returned a usable response wins. Busy rejections, server
+        errors and exceptions are only used once nothing is left pending,
+        preferring a response over an exception.
+        """
+        succeeded = [call for call in finished if _succeeded(call)]
+        if succeeded:
+            if backup in succeeded:
+                with self._lock:
+                    self.hedge_wins += 1
+                return backup
+            return succeeded[0]
+        if not pending:
+            answered = [call for call in finished if call.exception() is None]
+            return (answered or list(finished))[0]
+        return None
+
+    def _hedge_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=HEDGE_THREADS, thread_name_prefix="ml-hedge"
+                )
+            return self._executor
+
+    # Asynchronous calls (asgi.py)
+
+    def async_sender(self, send, hedge=False):
+        """Like ``sender``, for an ``httpx.AsyncClient`` method."""
+
+        async def call(path, **kwargs):
+            started = time.perf_counter()
+            try:
+                if hedge and self.hedge:
+                    return await self._async_hedged(send, path, kwargs)
+                return await self._async_send(self.choose(), send, path, kwargs)
+            finally:
+                self._observe(path, started)
+
+        return call
+
+    async def _async_send(self, replica, send, path, kwargs):
+        started = self._begin(replica)
+        response = None
+        try:
+            response = await send(replica.url + path, **kwargs)
+            return response
+        finally:
+            self._finish(replica, path, started, response)
+
+    async def _async_hedged(self, send, path, kwargs):
+        delay = self.hedge_delay(path)
+        first = self.choose()
+        if delay is None or len(self.replicas) < 2:
+            return await self._async_send(first, send, path, kwargs)
+
+        primary = asyncio.ensure_future(self._async_send(first, send, path, kwargs))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        second = self.choose(exclude=(first,))
+        with self._lock:
+            self.hedges += 1
+        backup_kwargs = dict(kwargs)
+        if "timeout" in kwargs:
+            backup_kwargs["timeout"] = max(0.001, kwargs["timeout"] - delay)
+        backup = asyncio.ensure_future(
+            self._async_send(second, send, path, backup_kwargs)
+        )
+
+        pending, finished = {primary, backup}, set()
+        try:
+            while True:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                finished |= done
+                winner = self._winner(finished, pending, backup)
+                if winner is not None:
+                    return winner.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        """Return per-replica load and health plus hedging counters."""
+        now = time.monotonic()
+        with self._lock:
+            paths = list(self._latencies)
+        delays = {path: self.hedge_delay(path) for path in paths}
+        with self._lock:
+            return {
+                "replicas": [replica.stats(now) for replica in self.replicas],
+                "hedging": self.hedge,
+                "hedge_delay_ms": {
+                    path: round(delay * 1000)
+                    for path, delay in delays.items()
+                    if delay is not None
+                },
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+            }
@@ -0,0 +1,111 @@
+"""
+In-process cache of who has already signed in today.
+
+Most traffic at the gate is the same people tapping in more than once. The
+cache holds the face ids that signed in on the current local day so that a
+repeat sign-in is answered without a database round trip. It is rebuilt from a
+single query on the daily attendance key the first time it is used and
+whenever the local date rolls over, so it never holds more than one entry per
+enrolled identity. The query runs without holding the cache's lock, so other
+lookups are not held up behind it.
+"""
+
+import threading
+from contextlib import contextmanager
+
+
+class PresenceCache:
+    """Thread-safe per-day set of face ids that have signed in."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._date = None
+        self._present = set()
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+
+    def contains(self, local_date, face_id, loader):
+        """
+        Check whether ``face_id`` has already signed in on ``local_date``.
+
+        Args:
+            local_date (str): ISO date of the current attendance day.
+            face_id: Id of the recognised face.
+            loader (callable): Called with ``local_date`` when the cache must be
+                rebuilt; returns the face ids already signed in that day.
+
+        Returns:
+            bool: True on a cache hit (known repeat sign-in).
+        """
+        with self._current(local_date, loader):
+            if str(face_id) in self._present:
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def claim(self, local_date, face_id, loader):
+        """
+        Atomically check and record a sign-in for ``face_id``.
+
+        Used when sign-ins are acknowledged before they reach the database,
+        so two concurrent requests for the same person cannot both win.
+
+        Returns:
+            bool: True when this call recorded the first sign-in of the day.
+        """
+        with self._current(local_date, loader):
+            if str(face_id) in self._present:
+                self.hits += 1
+                return False
+            self.misses += 1
+            self._present.add(str(face_id))
+            return True
+
+    def add(self, local_date, face_id):
+        """Mark ``face_id`` as signed in on ``local_date``."""
+        with self._lock:
+            if self._date == local_date:
+                self._present.add(str(face_id))
+
+    def discard(self, face_id):
+        """Forget ``face_id``, e.g. after its face record was deleted."""
+        with self._lock:
+            self._present.discard(str(face_id))
+
+    def clear(self):
+        """Drop all state; the next lookup rebuilds from the database."""
+        with self._lock:
+            self._date = None
+            self._present = set()
+
+    def stats(self):
+        """Return cache size and hit rate as a JSON-serialisable dict."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "date": self._date,
+                "size": len(self._present),
+                "hits": self.hits,
+                "misses": self.misses,
+                "rebuilds": self.rebuilds,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    @contextmanager
+    def _current(self, local_date, loader):
+        """Hold the lock with ``local_date`` loaded, loading it unlocked first."""
+        while True:
+            with self._lock:
+                if self._date == local_date:
+                    yield
+                    return
+            present = {str(face) for face in loader(local_date)}
+            with self._lock:
+                # Another caller may have loaded the day meanwhile and already
+                # claimed ids in it; keep its set.
+                if self._date != local_date:
+                    self._present = present
+                    self._date = local_date
+                    self.rebuilds += 1
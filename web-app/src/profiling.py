@@ -0,0 +1,234 @@
+"""
+On-demand sampling profiler.
+
+An admin arms the profiler for the next N requests to one route, or for a time
+window. While a profile runs, a background thread samples the stacks of the
+profiled threads every ``interval`` seconds with ``sys._current_frames()``:
+the threads serving the chosen requests, or every thread in a window.
+Samples are counted two ways. Wall samples count every sample, so time spent
+waiting on DeepFace or MongoDB shows up. CPU samples count the CPU microseconds
+the thread used since the previous sample.
+
+When the profile ends, it is written to ``<directory>/<name>-<time>.wall.folded``
+and ``.cpu.folded`` in the collapsed-stack format (``frame;frame;frame count``)
+read by ``flamegraph.pl`` and https://www.speedscope.app.
+
+Disabled, the profiler has no sampling thread. The only per-request cost is
+reading its ``active`` flag.
+
+Each service is built from its own directory, so this module is a copy of
+``machine-learning-client/src/profiling.py``. Below this docstring the two are kept identical,
+which ``tests/test_profiling.py`` checks; change both together.
+"""
+
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+DEFAULT_INTERVAL = 0.01
+MAX_SECONDS = 600
+
+
+def _frame_name(code):
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+def folded_stack(frame):
+    """Return ``frame``'s stack, outermost first, as one collapsed-stack line."""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code).replace(";", ":"))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _thread_cpu(ident):
+    """Return the CPU seconds thread ``ident`` has used, or None if unknown."""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
+
+
+class _Session:  # pylint: disable=too-many-instance-attributes,too-few-public-methods
+    """One profile being collected."""
+
+    def __init__(self, name, routes, requests, seconds):
+        self.name = name
+        self.routes = routes
+        self.remaining = requests
+        self.deadline = time.monotonic() + min(seconds or MAX_SECONDS, MAX_SECONDS)
+        self.targets = set()
+        self.all_threads = requests is None
+        self.wall = Counter()
+        self.cpu = Counter()
+        self.cpu_seen = {}
+        self.samples = 0
+        self.done = threading.Event()
+
+    def finished(self):
+        """Return whether the profile has collected all it was asked for."""
+        if time.monotonic() >= self.deadline:
+            return True
+        return self.remaining is not None and self.remaining <= 0 and not self.targets
+
+
+class Profiler:
+    """
+    Collects one sampling profile at a time and writes it to ``directory``.
+
+    Args:
+        directory (str): Where profiles are written; created when needed.
+        interval (float): Seconds between samples.
+    """
+
+    def __init__(self, directory, interval=DEFAULT_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        # Read without the lock by the request hooks; True while profiling
+        self.active = False
+        self.written = []
+        self._lock = threading.Lock()
+        self._session = None
+        self._thread = None
+
+    def start(self, name, routes=None, requests=None, seconds=None):
+        """
+        Start a profile in the background.
+
+        Args:
+            name (str): Name of the output files.
+            routes (tuple, optional): Route patterns whose requests are
+                profiled; any route when None.
+            requests (int, optional): Profile this many matching requests.
+            seconds (float, optional): Profile every thread for this long, or
+                give up on ``requests`` after this long. At most
+                ``MAX_SECONDS``.
+
+        Raises:
+            ValueError: If neither ``requests`` nor ``seconds`` is positive, or
+                a profile is already running.
+        """
+        if not ((requests or 0) > 0 or (seconds or 0) > 0):
+            raise ValueError("Give a positive number of requests or seconds")
+        with self._lock:
+            if self._session is not None:
+                raise ValueError(f"Profile {self._session.name!r} is already running")
+            self._session = _Session(
+                name, tuple(routes) if routes else None, requests, seconds
+            )
+            self.active = True
+            self._thread = threading.Thread(
+                target=self._run, args=(self._session,), daemon=True
+            )
+            self._thread.start()
+
+    def enter(self, route):
+        """Profile the calling thread's request to ``route`` if one is wanted."""
+        with self._lock:
+            session = self._session
+            if (
+                session is None
+                or session.all_threads
+                or session.remaining <= 0
+                or (session.routes is not None and route not in session.routes)
+            ):
+                return
+            session.remaining -= 1
+            session.targets.add(threading.get_ident())
+
+    def exit(self):
+        """Stop profiling the calling thread's request."""
+        with self._lock:
+            if self._session is not None:
+                self._session.targets.discard(threading.get_ident())
+
+    @contextmanager
+    def block(self, name):
+        """Profile the calling thread for the duration of the ``with`` block."""
+        self.start(name, requests=1)
+        session, thread = self._session, self._thread
+        self.enter(None)
+        try:
+            yield
+        finally:
+            self.exit()
+            session.done.set()
+            thread.join()
+
+    def wait(self, timeout=None):
+        """Wait for the running profile, if any, to be written."""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def status(self):
+        """Return the running profile, if any, and the files written so far."""
+        with self._lock:
+            session = self._session
+            return {
+                "running": session.name if session else None,
+                "samples": session.samples if session else 0,
+                "remaining_requests": session.remaining if session else None,
+                "written": list(self.written),
+            }
+
+    # Sampling thread
+
+    def _run(self, session):
+        sampler = threading.get_ident()
+        while not session.done.wait(self.interval):
+            if not self._sample(session, sampler):
+                break
+        self._finish(session)
+
+    def _sample(self, session, sampler):
+        """Take one sample; return False once the profile is complete."""
+        frames = sys._current_frames()  # pylint: disable=protected-access
+        with self._lock:
+            if session.finished():
+                return False
+            if session.all_threads:
+                idents = [ident for ident in frames if ident != sampler]
+            else:
+                idents = list(session.targets)
+        for ident in idents:
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = folded_stack(frame)
+            session.wall[stack] += 1
+            used = _thread_cpu(ident)
+            if used is not None:
+                previous = session.cpu_seen.get(ident, used)
+                session.cpu_seen[ident] = used
+                if used > previous:
+                    session.cpu[stack] += round((used - previous) * 1e6)
+        session.samples += 1
+        return True
+
+    def _finish(self, session):
+        paths = self._write(session)
+        with self._lock:
+            self.written.extend(paths)
+            self._session = None
+            self.active = False
+
+    def _write(self, session):
+        os.makedirs(self.directory, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", session.name).strip("_") or "profile"
+        base = os.path.join(self.directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}")
+        paths = []
+        for kind, counts in (("wall", session.wall), ("cpu", session.cpu)):
+            path = f"{base}.{kind}.folded"
+            with open(path, "w", encoding="utf-8") as file:
+                for stack, count in counts.most_common():
+                    file.write(f"{stack} {count}\n")
+            paths.append(path)
+        return paths
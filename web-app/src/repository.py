@@ -0,0 +1,440 @@
+"""
+Data access layer for the SmartGate web app.
+
+Every MongoDB query issued by the web app goes through SmartGateRepository so
+that each one carries an explicit projection. Face documents also hold the
+``img_vectors`` embeddings written by the machine learning client; the web app
+never needs them, so they are never fetched, and the cost of a query does not
+grow with the embedding size.
+"""
+
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Tuple
+
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+FACE_PROJECTION = {"name": 1}
+ATTENDANCE_PROJECTION = {"face_id": 1, "timestamp": 1}
+DAILY_KEY_INDEX = "daily_attendance_key"
+DUPLICATE_KEY_ERROR = 11000
+EXPORT_BATCH_SIZE = 2000
+PARTITION_PATTERN = re.compile(r"^attendance_\d{4}_\d{2}$")
+
+
+def partition_name(month):
+    """Return the collection name of a ``YYYY-MM`` month's partition."""
+    return f"attendance_{month[:4]}_{month[5:7]}"
+
+
+def _partition_month(name):
+    return f"{name[11:15]}-{name[16:18]}"
+
+
+def months_between(start, end):
+    """Return the ``YYYY-MM`` months touched by ``start <= t < end``."""
+    last = (end - timedelta(microseconds=1)).date()
+    year, month = start.year, start.month
+    months = []
+    while (year, month) <= (last.year, last.month):
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def _create_attendance_indexes(collection):
+    """
+    Create the indexes every attendance collection needs.
+
+    The unique ``(local_date, face_id)`` index is the daily attendance key:
+    it makes a second sign-in on the same local day impossible even when two
+    requests race. Legacy records written before ``local_date`` existed are
+    excluded by the partial filter. The ``timestamp`` index serves date-range
+    reads such as the export.
+    """
+    collection.create_index([("timestamp", 1)])
+    collection.create_index(
+        [("local_date", 1), ("face_id", 1)],
+        name=DAILY_KEY_INDEX,
+        unique=True,
+        partialFilterExpression={"local_date": {"$exists": True}},
+    )
+
+
+@dataclass(frozen=True)
+class FaceRecord:
+    """Lightweight view of a face document without its embeddings."""
+
+    id: ObjectId
+    name: str
+
+    @classmethod
+    def from_doc(cls, doc):
+        """Build a record from a projected ``faces`` document."""
+        return cls(id=doc["_id"], name=doc.get("name", ""))
+
+
+@dataclass(frozen=True)
+class AttendanceRecord:
+    """Single sign-in entry from the ``attendance`` collection."""
+
+    id: ObjectId
+    face_id: ObjectId
+    timestamp: datetime
+
+    @classmethod
+    def from_doc(cls, doc):
+        """Build a record from a projected ``attendance`` document."""
+        return cls(id=doc["_id"], face_id=doc["face_id"], timestamp=doc["timestamp"])
+
+
+@dataclass(frozen=True)
+class SigninResult:
+    """Outcome of recording a daily sign-in."""
+
+    attendance_id: Optional[ObjectId]
+    first: bool
+
+
+class SmartGateRepository:
+    """
+    Owns the queries the web app runs against the ``smart_gate`` database.
+
+    Attendance is partitioned by local month into ``attendance_YYYY_MM``
+    collections. Records written before partitioning stay in the legacy
+    ``attendance`` collection and are still read. Months moved out of MongoDB
+    by the archive job are read back from ``archive``.
+
+    Args:
+        db: A pymongo ``Database`` (or anything exposing ``faces`` and
+            ``attendance`` collections with the same interface).
+        archive (AttendanceArchive, optional): Store of archived months.
+    """
+
+    def __init__(self, db, archive=None):
+        self.db = db
+        self.archive = archive
+        self._indexed_partitions = set()
+
+    # Faces
+
+    def list_faces(self) -> List[FaceRecord]:
+        """Return every enrolled face, without embeddings."""
+        return list(self.iter_faces())
+
+    def iter_faces(self) -> Iterator[FaceRecord]:
+        """Lazily iterate over enrolled faces, without embeddings."""
+        for doc in self.db.faces.find({}, FACE_PROJECTION):
+            yield FaceRecord.from_doc(doc)
+
+    def get_face(self, face_id) -> Optional[FaceRecord]:
+        """Fetch a single face by id, or ``None`` when it does not exist."""
+        doc = self.db.faces.find_one({"_id": ObjectId(face_id)}, FACE_PROJECTION)
+        return FaceRecord.from_doc(doc) if doc else None
+
+    def face_names(self):
+        """Return a ``{face_id: name}`` map of every enrolled face."""
+        return {str(face.id): face.name for face in self.iter_faces()}
+
+    def delete_face(self, face_id) -> bool:
+        """Delete a face record. Returns whether a document was removed."""
+        result = self.db.faces.delete_one({"_id": ObjectId(face_id)})
+        return bool(result.deleted_count)
+
+    # Attendance partitions
+
+    def partition(self, month: str):
+        """
+        Return the collection holding ``month``'s attendance (``YYYY-MM``).
+
+        The daily key index is created the first time this process writes to
+        or reads from a partition, so a brand new month is protected before its
+        first sign-in.
+        """
+        name = partition_name(month)
+        if name not in self._indexed_partitions:
+            _create_attendance_indexes(self.db[name])
+            self._indexed_partitions.add(name)
+        return self.db[name]
+
+    def live_months(self) -> List[str]:
+        """Return the months that still have a live partition, ascending."""
+        names = self.db.list_collection_names(
+            filter={"name": {"$regex": PARTITION_PATTERN.pattern}}
+        )
+        return sorted(_partition_month(name) for name in names)
+
+    def _sources(self, months=None):
+        """
+        Locate where each month's attendance lives.
+
+        Args:
+            months (iterable, optional): ``YYYY-MM`` months to look up, in the
+                order wanted. Defaults to every stored month, ascending.
+
+        Returns:
+            list: ``(month, "live" | "archive")`` pairs; months with no data
+            anywhere are left out.
+        """
+        live = set(self.live_months())
+        archived = set(self.archive.months()) if self.archive else set()
+        if months is None:
+            months = sorted(live | archived)
+        sources = []
+        for month in months:
+            if month in live:
+                sources.append((month, "live"))
+            elif month in archived:
+                sources.append((month, "archive"))
+        return sources
+
+    # Attendance queries
+
+    def list_attendance(self) -> List[AttendanceRecord]:
+        """Return the live attendance records, newest first.
+
+        Archived months are left out; use ``iter_attendance_between`` for
+        historical reports.
+        """
+        records = []
+        for month in reversed(self.live_months()):
+            cursor = (
+                self.db[partition_name(month)]
+                .find({}, ATTENDANCE_PROJECTION)
+                .sort("timestamp", -1)
+            )
+            records.extend(AttendanceRecord.from_doc(doc) for doc in cursor)
+        cursor = self.db.attendance.find({}, ATTENDANCE_PROJECTION).sort(
+            "timestamp", -1
+        )
+        records.extend(AttendanceRecord.from_doc(doc) for doc in cursor)
+        return records
+
+    def list_attendance_for(self, face_id) -> List[AttendanceRecord]:
+        """Return every attendance record of one person, newest first.
+
+        Includes archived months.
+        """
+        query = {"face_id": ObjectId(face_id)}
+        records = []
+        for month, source in reversed(self._sources()):
+            if source == "live":
+                cursor = (
+                    self.db[partition_name(month)]
+                    .find(query, ATTENDANCE_PROJECTION)
+                    .sort("timestamp", -1)
+                )
+                records.extend(AttendanceRecord.from_doc(doc) for doc in cursor)
+            else:
+                archived = self.archive.read(month, face_id=query["face_id"])
+                records.extend(
+                    sorted(
+                        map(AttendanceRecord.from_doc, archived),
+                        key=lambda record: record.timestamp,
+                        reverse=True,
+                    )
+                )
+        cursor = self.db.attendance.find(query, ATTENDANCE_PROJECTION).sort(
+            "timestamp", -1
+        )
+        records.extend(AttendanceRecord.from_doc(doc) for doc in cursor)
+        return records
+
+    def iter_attendance_between(
+        self, start: datetime, end: datetime, batch_size: int = EXPORT_BATCH_SIZE
+    ) -> Iterator[AttendanceRecord]:
+        """
+        Stream attendance records with ``start <= timestamp < end``.
+
+        Records come month by month, oldest month first; archived months are
+        read from their Parquet files. Live records are pulled from a
+        server-side cursor ``batch_size`` documents per round trip, so the
+        caller never holds more than one batch.
+        """
+        query = {"timestamp": {"$gte": start, "$lt": end}}
+        sources = [(None, "legacy")] + self._sources(months_between(start, end))
+        for month, source in sources:
+            if source == "archive":
+                docs = self.archive.read(month, start=start, end=end)
+            else:
+                collection = (
+                    self.db.attendance
+                    if source == "legacy"
+                    else self.db[partition_name(month)]
+                )
+                docs = (
+                    collection.find(query, ATTENDANCE_PROJECTION)
+                    .sort("timestamp", 1)
+                    .batch_size(batch_size)
+                )
+            for doc in docs:
+                yield AttendanceRecord.from_doc(doc)
+
+    def iter_daily_keys(self, timezone_name: str = "UTC"):
+        """
+        Yield each distinct ``(face_id, local_date)`` sign-in across all data.
+
+        Live partitions and the legacy collection are grouped server-side;
+        legacy records without ``local_date`` get it from their timestamp in
+        ``timezone_name``. Archived months are read from Parquet.
+        """
+        pipeline = [
+            {
+                "$group": {
+                    "_id": {
+                        "face_id": "$face_id",
+                        "day": {
+                            "$ifNull": [
+                                "$local_date",
+                                {
+                                    "$dateToString": {
+                                        "format": "%Y-%m-%d",
+                                        "date": "$timestamp",
+                                        "timezone": timezone_name,
+                                    }
+                                },
+                            ]
+                        },
+                    }
+                }
+            }
+        ]
+        sources = [(None, "legacy")] + self._sources()
+        for month, source in sources:
+            if source == "archive":
+                seen = set()
+                for doc in self.archive.read(month):
+                    key = (doc["face_id"], doc["local_date"])
+                    if key not in seen:
+                        seen.add(key)
+                        yield key
+                continue
+            collection = (
+                self.db.attendance
+                if source == "legacy"
+                else self.db[partition_name(month)]
+            )
+            for doc in collection.aggregate(pipeline, allowDiskUse=True):
+                yield doc["_id"]["face_id"], doc["_id"]["day"]
+
+    def face_ids_signed_in_on(self, local_date: str) -> List[ObjectId]:
+        """Return the ids of everyone who signed in on ``local_date``.
+
+        Served from the daily key index without touching the documents.
+        """
+        cursor = self.partition(local_date[:7]).find(
+            {"local_date": local_date}, {"_id": 0, "face_id": 1}
+        )
+        return [doc["face_id"] for doc in cursor]
+
+    # Attendance writes
+
+    def ensure_indexes(self):
+        """Create the indexes the web app relies on.
+
+        Covers the legacy ``attendance`` collection and the current partitions;
+        new partitions are indexed on first use by ``partition``.
+        """
+        _create_attendance_indexes(self.db.attendance)
+        for month in self.live_months():
+            self.partition(month)
+
+    def record_daily_signin(self, face_id, now: datetime) -> SigninResult:
+        """
+        Record today's sign-in for ``face_id`` in a single round trip.
+
+        Args:
+            face_id: Id of the recognised face.
+            now (datetime): Current time in the site timezone; its date is
+                the attendance day and selects the monthly partition.
+
+        Returns:
+            SigninResult: ``first`` is False when the person had already
+            signed in on that local day, in which case nothing is written.
+        """
+        local_date = now.date().isoformat()
+        try:
+            result = self.partition(local_date[:7]).update_one(
+                {"face_id": ObjectId(face_id), "local_date": local_date},
+                {"$setOnInsert": {"timestamp": now}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # A concurrent request inserted the same daily key first.
+            return SigninResult(attendance_id=None, first=False)
+        if result.upserted_id is None:
+            return SigninResult(attendance_id=None, first=False)
+        return SigninResult(attendance_id=result.upserted_id, first=True)
+
+    @staticmethod
+    def daily_signin_doc(face_id, now: datetime, attendance_id=None):
+        """Build the attendance document for a sign-in on ``now``'s local day."""
+        return {
+            "_id": attendance_id or ObjectId(),
+            "face_id": ObjectId(face_id),
+            "local_date": now.date().isoformat(),
+            "timestamp": now,
+        }
+
+    def insert_signins(self, docs):
+        """
+        Bulk insert sign-in documents built by ``daily_signin_doc``.
+
+        Documents are grouped by monthly partition, one ``insert_many`` each.
+        Documents that collide with an existing daily key (or ``_id``, when a
+        batch is replayed) are skipped, so the call is idempotent.
+
+        Returns:
+            list: The documents that were actually inserted.
+        """
+        by_month = {}
+        for doc in docs:
+            by_month.setdefault(doc["local_date"][:7], []).append(doc)
+        inserted = []
+        for month, batch in by_month.items():
+            try:
+                self.partition(month).insert_many(batch, ordered=False)
+                inserted.extend(batch)
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if any(err.get("code") != DUPLICATE_KEY_ERROR for err in errors):
+                    raise
+                skipped = {err["index"] for err in errors}
+                inserted.extend(doc for i, doc in enumerate(batch) if i not in skipped)
+        return inserted
+
+    # Archival
+
+    def archive_months_before(self, cutoff_month: str) -> List[Tuple[str, int]]:
+        """
+        Move every live partition older than ``cutoff_month`` to the archive.
+
+        Each partition is streamed to its Parquet file, the row count is
+        verified, and only then is the collection dropped. Re-running after a
+        crash simply rewrites the file.
+
+        Returns:
+            list: ``(month, rows archived)`` for each archived partition.
+        """
+        if self.archive is None:
+            raise RuntimeError("No attendance archive directory configured")
+        archived = []
+        for month in self.live_months():
+            if month >= cutoff_month:
+                continue
+            collection = self.db[partition_name(month)]
+            expected = collection.count_documents({})
+            docs = (
+                collection.find({}).sort("timestamp", 1).batch_size(EXPORT_BATCH_SIZE)
+            )
+            written = self.archive.write(month, docs)
+            if written != expected:
+                raise RuntimeError(
+                    f"Archived {written} of {expected} records for {month}"
+                )
+            collection.drop()
+            self._indexed_partitions.discard(partition_name(month))
+            archived.append((month, written))
+        return archived
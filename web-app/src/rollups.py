@@ -0,0 +1,178 @@
+"""
+Precomputed attendance rollups.
+
+Two aggregate collections are kept next to ``attendance``:
+
+* ``attendance_daily``: one document per local day with the headcount of
+  distinct people who signed in (``{"_id": "2025-04-01", "count": 42}``).
+* ``attendance_monthly``: one document per person and month with the number
+  of days they attended (``{"month": "2025-04", "face_id": ..., "count": 17}``).
+
+They are updated incrementally whenever a first sign-in of the day is written
+and can be rebuilt from the raw records (live partitions and archived months)
+at any time. Summary pages read only from the rollups.
+"""
+
+from pymongo import UpdateOne
+
+DAILY = "attendance_daily"
+MONTHLY = "attendance_monthly"
+
+
+def _month(local_date):
+    return local_date[:7]
+
+
+class AttendanceRollups:
+    """
+    Maintains and queries the daily and monthly attendance rollups.
+
+    Args:
+        db: The ``smart_gate`` pymongo database.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def ensure_indexes(self):
+        """Create the indexes used by upserts and per-person lookups."""
+        self.db[MONTHLY].create_index([("month", 1), ("face_id", 1)], unique=True)
+        self.db[MONTHLY].create_index([("face_id", 1), ("month", -1)])
+
+    # Incremental maintenance
+
+    def record(self, signins):
+        """
+        Count newly inserted first sign-ins of the day.
+
+        Args:
+            signins (iterable): ``(face_id, local_date)`` pairs. Each pair must
+                correspond to exactly one newly inserted attendance record.
+        """
+        daily, monthly = _count(signins)
+        if not daily:
+            return
+        self.db[DAILY].bulk_write(
+            [
+                UpdateOne({"_id": day}, {"$inc": {"count": count}}, upsert=True)
+                for day, count in daily.items()
+            ],
+            ordered=False,
+        )
+        self.db[MONTHLY].bulk_write(
+            [
+                UpdateOne(
+                    {"month": month, "face_id": face_id},
+                    {"$inc": {"count": count}},
+                    upsert=True,
+                )
+                for (month, face_id), count in monthly.items()
+            ],
+            ordered=False,
+        )
+
+    # Rebuild and consistency check
+
+    def rebuild(self, daily_keys):
+        """
+        Recompute both rollups from raw attendance.
+
+        Args:
+            daily_keys (iterable): Every distinct ``(face_id, local_date)``
+                sign-in, as produced by ``SmartGateRepository.iter_daily_keys``.
+
+        The new rollups are written to scratch collections and renamed over
+        the live ones, so readers never see a half-built rollup. Sign-ins
+        counted by ``record`` while the raw records are read are lost in the
+        rename, so run it while no sign-ins are being taken.
+        """
+        daily, monthly = _count(daily_keys)
+        self._replace(
+            DAILY, [{"_id": day, "count": count} for day, count in daily.items()]
+        )
+        self._replace(
+            MONTHLY,
+            [
+                {"month": month, "face_id": face_id, "count": count}
+                for (month, face_id), count in monthly.items()
+            ],
+        )
+        self.ensure_indexes()
+
+    def check(self, daily_keys):
+        """
+        Compare the rollups against raw attendance.
+
+        Args:
+            daily_keys (iterable): As for ``rebuild``.
+
+        Returns:
+            list: One dict per mismatch with the rollup ``kind``, its ``key``,
+            the ``expected`` count from raw data and the ``actual`` rollup
+            count. An empty list means the rollups are consistent.
+        """
+        daily, monthly = _count(daily_keys)
+        actual = {doc["_id"]: doc["count"] for doc in self.db[DAILY].find()}
+        mismatches = list(_diff("daily", daily, actual))
+
+        expected = {
+            (month, str(face_id)): count for (month, face_id), count in monthly.items()
+        }
+        actual = {
+            (doc["month"], str(doc["face_id"])): doc["count"]
+            for doc in self.db[MONTHLY].find({}, {"_id": 0})
+        }
+        mismatches.extend(_diff("monthly", expected, actual))
+        return mismatches
+
+    def _replace(self, name, docs):
+        scratch = self.db[f"{name}_rebuild"]
+        scratch.drop()
+        if docs:
+            scratch.insert_many(docs)
+            scratch.rename(name, dropTarget=True)
+        else:
+            self.db[name].delete_many({})
+
+    # Queries
+
+    def daily_headcounts(self, start_day, end_day):
+        """Return ``[(local_date, count)]`` for ``start_day..end_day``, inclusive."""
+        cursor = self.db[DAILY].find({"_id": {"$gte": start_day, "$lte": end_day}})
+        return [(doc["_id"], doc["count"]) for doc in cursor.sort("_id", 1)]
+
+    def monthly_counts(self, month):
+        """Return ``{face_id: days attended}`` for every person in ``month``."""
+        cursor = self.db[MONTHLY].find({"month": month}, {"_id": 0, "month": 0})
+        return {str(doc["face_id"]): doc["count"] for doc in cursor}
+
+    def monthly_for(self, face_id):
+        """Return ``[(month, days attended)]`` for one person, newest first."""
+        cursor = (
+            self.db[MONTHLY]
+            .find({"face_id": face_id}, {"_id": 0, "month": 1, "count": 1})
+            .sort("month", -1)
+        )
+        return [(doc["month"], doc["count"]) for doc in cursor]
+
+
+def _count(daily_keys):
+    """Fold ``(face_id, local_date)`` pairs into daily and monthly counts."""
+    daily = {}
+    monthly = {}
+    for face_id, local_date in daily_keys:
+        daily[local_date] = daily.get(local_date, 0) + 1
+        key = (_month(local_date), face_id)
+        monthly[key] = monthly.get(key, 0) + 1
+    return daily, monthly
+
+
+def _diff(kind, expected, actual):
+    for key in sorted(set(expected) | set(actual), key=str):
+        if expected.get(key, 0) != actual.get(key, 0):
+            yield {
+                "kind": kind,
+                "key": key if isinstance(key, str) else list(key),
+                "expected": expected.get(key, 0),
+                "actual": actual.get(key, 0),
+            }
@@ -0,0 +1,215 @@
+"""
+Request tracing across the web app and the DeepFace service.
+
+Each request gets a trace context in the W3C ``traceparent`` format. It is
+taken from the incoming header when a kiosk or proxy sent one, or started here
+otherwise. Every DeepFace call forwards it (see ``ml_client.send_within``), so
+the DeepFace service's spans join the same trace.
+
+Sampling is decided once, at the head of the trace: ``TRACE_SAMPLE_RATE``
+(default 0, tracing off) is the share of new traces that are recorded, and the
+decision travels with the ``traceparent`` flags. Spans of a sampled trace are
+appended as JSON lines to ``TRACE_FILE`` (default ``traces.jsonl``); the
+DeepFace service writes its own file, and the two can be joined on
+``trace_id``. Unsampled requests only pay for generating the ids.
+
+Spans cover the request itself, each DeepFace call, and each MongoDB command
+and template render timed for ``/metrics`` (see ``src.metrics``).
+"""
+
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+SERVICE = "web-app"
+TRACEPARENT = "traceparent"
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0"))
+
+TRACEPARENT_PATTERN = re.compile(
+    r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$"
+)
+
+
+@dataclass(frozen=True)
+class SpanContext:
+    """The ids and sampling decision that travel in ``traceparent``."""
+
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+    def traceparent(self):
+        """Return the context as a ``traceparent`` header value."""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def _new_id(nbytes):
+    return random.getrandbits(nbytes * 8).to_bytes(nbytes, "big").hex()
+
+
+def parse(header):
+    """Return the ``SpanContext`` of a ``traceparent`` value, or None if invalid."""
+    match = TRACEPARENT_PATTERN.match((header or "").strip().lower())
+    if match is None:
+        return None
+    version, trace_id, span_id, flags = match.groups()
+    if version == "ff" or trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return SpanContext(trace_id, span_id, bool(int(flags, 16) & 1))
+
+
+class FileExporter:
+    """
+    Appends finished spans to a JSON-lines file.
+
+    Args:
+        path (str): File to append to; opened on the first sampled span.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def export(self, fields):
+        """Write one span record."""
+        line = json.dumps(fields, default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                # pylint: disable-next=consider-using-with
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+
+    def flush(self):
+        """Flush written spans to the file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+
+exporter = FileExporter(TRACE_FILE)
+_current = ContextVar("trace_span", default=None)
+
+
+class Span:
+    """
+    One timed operation in a trace. Only sampled spans are exported.
+
+    Args:
+        name (str): Operation name, e.g. ``POST /process_signin``.
+        context (SpanContext): The span's own ids.
+        parent_id (str, optional): Span id of the parent.
+        attributes (dict, optional): Extra fields recorded with the span.
+    """
+
+    def __init__(self, name, context, parent_id=None, attributes=None):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.token = None
+
+    def headers(self):
+        """Return the headers that make a downstream call part of this span."""
+        return {TRACEPARENT: self.context.traceparent()}
+
+    def end(self, **attributes):
+        """Finish the span and export it if sampled."""
+        if self.context.sampled:
+            self.attributes.update(attributes)
+            _export(self, time.perf_counter() - self._started)
+
+    async def end_after(self, awaitable):
+        """Await ``awaitable``, then finish the span."""
+        try:
+            return await awaitable
+        finally:
+            self.end()
+
+
+def _export(span, seconds, start=None):
+    exporter.export(
+        {
+            "service": SERVICE,
+            "trace_id": span.context.trace_id,
+            "span_id": span.context.span_id,
+            "parent_id": span.parent_id,
+            "name": span.name,
+            "start": round(span.start if start is None else start, 6),
+            "duration_ms": round(seconds * 1000, 3),
+            "attributes": span.attributes,
+        }
+    )
+
+
+def _child_of(parent, name, attributes):
+    if parent is None:
+        context = SpanContext(
+            _new_id(16), _new_id(8), random.random() < TRACE_SAMPLE_RATE
+        )
+        return Span(name, context, None, attributes)
+    context = SpanContext(parent.context.trace_id, _new_id(8), parent.context.sampled)
+    return Span(name, context, parent.context.span_id, attributes)
+
+
+def enter(name, traceparent=None, **attributes):
+    """
+    Start the span of an incoming request and make it current.
+
+    Args:
+        name (str): Span name.
+        traceparent (str, optional): The request's ``traceparent`` header. A
+            valid one is continued with its sampling decision; otherwise a new
+            trace is started and head-sampled at ``TRACE_SAMPLE_RATE``.
+
+    Returns:
+        Span: Pass it to ``leave`` when the request is done.
+    """
+    remote = parse(traceparent)
+    if remote is None:
+        span = _child_of(None, name, attributes)
+    else:
+        context = SpanContext(remote.trace_id, _new_id(8), remote.sampled)
+        span = Span(name, context, remote.span_id, attributes)
+    span.token = _current.set(span)
+    return span
+
+
+def leave(span, **attributes):
+    """End a span started with ``enter`` and restore the previous one."""
+    _current.reset(span.token)
+    span.end(**attributes)
+    if span.context.sampled:
+        exporter.flush()
+
+
+def current():
+    """Return the current span, or None outside a traced request."""
+    return _current.get()
+
+
+def child(name, **attributes):
+    """
+    Start a span under the current one without making it current.
+
+    For calls to another service: forward ``span.headers()`` and call
+    ``span.end()`` when the reply arrives. Outside a request this starts a
+    new trace.
+    """
+    return _child_of(_current.get(), name, attributes)
+
+
+def record(name, seconds, **attributes):
+    """Record an operation that just took ``seconds`` under the current span."""
+    parent = _current.get()
+    if parent is not None and parent.context.sampled:
+        span = _child_of(parent, name, attributes)
+        _export(span, seconds, start=time.time() - seconds)
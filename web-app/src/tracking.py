@@ -0,0 +1,143 @@
+"""
+Face tracking across streamed kiosk frames.
+
+A streaming kiosk sends small frames several times a second. Each frame goes
+through the DeepFace service's cheap ``/faces/detect``, and ``FaceTracker``
+links the detected boxes to the faces seen in earlier frames by overlap. A
+track becomes ready for recognition once it has been seen in enough consecutive
+good frames: large enough and sharp enough. A ready track is settled straight
+away, so each person in front of the kiosk costs one recognition, however long
+they stay in view. A track that leaves the frame is forgotten, so the person
+is recognised again when they come back.
+"""
+
+import itertools
+from dataclasses import dataclass, field
+
+
+def overlap(first, second):
+    """Return the intersection over union of two ``x, y, w, h`` boxes."""
+    left = max(first["x"], second["x"])
+    top = max(first["y"], second["y"])
+    right = min(first["x"] + first["w"], second["x"] + second["w"])
+    bottom = min(first["y"] + first["h"], second["y"] + second["h"])
+    intersection = max(0, right - left) * max(0, bottom - top)
+    union = first["w"] * first["h"] + second["w"] * second["h"] - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+@dataclass
+class Track:
+    """One face followed across frames."""
+
+    track_id: int
+    box: dict = field(default_factory=dict)
+    good_frames: int = 0
+    missed: int = 0
+    settled: bool = False
+
+
+class FaceTracker:
+    """
+    Tracks faces between frames of one kiosk stream. Not thread-safe.
+
+    Args:
+        stable_frames (int): Consecutive good frames before a track is ready.
+        min_size (int): Smallest face width and height in pixels that counts
+            as a good frame.
+        min_sharpness (float): Lowest sharpness score that counts as a good
+            frame; blurred crops score low.
+        min_overlap (float): Intersection over union needed to continue a
+            track in the next frame.
+        max_missed (int): Frames a track survives without a detection.
+    """
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        stable_frames=3,
+        min_size=60,
+        min_sharpness=20.0,
+        min_overlap=0.3,
+        max_missed=5,
+    ):
+        self.stable_frames = stable_frames
+        self.min_size = min_size
+        self.min_sharpness = min_sharpness
+        self.min_overlap = min_overlap
+        self.max_missed = max_missed
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def _good(self, detection):
+        box = detection["box"]
+        return (
+            min(box["w"], box["h"]) >= self.min_size
+            and detection.get("sharpness", 0) >= self.min_sharpness
+        )
+
+    def update(self, detections):
+        """
+        Fold one frame's detections into the tracks.
+
+        Args:
+            detections (list): ``/faces/detect`` results with ``box`` and
+                ``sharpness``.
+
+        Returns:
+            list: The tracks that became ready in this frame. They are
+            settled; call ``reopen`` if recognising them failed.
+        """
+        unmatched = list(self.tracks)
+        seen = []
+        for detection in detections:
+            score, best = max(
+                ((overlap(track.box, detection["box"]), track) for track in unmatched),
+                key=lambda pair: pair[0],
+                default=(0.0, None),
+            )
+            if best is None or score < self.min_overlap:
+                best = Track(next(self._ids))
+            else:
+                unmatched.remove(best)
+            best.box = detection["box"]
+            best.missed = 0
+            best.good_frames = best.good_frames + 1 if self._good(detection) else 0
+            seen.append(best)
+
+        for track in unmatched:
+            track.missed += 1
+        self.tracks = seen + [
+            track for track in unmatched if track.missed <= self.max_missed
+        ]
+
+        ready = [
+            track
+            for track in seen
+            if not track.settled and track.good_frames >= self.stable_frames
+        ]
+        for track in ready:
+            track.settled = True
+        return ready
+
+    def settle(self, boxes):
+        """Settle every visible track overlapping one of ``boxes``."""
+        for track in self.tracks:
+            if track.missed == 0 and any(
+                overlap(track.box, box) >= self.min_overlap for box in boxes
+            ):
+                track.settled = True
+
+    def reopen(self, tracks):
+        """Make ``tracks`` eligible again after their recognition failed."""
+        for track in tracks:
+            track.settled = False
+            track.good_frames = 0
+
+    def visible(self):
+        """Return the tracks in the latest frame as JSON-ready dicts."""
+        return [
+            {"track": track.track_id, "box": track.box, "settled": track.settled}
+            for track in self.tracks
+            if track.missed == 0
+        ]
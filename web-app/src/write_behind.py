@@ -0,0 +1,277 @@
+"""
+Write-behind buffer for attendance inserts.
+
+At shift change hundreds of sign-ins arrive within minutes. With write-behind
+enabled a sign-in is acknowledged as soon as it has been appended to a local,
+fsync'd log; a background thread then writes queued sign-ins to MongoDB with
+one ``insert_many`` per batch, triggered by batch size or elapsed time.
+
+Crash safety: before each flush the active log is rotated into a numbered
+segment. Segments are only deleted after their documents were inserted, and
+on startup every remaining segment is replayed. Replaying a document twice is
+harmless because inserts are idempotent on ``_id`` and the daily key.
+
+The reply to a queued sign-in says whether it was the first of the day before
+MongoDB has seen it, using the process's ``PresenceCache``. Each worker process
+has its own cache, so write-behind needs a single worker: with several, two
+workers can both answer "first" for the same person.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(doc):
+    return json.dumps(
+        {
+            "_id": str(doc["_id"]),
+            "face_id": str(doc["face_id"]),
+            "local_date": doc["local_date"],
+            "timestamp": doc["timestamp"].isoformat(),
+        }
+    )
+
+
+def _decode(line):
+    data = json.loads(line)
+    return {
+        "_id": ObjectId(data["_id"]),
+        "face_id": ObjectId(data["face_id"]),
+        "local_date": data["local_date"],
+        "timestamp": datetime.fromisoformat(data["timestamp"]),
+    }
+
+
+class AttendanceWriteBehind:  # pylint: disable=too-many-instance-attributes
+    """
+    Durable in-process queue that batches attendance inserts.
+
+    Args:
+        log_path (str): Path of the append-only log. Rotated segments are
+            written next to it as ``<log_path>.<n>``.
+        repository_factory (callable): Returns the SmartGateRepository used by
+            the flusher thread, which cannot use the request-scoped one.
+        max_batch (int): Flush as soon as this many sign-ins are queued.
+        max_delay (float): Flush queued sign-ins at least this often (seconds).
+        on_flush (callable, optional): Called as ``on_flush(repository, docs)``
+            with the documents each flush actually inserted.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        log_path,
+        repository_factory,
+        max_batch=100,
+        max_delay=1.0,
+        on_flush=None,
+    ):
+        self.log_path = log_path
+        self.repository_factory = repository_factory
+        self.on_flush = on_flush
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._repository = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending = []
+        self._flushing = []
+        self._segments = []
+        self._next_segment = 0
+        self._log = None
+        self._thread = None
+        self._stopped = False
+        self.flushed = 0
+        self.flush_count = 0
+        self.flush_failures = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def start(self):
+        """Replay segments left by a previous run and start the flusher."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.log_path)), exist_ok=True)
+        with self._lock:
+            self._replay()
+            self._log = open(  # pylint: disable=consider-using-with
+                self.log_path, "a", encoding="utf-8"
+            )
+        self._thread = threading.Thread(
+            target=self._run, name="attendance-write-behind", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Flush what is queued and stop the flusher thread."""
+        with self._lock:
+            self._stopped = True
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def enqueue(self, doc):
+        """
+        Durably queue an attendance document.
+
+        Returns only after the document has been fsync'd to the local log, so
+        an acknowledged sign-in survives a crash before the next flush. Raises
+        RuntimeError before ``start`` or after ``stop``.
+        """
+        line = _encode(doc) + "\n"
+        with self._lock:
+            if self._log is None:
+                raise RuntimeError("attendance write-behind is not running")
+            self._log.write(line)
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._pending.append(doc)
+            if len(self._pending) >= self.max_batch:
+                self._wakeup.notify()
+        return doc["_id"]
+
+    def pending_face_ids(self, local_date):
+        """Return face ids queued or being flushed for ``local_date``."""
+        with self._lock:
+            return [
+                doc["face_id"]
+                for doc in self._flushing + self._pending
+                if doc["local_date"] == local_date
+            ]
+
+    def flush(self):
+        """Write every queued document to MongoDB in one batch."""
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            batch = self._pending
+            if not batch:
+                return
+            self._pending = []
+            self._flushing = batch
+            self._rotate()
+            segments = list(self._segments)
+
+        start = time.perf_counter()
+        try:
+            if self._repository is None:
+                self._repository = self.repository_factory()
+            inserted = self._repository.insert_signins(batch)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception(
+                "Failed to insert %d queued sign-ins; they stay queued", len(batch)
+            )
+            with self._lock:
+                self._pending = batch + self._pending
+                self._flushing = []
+                self.flush_failures += 1
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            self._flushing = []
+            for path in segments:
+                os.remove(path)
+                self._segments.remove(path)
+            self.flushed += len(batch)
+            self.flush_count += 1
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self._total_flush_ms += elapsed_ms
+
+        if self.on_flush is not None and inserted:
+            self.on_flush(self._repository, inserted)
+
+    def stats(self):
+        """Return queue depth and flush latency as a JSON-serialisable dict."""
+        with self._lock:
+            return {
+                "queue_depth": len(self._pending),
+                "segments": len(self._segments),
+                "flushed": self.flushed,
+                "flush_count": self.flush_count,
+                "flush_failures": self.flush_failures,
+                "last_flush_ms": self.last_flush_ms,
+                "max_flush_ms": self.max_flush_ms,
+                "avg_flush_ms": (
+                    self._total_flush_ms / self.flush_count if self.flush_count else 0.0
+                ),
+            }
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if len(self._pending) < self.max_batch and not self._stopped:
+                    self._wakeup.wait(self.max_delay)
+                if self._stopped:
+                    return
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=broad-exception-caught
+                # Losing the flusher would silently stop storing sign-ins
+                logger.exception("Attendance write-behind flush failed")
+                with self._lock:
+                    if not self._stopped:
+                        self._wakeup.wait(self.max_delay)
+
+    def _rotate(self):
+        """Move the active log aside so new appends go to a fresh file."""
+        segment = f"{self.log_path}.{self._next_segment}"
+        self._next_segment += 1
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        if os.path.exists(self.log_path):
+            os.replace(self.log_path, segment)
+            self._segments.append(segment)
+        if not self._stopped:
+            self._log = open(  # pylint: disable=consider-using-with
+                self.log_path, "a", encoding="utf-8"
+            )
+
+    def _replay(self):
+        """Load queued documents from the log and segments of a previous run."""
+        directory = os.path.dirname(os.path.abspath(self.log_path))
+        prefix = os.path.basename(self.log_path) + "."
+        numbered = []
+        for name in os.listdir(directory):
+            suffix = name[len(prefix) :]
+            if name.startswith(prefix) and suffix.isdigit():
+                numbered.append((int(suffix), os.path.join(directory, name)))
+        paths = [path for _, path in sorted(numbered)]
+        self._next_segment = max((n for n, _ in numbered), default=-1) + 1
+        if os.path.exists(self.log_path):
+            paths.append(self.log_path)
+
+        for path in paths:
+            with open(path, "r+b") as log:
+                data = log.read()
+                if data and not data.endswith(b"\n"):
+                    # Torn final write from a crash; it was never acknowledged.
+                    # Cut it off so the next append starts on a line of its own.
+                    data = data[: data.rfind(b"\n") + 1]
+                    log.truncate(len(data))
+            for line in data.decode("utf-8", errors="replace").splitlines():
+                try:
+                    self._pending.append(_decode(line))
+                except (KeyError, ValueError):
+                    logger.warning(
+                        "Skipping unreadable write-behind record in %s", path
+                    )
+        self._segments = [path for path in paths if path != self.log_path]
+        if self._pending:
+            self._wakeup.notify()
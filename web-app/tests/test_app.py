@@ -1,11 +1,15 @@
-# pylint: disable=redefined-outer-name
+# pylint: disable=redefined-outer-name,too-many-lines
 """Unit tests for Flask web application routes and logic."""
+import json
 from unittest.mock import patch, MagicMock
 from datetime import datetime
 from bson import ObjectId
 import requests
+from pymongo.errors import PyMongoError
 import pytest
-from app import app as flask_app
+import app as flask_app_module
+from app import app as flask_app, live_feed, presence_cache
+from src import tracing
 
 
 @pytest.fixture(name="client_fixture")
@@ -13,6 +17,7 @@ def client():
     """Create and configure a new test client for the app."""
     flask_app.config["TESTING"] = True
     flask_app.secret_key = "test"
+    presence_cache.clear()
     with flask_app.test_client() as client:
         with flask_app.app_context():
             yield client
@@ -71,10 +76,9 @@ def test_process_signin_success(mock_get_db, mock_post, client_fixture):
         "match": {"_id": valid_face_id, "name": "Alice"},
     }
 
-    # Mock find_one to return None (user hasn't signed in today)
+    # Upsert inserts a new daily record (user hasn't signed in today)
     mock_db = MagicMock()
-    mock_db.attendance.find_one.return_value = None
-    mock_db.attendance.insert_one.return_value.inserted_id = ObjectId()
+    mock_db.__getitem__.return_value.update_one.return_value.upserted_id = ObjectId()
     mock_get_db.return_value = mock_db
 
     response = client_fixture.post("/process_signin", data={"image": "dummy_base64"})
@@ -111,13 +115,9 @@ def test_process_signin_already_signed_in(mock_get_db, mock_post, client_fixture
         "match": {"_id": valid_face_id, "name": "Alice"},
     }
 
-    # Mock find_one to return an existing record (user already signed in today)
+    # Upsert matches an existing daily record (user already signed in today)
     mock_db = MagicMock()
-    mock_db.attendance.find_one.return_value = {
-        "_id": ObjectId(),
-        "face_id": ObjectId(valid_face_id),
-        "timestamp": datetime.now(),
-    }
+    mock_db.__getitem__.return_value.update_one.return_value.upserted_id = None
     mock_get_db.return_value = mock_db
 
     response = client_fixture.post("/process_signin", data={"image": "dummy_base64"})
@@ -129,6 +129,186 @@ def test_process_signin_already_signed_in(mock_get_db, mock_post, client_fixture
     assert "already_signed_in=True" in response.json["redirect"]
 
 
+@patch("app.requests.post")
+@patch("app.get_db")
+def test_process_signin_updates_rollups(mock_get_db, mock_post, client_fixture):
+    """Test a first sign-in of the day increments the rollups."""
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.json.return_value = {
+        "success": True,
+        "verified": True,
+        "match": {"_id": str(ObjectId()), "name": "Alice"},
+    }
+    mock_db = MagicMock()
+    mock_db.__getitem__.return_value.find.return_value = []
+    mock_db.__getitem__.return_value.update_one.return_value.upserted_id = ObjectId()
+    mock_get_db.return_value = mock_db
+
+    response = client_fixture.post("/process_signin", data={"image": "img"})
+
+    assert response.json["success"] is True
+    assert mock_db.__getitem__.return_value.bulk_write.call_count == 2
+
+
+@patch("app.requests.post")
+@patch("app.get_db")
+def test_process_signin_repeat_served_from_cache(
+    mock_get_db, mock_post, client_fixture
+):
+    """Test a repeat sign-in on the same day skips the database write."""
+    valid_face_id = str(ObjectId())
+
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.json.return_value = {
+        "success": True,
+        "verified": True,
+        "match": {"_id": valid_face_id, "name": "Alice"},
+    }
+
+    mock_db = MagicMock()
+    mock_db.__getitem__.return_value.find.return_value = []
+    mock_db.__getitem__.return_value.update_one.return_value.upserted_id = ObjectId()
+    mock_get_db.return_value = mock_db
+
+    first = client_fixture.post("/process_signin", data={"image": "dummy_base64"})
+    repeat = client_fixture.post("/process_signin", data={"image": "dummy_base64"})
+
+    assert first.json["success"] is True
+    assert repeat.json["already_signed_in"] is True
+    partition = mock_db.__getitem__.return_value
+    assert partition.update_one.call_count == 1
+    assert partition.find.call_count == 1
+
+
+@patch("app.requests.post")
+@patch("app.get_db")
+def test_process_signin_write_behind(mock_get_db, mock_post, client_fixture):
+    """Test sign-ins are queued, and deduplicated, when write-behind is on."""
+    valid_face_id = str(ObjectId())
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.json.return_value = {
+        "success": True,
+        "verified": True,
+        "match": {"_id": valid_face_id, "name": "Alice"},
+    }
+    mock_db = MagicMock()
+    mock_db.__getitem__.return_value.find.return_value = []
+    mock_get_db.return_value = mock_db
+    buffer = MagicMock()
+    buffer.pending_face_ids.return_value = []
+    buffer.enqueue.side_effect = lambda doc: doc["_id"]
+
+    with patch("app.write_behind", buffer):
+        first = client_fixture.post("/process_signin", data={"image": "img"})
+        repeat = client_fixture.post("/process_signin", data={"image": "img"})
+
+    assert first.json["success"] is True
+    assert repeat.json["already_signed_in"] is True
+    assert buffer.enqueue.call_count == 1
+    mock_db.__getitem__.return_value.update_one.assert_not_called()
+
+
+@patch("app.requests.delete")
+@patch("app.get_db")
+def test_delete_face_invalidates_presence_cache(
+    mock_get_db, mock_delete, client_fixture
+):
+    """Test deleting a face removes it from today's presence cache."""
+    mock_get_db.return_value = MagicMock()
+    mock_delete.return_value.status_code = 200
+    face_id = str(ObjectId())
+    presence_cache.contains("2025-04-01", face_id, lambda _: [face_id])
+
+    with client_fixture.session_transaction() as sess:
+        sess["admin"] = True
+    client_fixture.post(f"/admin/delete/{face_id}")
+
+    assert presence_cache.stats()["size"] == 0
+
+
+@patch("app.get_db")
+def test_admin_export_streams_csv(mock_get_db, client_fixture):
+    """Test the export endpoint streams CSV joined with face names."""
+    face_id = ObjectId()
+    mock_db = MagicMock()
+    mock_db.faces.find.return_value = [{"_id": face_id, "name": "Alice"}]
+    cursor = mock_db.attendance.find.return_value.sort.return_value.batch_size
+    cursor.return_value = [
+        {"_id": ObjectId(), "face_id": face_id, "timestamp": datetime(2025, 4, 1, 9)}
+    ]
+    mock_get_db.return_value = mock_db
+
+    with client_fixture.session_transaction() as sess:
+        sess["admin"] = True
+
+    response = client_fixture.get(
+        "/admin/export?start=2025-04-01&end=2025-04-30&format=csv"
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    assert "attendance_20250401_20250430.csv" in response.headers["Content-Disposition"]
+    assert b"Alice" in response.data
+    query = mock_db.attendance.find.call_args[0][0]
+    assert query["timestamp"]["$lt"].day == 1 and query["timestamp"]["$lt"].month == 5
+
+
+@patch("app.get_db")
+def test_admin_summary_reads_rollups(mock_get_db, client_fixture):
+    """Test the summary page renders headcounts and per-person counts."""
+    face_id = ObjectId()
+    mock_db = MagicMock()
+    mock_db.faces.find.return_value = [{"_id": face_id, "name": "Alice"}]
+    rollup = mock_db.__getitem__.return_value
+    rollup.find.return_value.sort.return_value = [{"_id": "2025-04-01", "count": 7}]
+    mock_get_db.return_value = mock_db
+
+    with client_fixture.session_transaction() as sess:
+        sess["admin"] = True
+
+    response = client_fixture.get("/admin/summary?month=2025-04")
+    assert response.status_code == 200
+    assert b"2025-04-01" in response.data
+    assert b"Alice" in response.data
+    query = rollup.find.call_args_list[0][0][0]
+    assert query == {"_id": {"$gte": "2025-04-01", "$lte": "2025-04-30"}}
+
+
+@patch("app.get_db")
+def test_rollups_check_command(mock_get_db):
+    """Test the rollups check command exits non-zero on mismatch."""
+    mock_db = MagicMock()
+    mock_db.list_collection_names.return_value = []
+    mock_db.attendance.aggregate.return_value = [
+        {"_id": {"face_id": ObjectId(), "day": "2025-04-01"}}
+    ]
+    mock_db.__getitem__.return_value.find.return_value = []
+    mock_get_db.return_value = mock_db
+
+    result = flask_app.test_cli_runner().invoke(args=["rollups", "check"])
+
+    assert result.exit_code == 1
+    assert "expected 1, found 0" in result.output
+
+
+def test_admin_export_rejects_bad_input(client_fixture):
+    """Test the export endpoint validates the format and date range."""
+    with client_fixture.session_transaction() as sess:
+        sess["admin"] = True
+
+    assert client_fixture.get("/admin/export?format=xml").status_code == 400
+    assert client_fixture.get("/admin/export?start=2025-04-01").status_code == 400
+
+
+def test_admin_stats_reports_cache(client_fixture):
+    """Test admin stats endpoint exposes the presence cache hit rate."""
+    with client_fixture.session_transaction() as sess:
+        sess["admin"] = True
+
+    response = client_fixture.get("/admin/stats")
+    assert response.status_code == 200
+    assert "hit_rate" in response.json["presence_cache"]
+
+
 def test_logout_clears_session(client_fixture):
     """Test that logout clears admin session."""
     with client_fixture.session_transaction() as sess:
@@ -158,16 +338,13 @@ def test_admin_delete_page_loads(mock_get_db, client_fixture):
     assert b"Alice" in response.data or b"Bob" in response.data
 
 
+@patch("app.requests.delete")
 @patch("app.get_db")
-def test_delete_face_success(mock_get_db, client_fixture):
-    """Test successful deletion of a face record."""
-    mock_faces = MagicMock()
-    mock_faces.delete_one.return_value.deleted_count = 1
-    mock_attendance = MagicMock()
+def test_delete_face_success(mock_get_db, mock_delete, client_fixture):
+    """Test a face is deleted through the DeepFace service, which evicts it."""
     mock_db = MagicMock()
-    mock_db.faces = mock_faces
-    mock_db.attendance = mock_attendance
     mock_get_db.return_value = mock_db
+    mock_delete.return_value.status_code = 200
 
     # Set admin session
     with client_fixture.session_transaction() as sess:
@@ -180,7 +357,25 @@ def test_delete_face_success(mock_get_db, client_fixture):
 
     assert response.status_code == 200
     assert b"Delete Face Records" in response.data
-    mock_faces.delete_one.assert_called_once_with({"_id": ObjectId(fake_face_id)})
+    assert mock_delete.call_args.args[0].endswith(f"/faces/{fake_face_id}")
+    mock_db.faces.delete_one.assert_not_called()
+
+
+@patch("app.requests.delete")
+@patch("app.get_db")
+def test_delete_face_falls_back_to_mongo(mock_get_db, mock_delete, client_fixture):
+    """Test the stored face is still deleted when DeepFace cannot be reached."""
+    mock_db = MagicMock()
+    mock_get_db.return_value = mock_db
+    mock_delete.side_effect = requests.ConnectionError("refused")
+
+    with client_fixture.session_transaction() as sess:
+        sess["admin"] = True
+
+    fake_face_id = str(ObjectId())
+    client_fixture.post(f"/admin/delete/{fake_face_id}")
+
+    mock_db.faces.delete_one.assert_called_once_with({"_id": ObjectId(fake_face_id)})
 
 
 def test_admin_dashboard_unauthorized(client_fixture):
@@ -541,3 +736,413 @@ def test_admin_delete_unauthorized(
     response = client_fixture.post(f"/admin/delete/{face_id}")
     assert response.status_code == 302
     assert "/admin/login" in response.headers["Location"]
+
+
+@patch("app.requests.post")
+@patch("app.get_db")
+def test_process_signin_publishes_live_event(mock_get_db, mock_post, client_fixture):
+    """Test a first sign-in is pushed to live feed subscribers."""
+    face_id = str(ObjectId())
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.json.return_value = {
+        "success": True,
+        "verified": True,
+        "match": {"_id": face_id, "name": "Alice"},
+    }
+    mock_db = MagicMock()
+    mock_db.__getitem__.return_value.find.return_value = []
+    mock_db.__getitem__.return_value.update_one.return_value.upserted_id = ObjectId()
+    mock_get_db.return_value = mock_db
+
+    with live_feed.subscribe() as subscriber:
+        client_fixture.post(
+            "/process_signin", data={"image": "dummy_base64", "gate": "north"}
+        )
+        _, event = subscriber.get_nowait()
+
+        # A repeat sign-in is not published again
+        client_fixture.post("/process_signin", data={"image": "dummy_base64"})
+        assert subscriber.empty()
+
+    assert event["face_id"] == face_id
+    assert event["name"] == "Alice"
+    assert event["gate"] == "north"
+
+
+def test_admin_live_requires_admin(client_fixture):
+    """Test the live feed is only streamed to admins."""
+    response = client_fixture.get("/admin/live")
+    assert response.status_code == 302
+
+    with client_fixture.session_transaction() as sess:
+        sess["admin"] = True
+    response = client_fixture.get("/admin/live")
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    response.close()
+
+
+@patch("app.requests.post")
+def test_process_signin_busy_passes_retry_after(mock_post, client_fixture):
+    """Test an overloaded DeepFace service is reported back for a client retry."""
+    mock_post.return_value.status_code = 503
+    mock_post.return_value.headers = {"Retry-After": "3"}
+
+    response = client_fixture.post("/process_signin", data={"image": "dummy_base64"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+    assert response.json["busy"] is True
+    assert mock_post.call_count == 1
+
+
+@patch.dict("app.GATE_SITES", {"north-door": "north"})
+@patch("app.requests.post")
+def test_process_signin_scopes_verify_to_gate_site(mock_post, client_fixture):
+    """Test a gate's configured site is sent with the verify call."""
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.json.return_value = {"success": True, "verified": False}
+
+    client_fixture.post(
+        "/process_signin",
+        data={"image": "dummy_base64", "gate": "north-door", "site": "south"},
+    )
+    assert mock_post.call_args.kwargs["json"] == {
+        "img": "dummy_base64",
+        "site": "north",
+    }
+
+    client_fixture.post(
+        "/process_signin", data={"image": "dummy_base64", "site": "south"}
+    )
+    assert mock_post.call_args.kwargs["json"]["site"] == "south"
+
+
+@patch("app.requests.post")
+def test_admin_add_user_sends_sites(mock_post, client_fixture):
+    """Test the sites field tags the new face."""
+    with client_fixture.session_transaction() as sess:
+        sess["admin"] = True
+    mock_post.side_effect = [
+        MagicMock(status_code=200, json=lambda: {"success": True, "verified": False}),
+        MagicMock(status_code=200, json=lambda: {"success": True}),
+    ]
+
+    client_fixture.post(
+        "/admin/add",
+        data={
+            "action": "add",
+            "name": "New User",
+            "image_data": "base64data",
+            "sites": "north, lab ,",
+        },
+    )
+
+    verify_call, add_call = mock_post.call_args_list
+    assert "sites" not in verify_call.kwargs["json"]
+    assert add_call.kwargs["json"]["sites"] == ["north", "lab"]
+
+
+@patch("app.requests.post")
+@patch("app.get_db")
+def test_process_signin_reports_server_timing(mock_get_db, mock_post, client_fixture):
+    """Test a two-hop sign-in breaks its latency down by component."""
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.headers = {"Server-Timing": "verify;dur=40.0"}
+    mock_post.return_value.json.return_value = {
+        "success": True,
+        "verified": True,
+        "match": {"_id": str(ObjectId()), "name": "Alice"},
+    }
+    mock_db = MagicMock()
+    mock_db.__getitem__.return_value.update_one.return_value.upserted_id = None
+    mock_get_db.return_value = mock_db
+
+    response = client_fixture.post("/process_signin", data={"image": "dummy_base64"})
+
+    names = [
+        part.split(";")[0] for part in response.headers["Server-Timing"].split(", ")
+    ]
+    assert names == ["deepface", "ml-verify", "record"]
+
+
+@patch("app.SIGNIN_ML_PATH", "/signins")
+@patch("app.SIGNIN_SINGLE_HOP", True)
+@patch("app.requests.post")
+@patch("app.get_db")
+def test_process_signin_single_hop(mock_get_db, mock_post, client_fixture):
+    """Test a single-hop sign-in uses the service's record and skips MongoDB."""
+    face_id = str(ObjectId())
+    attendance_id = str(ObjectId())
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.json.return_value = {
+        "success": True,
+        "verified": True,
+        "match": {"_id": face_id, "name": "Alice"},
+        "first": True,
+        "attendance_id": attendance_id,
+    }
+
+    response = client_fixture.post("/process_signin", data={"image": "dummy_base64"})
+
+    assert mock_post.call_args.args[0].endswith("/signins")
+    mock_get_db.assert_not_called()
+    assert response.json["success"] is True
+    assert attendance_id in response.json["redirect"]
+    assert "record;" not in response.headers["Server-Timing"]
+
+    mock_post.return_value.json.return_value["first"] = False
+    response = client_fixture.post("/process_signin", data={"image": "dummy_base64"})
+    assert response.json["already_signed_in"] is True
+
+
+@patch("app.requests.post")
+def test_admin_add_user_reuses_staged_embedding(mock_post, client_fixture):
+    """Test the add call sends the verify step's token instead of the image."""
+    with client_fixture.session_transaction() as sess:
+        sess["admin"] = True
+    mock_post.side_effect = [
+        MagicMock(
+            status_code=200,
+            url="http://localhost:5005/faces/verify",
+            json=lambda: {"success": True, "verified": False, "token": "tok"},
+        ),
+        MagicMock(status_code=200, json=lambda: {"success": True}),
+    ]
+
+    client_fixture.post(
+        "/admin/add",
+        data={"action": "add", "name": "New User", "image_data": "base64data"},
+    )
+
+    verify_call, add_call = mock_post.call_args_list
+    assert verify_call.kwargs["json"] == {"img": "base64data", "stage": True}
+    assert add_call.kwargs["json"] == {"token": "tok", "name": "New User"}
+
+
+@patch("app.requests.put")
+@patch("app.requests.post")
+def test_admin_confirm_uses_staged_token(mock_post, mock_put, client_fixture):
+    """Test the confirmation page carries the token, not the image."""
+    with client_fixture.session_transaction() as sess:
+        sess["admin"] = True
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.url = "http://localhost:5005/faces/verify"
+    mock_post.return_value.json.return_value = {
+        "success": True,
+        "verified": True,
+        "match": {"_id": "abc", "name": "Existing User"},
+        "token": "tok",
+    }
+
+    page = client_fixture.post(
+        "/admin/add",
+        data={"action": "add", "name": "New User", "image_data": "base64data"},
+    )
+    assert b'name="face_token" value="tok"' in page.data
+    assert b"base64data" not in page.data
+
+    mock_put.return_value.status_code = 200
+    mock_put.return_value.json.return_value = {"success": False, "message": "x"}
+    client_fixture.post(
+        "/admin/add",
+        data={
+            "action": "confirm",
+            "name": "New User",
+            "face_token": "tok",
+            "face_replica": "http://localhost:5005",
+            "existing_face_id": "abc",
+        },
+    )
+    assert mock_put.call_args.args[0] == "http://localhost:5005/faces/abc"
+    assert mock_put.call_args.kwargs["json"] == {"token": "tok", "name": "New User"}
+
+
+@patch("app.requests.post")
+@patch("app.get_db")
+def test_process_signin_group_records_everyone(mock_get_db, mock_post, client_fixture):
+    """Test a group capture signs in every recognised face in one bulk insert."""
+    alice, bob = str(ObjectId()), str(ObjectId())
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.json.return_value = {
+        "success": True,
+        "faces": [
+            {
+                "box": {"x": 0, "y": 0, "w": 90, "h": 90},
+                "verified": True,
+                "match": {"_id": alice, "name": "Alice"},
+            },
+            {
+                "box": {"x": 100, "y": 0, "w": 80, "h": 80},
+                "verified": True,
+                "match": {"_id": bob, "name": "Bob"},
+            },
+            {"box": {"x": 200, "y": 0, "w": 60, "h": 60}, "verified": False},
+        ],
+    }
+    mock_db = MagicMock()
+    mock_db.__getitem__.return_value.find.return_value = []
+    mock_get_db.return_value = mock_db
+
+    response = client_fixture.post(
+        "/process_signin", data={"image": "img", "site": "north", "group": "1"}
+    )
+
+    assert mock_post.call_args.args[0].endswith("/faces/identify")
+    assert mock_post.call_args.kwargs["json"] == {
+        "img": "img",
+        "site": "north",
+        "record": False,
+    }
+    partition = mock_db.__getitem__.return_value
+    partition.insert_many.assert_called_once()
+    assert len(partition.insert_many.call_args.args[0]) == 2
+    assert response.json["group"] is True
+    assert response.json["success"] is True
+    assert [face.get("first") for face in response.json["faces"]] == [
+        True,
+        True,
+        None,
+    ]
+    assert response.json["faces"][2]["box"]["x"] == 200
+    assert "Signed in: Alice, Bob" in response.json["message"]
+    assert "1 face(s) not recognized" in response.json["message"]
+
+    repeat = client_fixture.post("/process_signin", data={"image": "img", "group": "1"})
+    partition.insert_many.assert_called_once()
+    assert "Already signed in today: Alice, Bob" in repeat.json["message"]
+
+
+@patch("app.SIGNIN_SINGLE_HOP", True)
+@patch("app.requests.post")
+@patch("app.get_db")
+def test_process_signin_group_single_hop(mock_get_db, mock_post, client_fixture):
+    """Test a single-hop group capture is recorded by the DeepFace service."""
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.json.return_value = {
+        "success": True,
+        "faces": [
+            {
+                "box": {"x": 0, "y": 0, "w": 90, "h": 90},
+                "verified": True,
+                "match": {"_id": str(ObjectId()), "name": "Alice"},
+                "first": False,
+                "attendance_id": None,
+            }
+        ],
+    }
+
+    response = client_fixture.post(
+        "/process_signin", data={"image": "img", "group": "1"}
+    )
+
+    assert mock_post.call_args.kwargs["json"]["record"] is True
+    mock_get_db.assert_not_called()
+    assert response.json["faces"][0]["first"] is False
+    assert "record;" not in response.headers.get("Server-Timing", "")
+
+
+@patch("app.CAPTURE", {**flask_app_module.CAPTURE, "width": 320, "quality": 0.5})
+@patch("app.requests.post")
+def test_capture_settings_reach_kiosk_and_uploads_are_counted(
+    mock_post, client_fixture
+):
+    """Test the kiosk gets the capture settings and upload sizes are reported."""
+    page = client_fixture.get("/signin").data.decode()
+    assert 'width="320"' in page
+    assert '"quality": 0.5' in page
+
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.json.return_value = {"success": True, "verified": False}
+    before = flask_app_module.signin_uploads.stats()["uploads"]
+    client_fixture.post(
+        "/process_signin", data={"image": "data:image/jpeg;base64,QUJD"}
+    )
+    with client_fixture.session_transaction() as sess:
+        sess["admin"] = True
+    uploads = client_fixture.get("/admin/stats").json["signin_uploads"]
+    assert uploads["uploads"] == before + 1
+
+
+@patch("app.requests.post")
+@patch("app.get_db")
+def test_metrics_break_down_route_latency(mock_get_db, mock_post, client_fixture):
+    """Routes are timed by pattern, with DeepFace and Jinja time under them."""
+    user_id = ObjectId()
+    mock_db = MagicMock()
+    mock_db.faces.find_one.return_value = {"_id": user_id, "name": "Test User"}
+    mock_db.attendance.find.return_value.sort.return_value = []
+    mock_get_db.return_value = mock_db
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.json.return_value = {"success": True, "verified": False}
+
+    client_fixture.get(f"/attendance/{user_id}")
+    client_fixture.post("/process_signin", data={"image": "dummy_base64"})
+    response = client_fixture.get("/metrics")
+
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    text = response.data.decode()
+    assert str(user_id) not in text
+    assert (
+        'webapp_request_seconds{endpoint="/attendance/<user_id>",method="GET",'
+        'status="200",quantile="0.99"}'
+    ) in text
+    assert (
+        'webapp_dependency_seconds_count{endpoint="/attendance/<user_id>",'
+        'dependency="jinja",operation="attendance.html"}'
+    ) in text
+    assert (
+        'webapp_dependency_seconds_count{endpoint="/process_signin",'
+        'dependency="deepface",operation="/faces/verify"}'
+    ) in text
+
+
+@patch("app.requests.post")
+def test_signin_trace_reaches_deepface(mock_post, client_fixture, tmp_path):
+    """A sampled sign-in forwards its trace and records its spans."""
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.json.return_value = {"success": True, "verified": False}
+    exporter = tracing.FileExporter(str(tmp_path / "traces.jsonl"))
+
+    with patch.object(tracing, "exporter", exporter), patch.object(
+        tracing, "TRACE_SAMPLE_RATE", 1.0
+    ):
+        response = client_fixture.post(
+            "/process_signin", data={"image": "dummy_base64"}
+        )
+
+    trace_id = response.headers["X-Trace-Id"]
+    forwarded = mock_post.call_args.kwargs["headers"][tracing.TRACEPARENT]
+    assert forwarded.startswith(f"00-{trace_id}-") and forwarded.endswith("-01")
+    with open(exporter.path, encoding="utf-8") as file:
+        names = [json.loads(line)["name"] for line in file]
+    assert names == ["deepface", "POST /process_signin"]
+
+
+def test_admin_profile_profiles_next_request(client_fixture, tmp_path):
+    """An admin can profile the next request to a route."""
+    assert client_fixture.get("/admin/profile").status_code == 302
+    with client_fixture.session_transaction() as sess:
+        sess["admin"] = True
+
+    with patch.object(flask_app_module.profiler, "directory", str(tmp_path)):
+        response = client_fixture.post(
+            "/admin/profile", json={"route": "/signin", "requests": 1}
+        )
+        assert response.json["running"] == "/signin"
+        client_fixture.get("/signin")
+        flask_app_module.profiler.wait()
+
+    written = flask_app_module.profiler.status()["written"]
+    assert [path.rsplit(".", 2)[-2] for path in written[-2:]] == ["wall", "cpu"]
+    assert client_fixture.post("/admin/profile", json={}).status_code == 400
+
+
+def test_rollup_failure_after_write_behind_flush_is_logged():
+    """Test a rollup write error in the flush callback does not propagate."""
+    repository = MagicMock()
+    repository.db.__getitem__.return_value.bulk_write.side_effect = PyMongoError("blip")
+    with patch.object(flask_app.logger, "warning") as warning:
+        flask_app_module._rollup_flushed(  # pylint: disable=protected-access
+            repository, [{"face_id": ObjectId(), "local_date": "2025-04-01"}]
+        )
+    warning.assert_called_once()
@@ -0,0 +1,97 @@
+"""Unit tests for the Parquet attendance archive."""
+
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+import pytest
+from bson import ObjectId
+from src.archive import AttendanceArchive
+from src.repository import SmartGateRepository
+
+pytest.importorskip("pyarrow")
+
+
+def _doc(face_id, day, hour=9):
+    return {
+        "_id": ObjectId(),
+        "face_id": face_id,
+        "local_date": f"2025-03-{day:02d}",
+        "timestamp": datetime(2025, 3, day, hour),
+    }
+
+
+def test_archive_round_trip_with_filters(tmp_path):
+    """Archived documents read back with the same ids, names and times."""
+    alice, bob = ObjectId(), ObjectId()
+    docs = [_doc(alice, 1), _doc(bob, 1), _doc(alice, 2)]
+    archive = AttendanceArchive(str(tmp_path))
+
+    assert archive.write("2025-03", iter(docs)) == 3
+    assert archive.months() == ["2025-03"]
+
+    assert list(archive.read("2025-03")) == docs
+    assert [d["_id"] for d in archive.read("2025-03", face_id=alice)] == [
+        docs[0]["_id"],
+        docs[2]["_id"],
+    ]
+    window = archive.read(
+        "2025-03",
+        start=datetime(2025, 3, 2, tzinfo=timezone.utc),
+        end=datetime(2025, 3, 3, tzinfo=timezone.utc),
+    )
+    assert [d["_id"] for d in window] == [docs[2]["_id"]]
+
+
+def test_archive_job_moves_old_partitions(tmp_path):
+    """Partitions before the cutoff are written to Parquet then dropped."""
+    docs = [_doc(ObjectId(), 1), _doc(ObjectId(), 2)]
+    db = MagicMock()
+    db.list_collection_names.return_value = ["attendance_2025_03", "attendance_2025_04"]
+    old = MagicMock()
+    old.count_documents.return_value = 2
+    old.find.return_value.sort.return_value.batch_size.return_value = docs
+    db.__getitem__.side_effect = lambda name: (
+        old if name.endswith("03") else MagicMock()
+    )
+    archive = AttendanceArchive(str(tmp_path))
+
+    archived = SmartGateRepository(db, archive=archive).archive_months_before("2025-04")
+
+    assert archived == [("2025-03", 2)]
+    old.drop.assert_called_once()
+    assert archive.has("2025-03")
+
+
+def test_archive_job_keeps_partition_on_count_mismatch(tmp_path):
+    """A short write aborts before the live partition is dropped."""
+    db = MagicMock()
+    db.list_collection_names.return_value = ["attendance_2025_03"]
+    old = db.__getitem__.return_value
+    old.count_documents.return_value = 5
+    old.find.return_value.sort.return_value.batch_size.return_value = [
+        _doc(ObjectId(), 1)
+    ]
+
+    with pytest.raises(RuntimeError):
+        SmartGateRepository(
+            db, archive=AttendanceArchive(str(tmp_path))
+        ).archive_months_before("2025-04")
+    old.drop.assert_not_called()
+
+
+def test_export_reads_archived_months_transparently(tmp_path):
+    """Date-range reads fall back to the archive for archived months."""
+    face_id = ObjectId()
+    archive = AttendanceArchive(str(tmp_path))
+    archive.write("2025-03", [_doc(face_id, 1), _doc(face_id, 20)])
+    db = MagicMock()
+    db.list_collection_names.return_value = []
+    db.attendance.find.return_value.sort.return_value.batch_size.return_value = []
+
+    records = list(
+        SmartGateRepository(db, archive=archive).iter_attendance_between(
+            datetime(2025, 3, 10, tzinfo=timezone.utc),
+            datetime(2025, 4, 1, tzinfo=timezone.utc),
+        )
+    )
+
+    assert [record.timestamp for record in records] == [datetime(2025, 3, 20, 9)]
@@ -0,0 +1,278 @@
+"""Tests for the ASGI entry point and its async sign-in path."""
+
+import asyncio
+import json
+from unittest.mock import MagicMock
+from bson import ObjectId
+import pytest
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("asgiref")
+
+# pylint: disable=wrong-import-position
+from app import app as flask_app, live_feed, presence_cache
+from asgi import SigninApplication
+from src import metrics
+from src.ml_pool import ReplicaPool
+
+
+def _application(ml_handler, upserted_id=None):
+    flask_app.config["TESTING"] = True
+    flask_app.config["INDEXES_READY"] = True
+    presence_cache.clear()
+    database = MagicMock()
+    database.__getitem__.return_value.find.return_value = []
+    database.__getitem__.return_value.update_one.return_value.upserted_id = upserted_id
+    application = SigninApplication(
+        flask_app,
+        ReplicaPool(["http://ml"], observe=metrics.observe_deepface),
+        database=database,
+    )
+    application.client = httpx.AsyncClient(transport=httpx.MockTransport(ml_handler))
+    return application
+
+
+def _request(application, method, path, data=None, headers=None):
+    async def run():
+        transport = httpx.ASGITransport(app=application)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://testserver"
+        ) as client:
+            return await client.request(method, path, data=data, headers=headers)
+
+    return asyncio.run(run())
+
+
+def test_async_signin_records_first_signin():
+    """The verify call is awaited and the result recorded through Flask."""
+    face_id = str(ObjectId())
+    seen = []
+
+    def ml_handler(ml_request):
+        seen.append(ml_request)
+        return httpx.Response(
+            200,
+            json={
+                "success": True,
+                "verified": True,
+                "match": {"_id": face_id, "name": "Alice"},
+            },
+        )
+
+    application = _application(ml_handler, upserted_id=ObjectId())
+    response = _request(
+        application, "POST", "/process_signin", {"image": "dummy_base64"}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["success"] is True
+    assert f"/signin/success/{face_id}" in response.json()["redirect"]
+    assert str(seen[0].url) == "http://ml/faces/verify"
+
+
+def test_async_signin_without_image_is_rejected():
+    """A missing image is answered by the Flask view without calling DeepFace."""
+    ml_handler = MagicMock()
+    application = _application(ml_handler)
+    response = _request(application, "POST", "/process_signin", {})
+
+    assert response.status_code == 400
+    assert response.json()["message"] == "No image provided"
+    ml_handler.assert_not_called()
+
+
+def test_async_signin_reports_connection_errors():
+    """DeepFace connection failures produce the usual error message."""
+
+    def ml_handler(ml_request):
+        raise httpx.ConnectError("refused", request=ml_request)
+
+    application = _application(ml_handler)
+    response = _request(
+        application, "POST", "/process_signin", {"image": "dummy_base64"}
+    )
+
+    assert response.json()["success"] is False
+    assert "Error connecting to DeepFace service" in response.json()["message"]
+
+
+def test_other_routes_are_served_by_flask():
+    """Requests other than sign-ins go through the WSGI adapter."""
+    response = _request(_application(MagicMock()), "GET", "/")
+    assert response.status_code == 302
+    assert "/signin" in response.headers["location"]
+
+
+def _admin_cookie():
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    name = flask_app.config["SESSION_COOKIE_NAME"]
+    return f"{name}={serializer.dumps({'admin': True})}".encode("latin1")
+
+
+def test_live_feed_does_not_block_other_routes():
+    """Plain requests are answered while a dashboard's event stream is open."""
+    application = _application(MagicMock())
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/admin/live",
+        "http_version": "1.1",
+        "query_string": b"",
+        "headers": [(b"cookie", _admin_cookie())],
+    }
+
+    async def run():
+        sent = asyncio.Queue()
+        closed = asyncio.Event()
+        messages = [{"type": "http.request", "body": b""}]
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await closed.wait()
+            return {"type": "http.disconnect"}
+
+        viewer = asyncio.ensure_future(application(scope, receive, sent.put))
+        start = await asyncio.wait_for(sent.get(), 5)
+        await asyncio.wait_for(sent.get(), 5)
+        transport = httpx.ASGITransport(app=application)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://testserver"
+        ) as client:
+            response = await asyncio.wait_for(client.get("/"), 5)
+        live_feed.publish({"name": "Alice"})
+        event = await asyncio.wait_for(sent.get(), 5)
+        closed.set()
+        await asyncio.wait_for(viewer, 5)
+        return start, response, event
+
+    start, response, event = asyncio.run(run())
+    assert start["status"] == 200
+    assert response.status_code == 302
+    assert b'"name": "Alice"' in event["body"]
+    assert live_feed.stats()["viewers"] == 0
+
+
+def test_live_feed_requires_admin():
+    """Without an admin session the stream redirects to the login page."""
+    response = _request(_application(MagicMock()), "GET", "/admin/live")
+    assert response.status_code == 302
+    assert "/admin/login" in response.headers["location"]
+
+
+def test_async_signin_forwards_remaining_budget():
+    """The kiosk's budget is passed on to DeepFace as the deadline header."""
+    seen = []
+
+    def ml_handler(ml_request):
+        seen.append(ml_request)
+        return httpx.Response(200, json={"success": True, "verified": False})
+
+    response = _request(
+        _application(ml_handler),
+        "POST",
+        "/process_signin",
+        {"image": "dummy_base64"},
+        headers={"X-Deadline-Ms": "5000"},
+    )
+    assert response.json()["message"] == "Face not recognized"
+    assert 0 < int(seen[0].headers["X-Deadline-Ms"]) <= 5000
+
+
+def test_async_signin_is_timed_under_its_route():
+    """The native sign-in path records its latency and its DeepFace wait."""
+
+    def ml_handler(_):
+        return httpx.Response(200, json={"success": True, "verified": False})
+
+    deepface = ("/process_signin", "deepface", "/faces/verify")
+    route = ("/process_signin", "POST", "200")
+    before = (
+        metrics.DEPENDENCY_SECONDS.count(*deepface),
+        metrics.REQUEST_SECONDS.count(*route),
+    )
+    _request(_application(ml_handler), "POST", "/process_signin", {"image": "x"})
+
+    assert metrics.DEPENDENCY_SECONDS.count(*deepface) == before[0] + 1
+    assert metrics.REQUEST_SECONDS.count(*route) == before[1] + 1
+
+
+def _stream(application, frames, query=b""):
+    """Send ``frames`` over a WebSocket to ``application``; return the replies."""
+    incoming = [{"type": "websocket.connect"}]
+    incoming += [{"type": "websocket.receive", "text": frame} for frame in frames]
+    incoming.append({"type": "websocket.disconnect", "code": 1000})
+    sent = []
+
+    async def receive():
+        return incoming.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "websocket", "path": "/signin/stream", "query_string": query}
+    asyncio.run(application(scope, receive, send))
+    assert sent[0]["type"] == "websocket.accept"
+    return [json.loads(message["text"]) for message in sent[1:]]
+
+
+def test_stream_recognises_a_steady_face_once():
+    """Frames are only detected until the face is steady, then recognised once."""
+    face_id = str(ObjectId())
+    box = {"x": 100, "y": 50, "w": 120, "h": 120}
+    calls = []
+
+    def ml_handler(ml_request):
+        calls.append(ml_request.url.path)
+        if ml_request.url.path == "/faces/detect":
+            return httpx.Response(
+                200,
+                json={
+                    "success": True,
+                    "faces": [{"box": box, "confidence": 0.9, "sharpness": 80.0}],
+                },
+            )
+        assert json.loads(ml_request.content)["site"] == "north"
+        return httpx.Response(
+            200,
+            json={
+                "success": True,
+                "faces": [
+                    {
+                        "box": box,
+                        "verified": True,
+                        "match": {"_id": face_id, "name": "Alice"},
+                    }
+                ],
+            },
+        )
+
+    frame = json.dumps({"image": "data:image/jpeg;base64,xyz"})
+    replies = _stream(_application(ml_handler), [frame] * 6, b"site=north")
+
+    assert calls.count("/faces/identify") == 1
+    assert calls.count("/faces/detect") == 6
+    assert [reply["type"] for reply in replies] == [
+        "tracking",
+        "tracking",
+        "signin",
+        "tracking",
+        "tracking",
+        "tracking",
+    ]
+    assert replies[2]["result"]["faces"][0]["name"] == "Alice"
+    assert replies[2]["result"]["faces"][0]["first"] is True
+    assert replies[-1]["recognitions"] == 1
+
+
+def test_stream_skips_busy_frames_and_rejects_garbage():
+    """A busy detector drops the frame; malformed messages get an error."""
+
+    def ml_handler(_):
+        return httpx.Response(503, headers={"Retry-After": "1"})
+
+    replies = _stream(
+        _application(ml_handler), [json.dumps({"image": "x"}), "not json"]
+    )
+    assert replies[0]["skipped"] is True
+    assert replies[1]["type"] == "error"
@@ -0,0 +1,26 @@
+"""Unit tests for uploaded image accounting."""
+
+import base64
+from src.capture import UploadStats, jpeg_bytes
+
+
+def _data_url(size):
+    return "data:image/jpeg;base64," + base64.b64encode(b"x" * size).decode()
+
+
+def test_jpeg_bytes_decodes_payload_size():
+    """The decoded size accounts for base64 padding."""
+    for size in (0, 1, 2, 3, 1000, 1001):
+        assert jpeg_bytes(_data_url(size)) == size
+
+
+def test_upload_stats_report_means():
+    """Stats report the mean upload, as sent and as JPEG."""
+    stats = UploadStats()
+    assert stats.stats()["mean_bytes"] == 0
+    stats.observe(_data_url(3000))
+    stats.observe(_data_url(1000))
+    report = stats.stats()
+    assert report["uploads"] == 2
+    assert report["mean_jpeg_bytes"] == 2000
+    assert report["max_bytes"] == len(_data_url(3000))
@@ -0,0 +1,45 @@
+"""Unit tests for the streaming attendance export helpers."""
+
+import gzip
+import json
+from datetime import datetime
+from bson import ObjectId
+from src import export
+from src.repository import AttendanceRecord
+
+FACE_ID = ObjectId()
+RECORDS = [
+    AttendanceRecord(id=ObjectId(), face_id=FACE_ID, timestamp=datetime(2025, 4, 1, 9))
+    for _ in range(3)
+]
+NAMES = {str(FACE_ID): "Alice, Jr."}
+
+
+def test_csv_lines_quotes_and_includes_header():
+    """CSV output has a header row and quotes names containing commas."""
+    text = "".join(export.csv_lines(iter(RECORDS), NAMES))
+    lines = text.splitlines()
+    assert lines[0] == ",".join(export.EXPORT_FIELDS)
+    assert len(lines) == 4
+    assert '"Alice, Jr."' in lines[1]
+
+
+def test_ndjson_lines():
+    """NDJSON output has one JSON document per record."""
+    docs = [json.loads(line) for line in export.ndjson_lines(RECORDS, NAMES)]
+    assert [doc["attendance_id"] for doc in docs] == [str(r.id) for r in RECORDS]
+    assert docs[0]["name"] == "Alice, Jr."
+    assert docs[0]["timestamp"] == "2025-04-01T09:00:00"
+
+
+def test_chunked_groups_lines():
+    """Lines are grouped into chunks of at least the requested size."""
+    chunks = list(export.chunked(["ab\n"] * 10, size=8))
+    assert b"".join(chunks) == b"ab\n" * 10
+    assert all(len(chunk) >= 8 for chunk in chunks[:-1])
+
+
+def test_gzipped_round_trip():
+    """The gzip stream decompresses back to the original bytes."""
+    data = list(export.chunked(export.ndjson_lines(RECORDS, NAMES), size=16))
+    assert gzip.decompress(b"".join(export.gzipped(data))) == b"".join(data)
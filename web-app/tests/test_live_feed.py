@@ -0,0 +1,46 @@
+"""Unit tests for the live sign-in feed."""
+
+import json
+from src.live_feed import LiveFeed
+
+
+def test_publish_fans_out_to_every_subscriber():
+    """Each viewer receives every event, tagged with an increasing id."""
+    feed = LiveFeed()
+    with feed.subscribe() as first, feed.subscribe() as second:
+        feed.publish({"name": "Alice"})
+        feed.publish({"name": "Bob"})
+        assert [first.get_nowait() for _ in range(2)] == [
+            (1, {"name": "Alice"}),
+            (2, {"name": "Bob"}),
+        ]
+        assert second.qsize() == 2
+        assert feed.stats()["viewers"] == 2
+    assert feed.stats()["viewers"] == 0
+
+
+def test_slow_subscriber_drops_events_without_blocking():
+    """A full viewer queue loses events instead of stalling the publisher."""
+    feed = LiveFeed(max_pending=1)
+    with feed.subscribe() as subscriber:
+        feed.publish({"name": "Alice"})
+        feed.publish({"name": "Bob"})
+        assert subscriber.qsize() == 1
+    assert feed.stats() == {"viewers": 0, "published": 2, "dropped": 1}
+
+
+def test_stream_formats_events_and_heartbeats():
+    """The stream emits SSE frames, keepalives, and unsubscribes on close."""
+    feed = LiveFeed()
+    stream = feed.stream(heartbeat=0.01)
+    assert next(stream).startswith("retry:")
+    assert next(stream) == ": keepalive\n\n"
+
+    feed.publish({"name": "Alice"})
+    frame = next(stream)
+    lines = frame.strip().split("\n")
+    assert lines[:2] == ["id: 1", "event: signin"]
+    assert json.loads(lines[2][len("data: ") :]) == {"name": "Alice"}
+
+    stream.close()
+    assert feed.stats()["viewers"] == 0
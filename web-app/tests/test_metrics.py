@@ -0,0 +1,65 @@
+"""Unit tests for the web app's route and dependency latency metrics."""
+
+from types import SimpleNamespace
+from src import metrics
+from src.metrics import MongoTimer, Summary
+
+
+def test_summary_reports_windowed_quantiles():
+    """Quantiles cover the window; sum and count cover every observation."""
+    summary = Summary("demo_seconds", "Demo.", ("endpoint",), window=100)
+    for millis in range(1, 201):
+        summary.observe(millis / 1000, "/signin")
+
+    quantiles = summary.quantiles("/signin")
+    assert quantiles[0.5] == 0.151
+    assert quantiles[0.99] == 0.2
+    text = summary.render()
+    assert "# TYPE demo_seconds summary" in text
+    assert 'demo_seconds{endpoint="/signin",quantile="0.95"} 0.196' in text
+    assert 'demo_seconds_count{endpoint="/signin"} 200' in text
+    assert summary.quantiles("/admin") == {}
+
+
+def test_deepface_paths_are_bounded():
+    """Face ids in DeepFace paths are replaced by a placeholder."""
+    assert metrics.deepface_operation("/faces/verify") == "/faces/verify"
+    assert (
+        metrics.deepface_operation("/faces/0123456789abcdef01234567")
+        == "/faces/<face_id>"
+    )
+
+
+def _event(command_name, command, request_id=1, micros=2500):
+    return SimpleNamespace(
+        command_name=command_name,
+        command=command,
+        connection_id=("db", 27017),
+        request_id=request_id,
+        duration_micros=micros,
+    )
+
+
+def test_mongo_commands_are_timed_by_collection():
+    """Commands are labelled by collection, with monthly partitions merged."""
+    timer = MongoTimer()
+    timer.started(_event("find", {"find": "attendance_2025_03"}))
+    timer.succeeded(_event("find", {}))
+    timer.started(_event("getMore", {"getMore": 7, "collection": "faces"}, 2))
+    timer.failed(_event("getMore", {}, 2))
+
+    background = ("background", "mongo")
+    assert metrics.DEPENDENCY_SECONDS.quantiles(
+        *background, "attendance_<month>.find"
+    ) == {0.5: 0.0025, 0.95: 0.0025, 0.99: 0.0025}
+    assert metrics.DEPENDENCY_SECONDS.quantiles(*background, "faces.getMore")
+
+
+def test_endpoint_prefers_the_asgi_route():
+    """The route set by asgi.py is used in place of the default label."""
+    assert metrics.endpoint() == "background"
+    token = metrics.ENDPOINT.set("/signin/stream")
+    try:
+        assert metrics.endpoint() == "/signin/stream"
+    finally:
+        metrics.ENDPOINT.reset(token)
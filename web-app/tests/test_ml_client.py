@@ -0,0 +1,104 @@
+"""Unit tests for the DeepFace call helpers."""
+
+from unittest.mock import MagicMock, patch
+import pytest
+from src import ml_client
+
+
+def _response(status_code, retry_after=None):
+    response = MagicMock(status_code=status_code)
+    response.headers = {} if retry_after is None else {"Retry-After": retry_after}
+    return response
+
+
+def test_retry_after_parses_header():
+    """Retry-After is read in whole seconds with a sane fallback."""
+    assert ml_client.retry_after(_response(503, "4")) == 4
+    assert ml_client.retry_after(_response(503, "soon")) == 1
+    assert ml_client.retry_after(_response(503)) == 1
+
+
+@patch("src.ml_client.time.sleep")
+def test_with_retry_retries_busy_responses(mock_sleep):
+    """Busy answers are retried after a jittered Retry-After wait."""
+    send = MagicMock(side_effect=[_response(503, "2"), _response(200)])
+    deadline = ml_client.Deadline(30)
+    response = ml_client.with_retry(
+        send, deadline, "http://ml/faces", json={"img": "x"}
+    )
+
+    assert response.status_code == 200
+    assert send.call_count == 2
+    assert send.call_args[0] == ("http://ml/faces",)
+    assert send.call_args[1]["json"] == {"img": "x"}
+    assert 1 <= mock_sleep.call_args[0][0] <= 3
+
+
+@patch("src.ml_client.time.sleep")
+def test_with_retry_gives_up_after_attempts(mock_sleep):
+    """The last rejection is returned once the attempts are used up."""
+    send = MagicMock(return_value=_response(429, "1"))
+    response = ml_client.with_retry(send, ml_client.Deadline(30), attempts=3)
+
+    assert response.status_code == 429
+    assert send.call_count == 3
+    assert mock_sleep.call_count == 2
+
+
+@patch("src.ml_client.time.sleep")
+def test_with_retry_stops_when_wait_exceeds_deadline(mock_sleep):
+    """No retry is attempted if the wait would outlast the budget."""
+    send = MagicMock(return_value=_response(503, "5"))
+    response = ml_client.with_retry(send, ml_client.Deadline(1))
+
+    assert response.status_code == 503
+    assert send.call_count == 1
+    mock_sleep.assert_not_called()
+
+
+def test_send_within_sets_timeout_and_header():
+    """The remaining budget becomes the timeout and the deadline header."""
+    send = MagicMock()
+    ml_client.send_within(send, ml_client.Deadline(2), "http://ml/faces/verify")
+
+    kwargs = send.call_args[1]
+    assert 0 < kwargs["timeout"] <= 2
+    assert 0 < int(kwargs["headers"][ml_client.DEADLINE_HEADER]) <= 2000
+
+
+def test_send_within_refuses_spent_budget():
+    """Nothing is sent once the budget is spent."""
+    send = MagicMock()
+    with pytest.raises(ml_client.DeadlineExceeded):
+        ml_client.send_within(send, ml_client.Deadline(0), "http://ml/faces/verify")
+    send.assert_not_called()
+
+
+def test_deadline_adopts_shorter_caller_budget():
+    """A caller's shorter budget wins; a longer or missing one is capped."""
+    assert ml_client.Deadline.from_header("500", 30).remaining() <= 0.5
+    assert 29 < ml_client.Deadline.from_header("60000", 30).remaining() <= 30
+    assert 29 < ml_client.Deadline.from_header(None, 30).remaining() <= 30
+
+
+def test_server_timing_round_trip():
+    """Server-Timing values are formatted and parsed as (name, ms) pairs."""
+    value = ml_client.format_server_timing([("verify", 12.34), ("record", 1)])
+    assert value == "verify;dur=12.3, record;dur=1.0"
+    assert ml_client.parse_server_timing(value) == [
+        ("verify", 12.3),
+        ("record", 1.0),
+    ]
+    assert not ml_client.parse_server_timing('cache;desc="hit", db;dur=x')
+    assert not ml_client.parse_server_timing(None)
+
+
+def test_call_timings_prefix_service_stages():
+    """A call's round trip comes first, then the service's own stages."""
+    response = _response(200)
+    response.headers = {"Server-Timing": "verify;dur=80, record;dur=2"}
+    assert ml_client.call_timings(response, 0.1) == [
+        ("deepface", 100.0),
+        ("ml-verify", 80.0),
+        ("ml-record", 2.0),
+    ]
@@ -0,0 +1,216 @@
+"""Unit tests for DeepFace replica balancing, ejection and hedging."""
+
+import asyncio
+import random
+import threading
+import time
+from unittest.mock import MagicMock
+import pytest
+import requests
+from src.ml_pool import HEDGE_MIN_SAMPLES, ReplicaPool
+
+
+def _ok(status_code=200):
+    return MagicMock(status_code=status_code)
+
+
+def _prime(pool):
+    """Record enough fast calls for hedging to have a p95."""
+    fast = pool.sender(MagicMock(return_value=_ok()))
+    for _ in range(HEDGE_MIN_SAMPLES):
+        fast("/faces/verify")
+
+
+def test_sender_prefixes_replica_url():
+    """Calls take a path and go to a replica's base URL."""
+    send = MagicMock(return_value=_ok())
+    pool = ReplicaPool(["http://ml-a/"])
+    pool.sender(send)("/faces/verify", json={"img": "x"}, timeout=5)
+    send.assert_called_once_with(
+        "http://ml-a/faces/verify", json={"img": "x"}, timeout=5
+    )
+
+
+def test_choose_prefers_fewer_outstanding_requests():
+    """Of two sampled replicas the one with less in flight wins."""
+    pool = ReplicaPool(["http://ml-a", "http://ml-b"], rng=random.Random(1))
+    busy, idle = pool.replicas
+    busy.outstanding = 5
+    assert all(pool.choose() is idle for _ in range(10))
+
+
+def test_failing_replica_is_ejected_and_skipped():
+    """Consecutive failures take a replica out of rotation."""
+    pool = ReplicaPool(
+        ["http://ml-a", "http://ml-b"], failure_threshold=2, ejection_seconds=60
+    )
+    _, good = pool.replicas
+    good.outstanding = 100  # so the failing replica is chosen until ejected
+    send = pool.sender(MagicMock(side_effect=requests.ConnectionError("down")))
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            send("/faces")
+
+    assert pool.stats()["replicas"][0]["ejected"] is True
+    assert all(pool.choose() is good for _ in range(10))
+
+
+def test_all_ejected_falls_back_to_soonest_return():
+    """With every replica ejected one is still used rather than failing."""
+    pool = ReplicaPool(["http://ml-a", "http://ml-b"])
+    first, second = pool.replicas
+    first.ejected_until = time.monotonic() + 100
+    second.ejected_until = time.monotonic() + 10
+    assert pool.choose() is second
+
+
+def test_busy_answers_do_not_count_as_failures():
+    """Overload rejections are not treated as an unhealthy replica."""
+    pool = ReplicaPool(["http://ml-a"], failure_threshold=1)
+    pool.sender(MagicMock(return_value=_ok(503)))("/faces/verify")
+    assert pool.stats()["replicas"][0]["failures"] == 0
+    pool.sender(MagicMock(return_value=_ok(500)))("/faces/verify")
+    assert pool.stats()["replicas"][0]["ejected"] is True
+
+
+def test_slow_call_is_hedged_to_another_replica():
+    """A call slower than the p95 is repeated elsewhere; the first answer wins."""
+    pool = ReplicaPool(["http://ml-a", "http://ml-b"], hedge=True)
+    _prime(pool)
+    slow, quick = pool.replicas
+    quick.outstanding = 100  # so the slow replica is chosen first
+    release = threading.Event()
+    fast = _ok()
+
+    def send(url, **_):
+        if url.startswith(slow.url):
+            release.wait(5)
+            return _ok()
+        return fast
+
+    response = pool.sender(send, hedge=True)("/faces/verify", timeout=5)
+    release.set()
+    assert response is fast
+    stats = pool.stats()
+    assert stats["hedges"] == 1
+    assert stats["hedge_wins"] == 1
+
+
+def test_async_slow_call_is_hedged():
+    """The async sender hedges the same way and cancels the loser."""
+    pool = ReplicaPool(["http://ml-a", "http://ml-b"], hedge=True)
+    _prime(pool)
+    slow, quick = pool.replicas
+    quick.outstanding = 100  # so the slow replica is chosen first
+    fast = _ok()
+
+    async def send(url, **_):
+        if url.startswith(slow.url):
+            await asyncio.sleep(5)
+        return fast
+
+    async def run():
+        return await pool.async_sender(send, hedge=True)("/faces/verify")
+
+    started = time.monotonic()
+    assert asyncio.run(run()) is fast
+    assert time.monotonic() - started < 5
+    assert pool.stats()["hedge_wins"] == 1
+
+
+def test_busy_first_answer_does_not_win_the_hedge():
+    """A busy or failing answer waits for the other replica's answer."""
+    pool = ReplicaPool(["http://ml-a", "http://ml-b"], hedge=True)
+    _prime(pool)
+    slow, quick = pool.replicas
+    quick.outstanding = 100  # so the slow replica is chosen first
+    answered = _ok()
+    release = threading.Event()
+
+    def send(url, **_):
+        if url.startswith(slow.url):
+            release.wait(5)
+            return _ok(503)
+        release.set()  # the busy answer arrives first
+        time.sleep(0.05)
+        return answered
+
+    assert pool.sender(send, hedge=True)("/faces/verify", timeout=5) is answered
+    assert pool.stats()["hedge_wins"] == 1
+
+
+def test_hedge_delay_is_kept_per_path():
+    """Slow identify calls do not raise the delay for hedging verify calls."""
+    pool = ReplicaPool(["http://ml-a", "http://ml-b"], hedge=True)
+    _prime(pool)
+    assert pool.hedge_delay("/faces/identify") is None
+    slow = pool.sender(
+        MagicMock(side_effect=lambda *_, **__: time.sleep(0.01) or _ok())
+    )
+    for _ in range(HEDGE_MIN_SAMPLES):
+        slow("/faces/identify")
+
+    assert (
+        pool.hedge_delay("/faces/verify") < 0.01 <= pool.hedge_delay("/faces/identify")
+    )
+    assert set(pool.stats()["hedge_delay_ms"]) == {"/faces/verify", "/faces/identify"}
+
+
+def test_hedging_waits_for_enough_samples():
+    """No hedge is sent before there is a latency history."""
+    pool = ReplicaPool(["http://ml-a", "http://ml-b"], hedge=True)
+    send = MagicMock(return_value=_ok())
+    pool.sender(send, hedge=True)("/faces/verify")
+    assert send.call_count == 1
+    assert pool.stats()["hedge_delay_ms"] == {}
+
+
+def test_pinned_sender_uses_that_replica():
+    """A call pinned to a replica goes there, or anywhere if it has left."""
+    send = MagicMock(return_value=_ok())
+    pool = ReplicaPool(["http://ml-a", "http://ml-b"], rng=random.Random(1))
+    for _ in range(5):
+        pool.sender(send, replica="http://ml-b")("/faces")
+        assert send.call_args.args[0] == "http://ml-b/faces"
+    pool.sender(send, replica="http://gone")("/faces")
+    assert pool.replica_url("http://ml-a/faces/verify") == "http://ml-a"
+    assert pool.replica_url("http://other/faces/verify") is None
+
+
+def test_broadcast_reaches_every_replica():
+    """A broadcast goes to each replica and survives one being down."""
+
+    def send(url, **_):
+        if url.startswith("http://ml-b"):
+            raise requests.ConnectionError("down")
+        return _ok()
+
+    pool = ReplicaPool(["http://ml-a", "http://ml-b", "http://ml-c"])
+    sent = MagicMock(side_effect=send)
+    assert pool.broadcast(sent)("/faces/abc").status_code == 200
+    assert [call.args[0] for call in sent.call_args_list] == [
+        "http://ml-a/faces/abc",
+        "http://ml-b/faces/abc",
+        "http://ml-c/faces/abc",
+    ]
+
+    with pytest.raises(requests.ConnectionError):
+        ReplicaPool(["http://ml-b"]).broadcast(sent)("/faces/abc")
+
+
+def test_observer_sees_each_call_once():
+    """The observer gets the path and the caller's wait for every call."""
+    observe = MagicMock()
+    pool = ReplicaPool(["http://ml-a"], observe=observe)
+    pool.sender(MagicMock(return_value=_ok()))("/faces/verify")
+
+    async def run():
+        send = MagicMock(side_effect=lambda *_, **__: asyncio.sleep(0, _ok()))
+        await pool.async_sender(send)("/faces/detect")
+
+    asyncio.run(run())
+    assert [call.args[0] for call in observe.call_args_list] == [
+        "/faces/verify",
+        "/faces/detect",
+    ]
+    assert all(call.args[1] >= 0 for call in observe.call_args_list)
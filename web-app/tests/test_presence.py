@@ -0,0 +1,69 @@
+"""Unit tests for the today's-presence cache."""
+
+import threading
+from unittest.mock import MagicMock
+from src.presence import PresenceCache
+
+
+def test_rebuilds_once_per_day_and_counts_hits():
+    """The loader runs on first use and on rollover only."""
+    loader = MagicMock(side_effect=[["a"], []])
+    cache = PresenceCache()
+
+    assert cache.contains("2025-04-01", "a", loader) is True
+    assert cache.contains("2025-04-01", "b", loader) is False
+    cache.add("2025-04-01", "b")
+    assert cache.contains("2025-04-01", "b", loader) is True
+    assert loader.call_count == 1
+
+    # Day rollover drops yesterday's entries
+    assert cache.contains("2025-04-02", "a", loader) is False
+    assert loader.call_count == 2
+
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 2
+    assert stats["hit_rate"] == 0.5
+    assert stats["date"] == "2025-04-02"
+
+
+def test_add_for_stale_day_is_ignored():
+    """Adds for a day other than the cached one are not kept."""
+    cache = PresenceCache()
+    cache.contains("2025-04-02", "x", lambda _: [])
+    cache.add("2025-04-01", "a")
+    assert cache.stats()["size"] == 0
+
+
+def test_discard_invalidates_entry():
+    """Discarding an id forces the next lookup to miss."""
+    cache = PresenceCache()
+    cache.contains("2025-04-01", "a", lambda _: ["a"])
+    cache.discard("a")
+    assert cache.contains("2025-04-01", "a", lambda _: ["a"]) is False
+
+
+def test_rebuild_does_not_hold_the_lock():
+    """Other lookups are answered while a rollover query is running."""
+    cache = PresenceCache()
+    cache.contains("2025-04-01", "a", lambda _: ["a"])
+    started, release = threading.Event(), threading.Event()
+
+    def slow_loader(_):
+        started.set()
+        release.wait(5)
+        return ["b"]
+
+    rollover = threading.Thread(
+        target=cache.contains, args=("2025-04-02", "b", slow_loader)
+    )
+    rollover.start()
+    assert started.wait(5)
+    assert cache.stats()["date"] == "2025-04-01"
+    cache.add("2025-04-01", "c")
+    release.set()
+    rollover.join(5)
+
+    assert cache.claim("2025-04-02", "b", slow_loader) is False
+    assert cache.claim("2025-04-02", "c", slow_loader) is True
+    assert cache.stats()["rebuilds"] == 2
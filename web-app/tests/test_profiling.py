@@ -0,0 +1,95 @@
+"""Unit tests for the on-demand sampling profiler."""
+
+import inspect
+import os
+import time
+import pytest
+from src import profiling
+from src.profiling import Profiler, folded_stack
+
+OTHER_COPY = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "..",
+    "machine-learning-client",
+    "src",
+    "profiling.py",
+)
+
+
+def _busy(seconds):
+    """Spin on the CPU for ``seconds``."""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as file:
+        return file.read()
+
+
+def test_block_writes_wall_and_cpu_flamegraphs(tmp_path):
+    """A profiled block is written as collapsed stacks, wall and CPU."""
+    profiler = Profiler(str(tmp_path), interval=0.001)
+    with profiler.block("startup"):
+        _busy(0.1)
+
+    written = profiler.status()["written"]
+    wall, cpu = written[0], written[1]
+    assert wall.endswith(".wall.folded") and cpu.endswith(".cpu.folded")
+    assert "_busy (test_profiling.py:" in _read(wall)
+    assert "_busy (test_profiling.py:" in _read(cpu)
+    assert not profiler.active
+
+
+def test_only_matching_requests_are_profiled(tmp_path):
+    """Requests to other routes are ignored; the profile ends after N."""
+    profiler = Profiler(str(tmp_path), interval=0.001)
+    profiler.start("signin", routes=("/process_signin",), requests=1)
+
+    profiler.enter("/admin")
+    assert profiler.status()["remaining_requests"] == 1
+    profiler.enter("/process_signin")
+    _busy(0.05)
+    profiler.exit()
+
+    profiler.wait(timeout=5)
+    assert not profiler.active
+    assert "_busy" in _read(profiler.status()["written"][0])
+
+
+def test_one_profile_at_a_time(tmp_path):
+    """A second profile, or one without a limit, is refused."""
+    profiler = Profiler(str(tmp_path))
+    with pytest.raises(ValueError):
+        profiler.start("nothing")
+    profiler.start("window", seconds=0.05)
+    with pytest.raises(ValueError):
+        profiler.start("again", seconds=1)
+    profiler.wait()
+
+
+def test_folded_stack_is_outermost_first():
+    """Frames are joined root first, as flamegraph tools expect."""
+
+    def inner():
+        return folded_stack(inspect.currentframe())
+
+    stack = inner().split(";")
+    assert stack[-1].startswith("inner (test_profiling.py:")
+    assert stack[-2].startswith("test_folded_stack_is_outermost_first")
+
+
+def _code(path):
+    """Return a module's source without its docstring."""
+    with open(path, encoding="utf-8") as file:
+        return file.read().split('"""', 2)[2]
+
+
+@pytest.mark.skipif(
+    not os.path.exists(OTHER_COPY), reason="built without machine-learning-client"
+)
+def test_matches_the_deepface_service_copy():
+    """This copy's code is identical to the DeepFace service's."""
+    assert _code(profiling.__file__) == _code(OTHER_COPY)
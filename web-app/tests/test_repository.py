@@ -0,0 +1,166 @@
+"""Unit tests for the web app data access layer."""
+
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from src.repository import (
+    ATTENDANCE_PROJECTION,
+    FACE_PROJECTION,
+    AttendanceRecord,
+    FaceRecord,
+    SigninResult,
+    SmartGateRepository,
+    months_between,
+    partition_name,
+)
+
+
+def test_face_projection_excludes_embeddings():
+    """Face queries must never request the embedding vectors."""
+    assert "img_vectors" not in FACE_PROJECTION
+    assert FACE_PROJECTION == {"name": 1}
+
+
+def test_list_faces_uses_projection():
+    """Listing faces passes the projection and returns typed records."""
+    face_id = ObjectId()
+    db = MagicMock()
+    db.faces.find.return_value = [{"_id": face_id, "name": "Alice"}]
+
+    faces = SmartGateRepository(db).list_faces()
+
+    db.faces.find.assert_called_once_with({}, FACE_PROJECTION)
+    assert faces == [FaceRecord(id=face_id, name="Alice")]
+
+
+def test_get_face_found_and_missing():
+    """get_face returns a record or None."""
+    face_id = ObjectId()
+    db = MagicMock()
+    db.faces.find_one.return_value = {"_id": face_id, "name": "Bob"}
+    repository = SmartGateRepository(db)
+
+    assert repository.get_face(str(face_id)) == FaceRecord(id=face_id, name="Bob")
+    db.faces.find_one.assert_called_once_with({"_id": face_id}, FACE_PROJECTION)
+
+    db.faces.find_one.return_value = None
+    assert repository.get_face(str(face_id)) is None
+
+
+def test_list_attendance_for_user():
+    """Per-user attendance is filtered, projected and sorted newest first."""
+    face_id = ObjectId()
+    record_id = ObjectId()
+    now = datetime.now()
+    db = MagicMock()
+    db.attendance.find.return_value.sort.return_value = [
+        {"_id": record_id, "face_id": face_id, "timestamp": now}
+    ]
+
+    records = SmartGateRepository(db).list_attendance_for(str(face_id))
+
+    db.attendance.find.assert_called_once_with(
+        {"face_id": face_id}, ATTENDANCE_PROJECTION
+    )
+    db.attendance.find.return_value.sort.assert_called_once_with("timestamp", -1)
+    assert records == [AttendanceRecord(id=record_id, face_id=face_id, timestamp=now)]
+
+
+def test_delete_face_reports_result():
+    """delete_face reports whether a document was removed."""
+    db = MagicMock()
+    db.faces.delete_one.return_value.deleted_count = 0
+    assert SmartGateRepository(db).delete_face(str(ObjectId())) is False
+
+
+def test_ensure_indexes_creates_unique_daily_key():
+    """The daily attendance key is backed by a unique partial index."""
+    db = MagicMock()
+    SmartGateRepository(db).ensure_indexes()
+
+    args, kwargs = db.attendance.create_index.call_args
+    assert args[0] == [("local_date", 1), ("face_id", 1)]
+    assert kwargs["unique"] is True
+    assert kwargs["partialFilterExpression"] == {"local_date": {"$exists": True}}
+
+
+def test_each_repository_indexes_its_own_partitions():
+    """A partition indexed through one database is still indexed on another."""
+    now = datetime(2025, 4, 1, 8, 30, tzinfo=timezone.utc)
+    first, second = MagicMock(), MagicMock()
+
+    SmartGateRepository(first).record_daily_signin(str(ObjectId()), now)
+    SmartGateRepository(second).record_daily_signin(str(ObjectId()), now)
+
+    assert first.__getitem__.return_value.create_index.called
+    assert second.__getitem__.return_value.create_index.called
+
+
+def test_record_daily_signin_first_and_repeat():
+    """A single upsert reports first versus repeat sign-ins."""
+    face_id = ObjectId()
+    attendance_id = ObjectId()
+    now = datetime(2025, 4, 1, 8, 30, tzinfo=timezone.utc)
+    db = MagicMock()
+    partition = db.__getitem__.return_value
+    partition.update_one.return_value.upserted_id = attendance_id
+    repository = SmartGateRepository(db)
+
+    result = repository.record_daily_signin(str(face_id), now)
+
+    db.__getitem__.assert_called_with("attendance_2025_04")
+    partition.update_one.assert_called_once_with(
+        {"face_id": face_id, "local_date": "2025-04-01"},
+        {"$setOnInsert": {"timestamp": now}},
+        upsert=True,
+    )
+    assert result == SigninResult(attendance_id=attendance_id, first=True)
+
+    partition.update_one.return_value.upserted_id = None
+    assert repository.record_daily_signin(str(face_id), now).first is False
+
+
+def test_record_daily_signin_race_is_repeat():
+    """Losing a concurrent insert on the unique key counts as a repeat."""
+    db = MagicMock()
+    db.__getitem__.return_value.update_one.side_effect = DuplicateKeyError("E11000")
+
+    result = SmartGateRepository(db).record_daily_signin(
+        str(ObjectId()), datetime.now(timezone.utc)
+    )
+
+    assert result == SigninResult(attendance_id=None, first=False)
+
+
+def test_months_between_spans_year_end():
+    """Month ranges are half-open and cross year boundaries."""
+    start = datetime(2024, 11, 15, tzinfo=timezone.utc)
+    end = datetime(2025, 2, 1, tzinfo=timezone.utc)
+    assert months_between(start, end) == ["2024-11", "2024-12", "2025-01"]
+    assert partition_name("2025-01") == "attendance_2025_01"
+
+
+def test_insert_signins_groups_by_partition():
+    """Write-behind batches spanning months go to their own partitions."""
+    db = MagicMock()
+    partitions = {}
+    db.__getitem__.side_effect = lambda name: partitions.setdefault(name, MagicMock())
+    face_id = ObjectId()
+    march = {
+        "_id": ObjectId(),
+        "face_id": face_id,
+        "local_date": "2025-03-31",
+        "timestamp": datetime(2025, 3, 31, 9),
+    }
+    april = dict(march, local_date="2025-04-01", _id=ObjectId())
+
+    inserted = SmartGateRepository(db).insert_signins([march, april])
+
+    assert inserted == [march, april]
+    partitions["attendance_2025_03"].insert_many.assert_called_once_with(
+        [march], ordered=False
+    )
+    partitions["attendance_2025_04"].insert_many.assert_called_once_with(
+        [april], ordered=False
+    )
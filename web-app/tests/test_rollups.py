@@ -0,0 +1,90 @@
+"""Unit tests for the attendance rollups."""
+
+from unittest.mock import MagicMock
+from bson import ObjectId
+from pymongo import UpdateOne
+from src.rollups import DAILY, MONTHLY, AttendanceRollups
+
+
+def _db():
+    db = MagicMock()
+    collections = {DAILY: MagicMock(), MONTHLY: MagicMock()}
+    db.__getitem__.side_effect = collections.__getitem__
+    return db, collections
+
+
+def test_record_groups_increments():
+    """Sign-ins are folded into one upsert per day and per person-month."""
+    db, collections = _db()
+    alice, bob = ObjectId(), ObjectId()
+
+    AttendanceRollups(db).record(
+        [(alice, "2025-04-01"), (bob, "2025-04-01"), (alice, "2025-04-02")]
+    )
+
+    daily_ops = collections[DAILY].bulk_write.call_args[0][0]
+    assert daily_ops == [
+        UpdateOne({"_id": "2025-04-01"}, {"$inc": {"count": 2}}, upsert=True),
+        UpdateOne({"_id": "2025-04-02"}, {"$inc": {"count": 1}}, upsert=True),
+    ]
+    monthly_ops = collections[MONTHLY].bulk_write.call_args[0][0]
+    assert monthly_ops == [
+        UpdateOne(
+            {"month": "2025-04", "face_id": alice},
+            {"$inc": {"count": 2}},
+            upsert=True,
+        ),
+        UpdateOne(
+            {"month": "2025-04", "face_id": bob}, {"$inc": {"count": 1}}, upsert=True
+        ),
+    ]
+
+
+def test_record_nothing_is_a_noop():
+    """No writes are issued when there is nothing to count."""
+    db, collections = _db()
+    AttendanceRollups(db).record([])
+    collections[DAILY].bulk_write.assert_not_called()
+
+
+def test_rebuild_swaps_in_scratch_collections():
+    """Rebuild writes fresh counts to scratch collections and renames them."""
+    db = MagicMock()
+    scratch = {}
+
+    def collection(name):
+        return scratch.setdefault(name, MagicMock())
+
+    db.__getitem__.side_effect = collection
+    alice = ObjectId()
+
+    AttendanceRollups(db).rebuild([(alice, "2025-04-01"), (alice, "2025-04-02")])
+
+    daily = scratch[f"{DAILY}_rebuild"]
+    daily.insert_many.assert_called_once_with(
+        [{"_id": "2025-04-01", "count": 1}, {"_id": "2025-04-02", "count": 1}]
+    )
+    daily.rename.assert_called_once_with(DAILY, dropTarget=True)
+    monthly = scratch[f"{MONTHLY}_rebuild"]
+    monthly.insert_many.assert_called_once_with(
+        [{"month": "2025-04", "face_id": alice, "count": 2}]
+    )
+
+
+def test_check_reports_mismatches():
+    """The consistency check lists every rollup that disagrees with raw data."""
+    db, collections = _db()
+    alice, bob = ObjectId(), ObjectId()
+    collections[DAILY].find.return_value = [{"_id": "2025-04-01", "count": 1}]
+    collections[MONTHLY].find.return_value = [
+        {"month": "2025-04", "face_id": alice, "count": 1},
+        {"month": "2025-04", "face_id": bob, "count": 1},
+    ]
+
+    mismatches = AttendanceRollups(db).check(
+        [(alice, "2025-04-01"), (bob, "2025-04-01")]
+    )
+
+    assert mismatches == [
+        {"kind": "daily", "key": "2025-04-01", "expected": 2, "actual": 1}
+    ]
@@ -0,0 +1,72 @@
+"""Unit tests for trace context propagation and span export."""
+
+import json
+from unittest.mock import patch
+import pytest
+from src import tracing
+
+PARENT = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+
+@pytest.fixture(name="spans")
+def spans_fixture(tmp_path):
+    """Export spans to a temporary file; yield a reader for them."""
+    exporter = tracing.FileExporter(str(tmp_path / "traces.jsonl"))
+    with patch.object(tracing, "exporter", exporter):
+
+        def read():
+            exporter.flush()
+            with open(exporter.path, encoding="utf-8") as file:
+                return [json.loads(line) for line in file]
+
+        yield read
+
+
+def test_parse_accepts_only_valid_traceparents():
+    """Malformed, all-zero and version ff headers are ignored."""
+    context = tracing.parse(PARENT)
+    assert context.trace_id == "0af7651916cd43dd8448eb211c80319c"
+    assert context.sampled is True
+    assert tracing.parse(PARENT[:-2] + "00").sampled is False
+    for header in (
+        None,
+        "",
+        "garbage",
+        "ff" + PARENT[2:],
+        "00-" + "0" * 32 + PARENT[35:],
+    ):
+        assert tracing.parse(header) is None
+
+
+def test_sampled_parent_is_continued(spans):
+    """Spans join the caller's trace, and calls carry a child context."""
+    request_span = tracing.enter("POST /process_signin", PARENT)
+    call = tracing.child("deepface", path="/faces/verify")
+    tracing.record("mongo faces.find", 0.002)
+    call.end()
+    tracing.leave(request_span)
+
+    records = {record["name"]: record for record in spans()}
+    assert {r["trace_id"] for r in records.values()} == {PARENT[3:35]}
+    assert records["POST /process_signin"]["parent_id"] == PARENT[36:52]
+    assert records["deepface"]["parent_id"] == request_span.context.span_id
+    assert records["mongo faces.find"]["duration_ms"] == 2.0
+    assert call.headers()[tracing.TRACEPARENT].endswith("-01")
+    assert tracing.current() is None
+
+
+def test_unsampled_traces_still_propagate(tmp_path):
+    """Without sampling nothing is written, but the decision is forwarded."""
+    exporter = tracing.FileExporter(str(tmp_path / "traces.jsonl"))
+    with patch.object(tracing, "exporter", exporter), patch.object(
+        tracing, "TRACE_SAMPLE_RATE", 0.0
+    ):
+        request_span = tracing.enter("GET /signin")
+        call = tracing.child("deepface")
+        tracing.record("jinja signin.html", 0.001)
+        call.end()
+        tracing.leave(request_span)
+
+    assert call.context.trace_id == request_span.context.trace_id
+    assert call.headers()[tracing.TRACEPARENT].endswith("-00")
+    assert not (tmp_path / "traces.jsonl").exists()
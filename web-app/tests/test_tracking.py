@@ -0,0 +1,61 @@
+"""Unit tests for face tracking across streamed frames."""
+
+from src.tracking import FaceTracker, overlap
+
+
+def _face(x, size=100, sharpness=50.0):
+    return {"box": {"x": x, "y": 20, "w": size, "h": size}, "sharpness": sharpness}
+
+
+def test_overlap_of_boxes():
+    """Identical boxes overlap fully, disjoint ones not at all."""
+    box = {"x": 0, "y": 0, "w": 10, "h": 10}
+    assert overlap(box, box) == 1.0
+    assert overlap(box, {"x": 20, "y": 0, "w": 10, "h": 10}) == 0.0
+    assert overlap(box, {"x": 5, "y": 0, "w": 10, "h": 10}) == 50 / 150
+
+
+def test_steady_face_is_ready_once():
+    """A face becomes ready after enough good frames, and only once."""
+    tracker = FaceTracker(stable_frames=3)
+    assert not tracker.update([_face(0)])
+    assert not tracker.update([_face(4)])
+    ready = tracker.update([_face(8)])
+    assert len(ready) == 1
+    for x in range(12, 60, 4):
+        assert not tracker.update([_face(x)])
+    assert tracker.visible()[0]["settled"] is True
+
+
+def test_small_or_blurred_frames_do_not_count():
+    """Poor frames reset the count of good frames."""
+    tracker = FaceTracker(stable_frames=2, min_size=60, min_sharpness=20)
+    assert not tracker.update([_face(0, size=40)])
+    assert not tracker.update([_face(0)])
+    assert not tracker.update([_face(0, sharpness=5)])
+    assert not tracker.update([_face(0)])
+    assert tracker.update([_face(0)])
+
+
+def test_face_that_leaves_is_recognised_again():
+    """A track lost for too many frames is dropped; its return is new."""
+    tracker = FaceTracker(stable_frames=1, max_missed=2)
+    first = tracker.update([_face(0)])
+    for _ in range(3):
+        tracker.update([])
+    assert tracker.tracks == []
+    again = tracker.update([_face(0)])
+    assert again and again[0].track_id != first[0].track_id
+
+
+def test_settle_and_reopen():
+    """Recognised boxes settle their tracks; a failed recognition reopens."""
+    tracker = FaceTracker(stable_frames=2)
+    tracker.update([_face(0), _face(300)])
+    ready = tracker.update([_face(0), _face(300)])
+    assert len(ready) == 2
+    tracker.reopen(ready)
+    tracker.settle([_face(300)["box"]])
+    assert [track["settled"] for track in tracker.visible()] == [False, True]
+    assert tracker.update([_face(0), _face(300)]) == []
+    assert len(tracker.update([_face(0), _face(300)])) == 1
@@ -0,0 +1,192 @@
+"""Unit tests for the write-behind attendance buffer."""
+
+import time
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+import pytest
+from bson import ObjectId
+from src.repository import SmartGateRepository
+from src.write_behind import AttendanceWriteBehind
+
+NOW = datetime(2025, 4, 1, 8, 30, tzinfo=timezone.utc)
+
+
+def _buffer(tmp_path, repository, **kwargs):
+    return AttendanceWriteBehind(
+        str(tmp_path / "attendance.wal"), lambda: repository, **kwargs
+    )
+
+
+def test_enqueue_is_durable_before_flush(tmp_path):
+    """Queued sign-ins are on disk and pending until flushed."""
+    repository = MagicMock()
+    buffer = _buffer(tmp_path, repository, max_delay=60)
+    buffer.start()
+    face_id = ObjectId()
+
+    doc = SmartGateRepository.daily_signin_doc(face_id, NOW)
+    assert buffer.enqueue(doc) == doc["_id"]
+
+    assert str(doc["_id"]) in (tmp_path / "attendance.wal").read_text()
+    assert buffer.pending_face_ids("2025-04-01") == [face_id]
+    assert buffer.stats()["queue_depth"] == 1
+    repository.insert_signins.assert_not_called()
+
+    buffer.flush()
+    repository.insert_signins.assert_called_once_with([doc])
+    stats = buffer.stats()
+    assert stats["queue_depth"] == 0
+    assert stats["flushed"] == 1
+    assert stats["segments"] == 0
+    buffer.stop()
+
+
+def test_failed_flush_keeps_documents(tmp_path):
+    """A failed flush re-queues the batch and keeps its log segment."""
+    repository = MagicMock()
+    repository.insert_signins.side_effect = [RuntimeError("down"), None]
+    buffer = _buffer(tmp_path, repository, max_delay=60)
+    buffer.start()
+    doc = SmartGateRepository.daily_signin_doc(ObjectId(), NOW)
+    buffer.enqueue(doc)
+
+    buffer.flush()
+    assert buffer.stats()["queue_depth"] == 1
+    assert buffer.stats()["flush_failures"] == 1
+
+    buffer.flush()
+    assert buffer.stats()["queue_depth"] == 0
+    assert repository.insert_signins.call_args[0][0] == [doc]
+    buffer.stop()
+
+
+def test_replay_after_crash(tmp_path):
+    """Sign-ins acknowledged before a crash are replayed on startup."""
+    crashed = _buffer(tmp_path, MagicMock(), max_delay=60)
+    crashed.start()
+    doc = SmartGateRepository.daily_signin_doc(ObjectId(), NOW)
+    crashed.enqueue(doc)
+    # Simulate a crash: a torn write and no flush
+    with open(tmp_path / "attendance.wal", "a", encoding="utf-8") as log:
+        log.write('{"_id": "trunc')
+
+    repository = MagicMock()
+    restarted = _buffer(tmp_path, repository, max_delay=60)
+    restarted.start()
+    restarted.flush()
+
+    repository.insert_signins.assert_called_once_with([doc])
+    assert restarted.stats()["queue_depth"] == 0
+    restarted.stop()
+
+
+def test_size_trigger_flushes_in_background(tmp_path):
+    """Reaching the batch size wakes the flusher thread."""
+    repository = MagicMock()
+    buffer = _buffer(tmp_path, repository, max_batch=2, max_delay=60)
+    buffer.start()
+    buffer.enqueue(SmartGateRepository.daily_signin_doc(ObjectId(), NOW))
+    buffer.enqueue(SmartGateRepository.daily_signin_doc(ObjectId(), NOW))
+    buffer.stop()
+
+    assert repository.insert_signins.call_count == 1
+    assert len(repository.insert_signins.call_args[0][0]) == 2
+
+
+def test_on_flush_receives_inserted_documents(tmp_path):
+    """The flush callback sees only the documents that were inserted."""
+    repository = MagicMock()
+    doc = SmartGateRepository.daily_signin_doc(ObjectId(), NOW)
+    repository.insert_signins.return_value = [doc]
+    on_flush = MagicMock()
+    buffer = _buffer(tmp_path, repository, max_delay=60, on_flush=on_flush)
+    buffer.start()
+    buffer.enqueue(doc)
+    buffer.enqueue(SmartGateRepository.daily_signin_doc(ObjectId(), NOW))
+
+    buffer.flush()
+
+    on_flush.assert_called_once_with(repository, [doc])
+    buffer.stop()
+
+
+def test_failing_on_flush_does_not_stop_the_flusher(tmp_path):
+    """An error in the flush callback is logged and later sign-ins still flush."""
+    repository = MagicMock()
+    repository.insert_signins.side_effect = lambda docs: docs
+    on_flush = MagicMock(side_effect=[RuntimeError("rollups down"), None])
+    buffer = _buffer(
+        tmp_path, repository, max_batch=1, max_delay=0.01, on_flush=on_flush
+    )
+    buffer.start()
+    first = SmartGateRepository.daily_signin_doc(ObjectId(), NOW)
+    buffer.enqueue(first)
+    deadline = time.monotonic() + 5
+    while on_flush.call_count < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    second = SmartGateRepository.daily_signin_doc(ObjectId(), NOW)
+    buffer.enqueue(second)
+    while on_flush.call_count < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert buffer._thread.is_alive()  # pylint: disable=protected-access
+    buffer.stop()
+    assert buffer.stats()["flushed"] == 2
+    assert on_flush.call_args[0][1] == [second]
+
+
+def test_replay_cuts_off_torn_record_before_appending(tmp_path):
+    """A sign-in queued after a torn write survives a second crash."""
+    crashed = _buffer(tmp_path, MagicMock(), max_delay=60)
+    crashed.start()
+    first = SmartGateRepository.daily_signin_doc(ObjectId(), NOW)
+    crashed.enqueue(first)
+    with open(tmp_path / "attendance.wal", "a", encoding="utf-8") as log:
+        log.write('{"_id": "trunc')
+
+    restarted = _buffer(tmp_path, MagicMock(), max_delay=60)
+    restarted.start()
+    second = SmartGateRepository.daily_signin_doc(ObjectId(), NOW)
+    restarted.enqueue(second)
+
+    repository = MagicMock()
+    recovered = _buffer(tmp_path, repository, max_delay=60)
+    recovered.start()
+    recovered.flush()
+
+    repository.insert_signins.assert_called_once_with([first, second])
+    recovered.stop()
+
+
+def test_sign_ins_being_flushed_still_count_as_pending(tmp_path):
+    """A batch mid-insert is still reported, so a repeat is not "first"."""
+    face_id = ObjectId()
+    seen_during_insert = []
+    buffer = None
+
+    def insert_signins(batch):
+        seen_during_insert.extend(buffer.pending_face_ids("2025-04-01"))
+        return batch
+
+    repository = MagicMock()
+    repository.insert_signins.side_effect = insert_signins
+    buffer = _buffer(tmp_path, repository, max_delay=60)
+    buffer.start()
+    buffer.enqueue(SmartGateRepository.daily_signin_doc(face_id, NOW))
+
+    buffer.flush()
+
+    assert seen_during_insert == [face_id]
+    assert not buffer.pending_face_ids("2025-04-01")
+    buffer.stop()
+
+
+def test_enqueue_after_stop_raises(tmp_path):
+    """Queueing on a stopped buffer fails clearly instead of losing the write."""
+    buffer = _buffer(tmp_path, MagicMock(), max_delay=60)
+    buffer.start()
+    buffer.stop()
+
+    doc = SmartGateRepository.daily_signin_doc(ObjectId(), NOW)
+    with pytest.raises(RuntimeError, match="not running"):
+        buffer.enqueue(doc)